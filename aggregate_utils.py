@@ -0,0 +1,323 @@
+"""
+This file contains utilities for precomputed (ORIGIN, DEST) route aggregates that serve per-origin summaries of Flights tab.
+"""
+
+import functools
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+from stats_utils import ColumnStatistics
+
+
+#################################################################################
+
+# Variables
+
+ROUTE_KEYS = ['ORIGIN', 'DEST']
+
+# Aggregates materialized for every route, named '<COLUMN>_<aggregation>'.
+# MEAN_COLS get '_sum', '_count' and '_mean' aggregates.
+FIRST_COLS = ['ORIGIN_CITY', 'DEST_CITY', 'AIRLINE', 'DOT_CODE']
+UNIQUE_COLS = ['AIRLINE', 'AIRLINE_DOT', 'AIRLINE_CODE']
+MEAN_COLS = [
+    'CRS_DEP_TIME', 'DEP_TIME', 'DEP_DELAY', 'TAXI_OUT', 'WHEELS_OFF', 'WHEELS_ON', 'TAXI_IN',
+    'CRS_ARR_TIME', 'ARR_TIME', 'ARR_DELAY', 'CANCELLED', 'DIVERTED',
+    'CRS_ELAPSED_TIME', 'ELAPSED_TIME', 'AIR_TIME', 'DISTANCE'
+]
+
+SAMPLE_SIZE = 1000 # rows of FLIGHTS_SAMPLE
+
+# Columns of FLIGHTS needed to build route index
+ROUTE_INDEX_COLUMNS = list(dict.fromkeys(ROUTE_KEYS + FIRST_COLS + UNIQUE_COLS + MEAN_COLS))
+
+
+#################################################################################
+# Functions
+
+def route_ids(flights: pd.DataFrame) -> tuple:
+    """
+    Id of (ORIGIN, DEST) route of every flight and sorted (ORIGIN, DEST) MultiIndex of all routes.
+
+    Route ids are positions in the returned index.
+    """
+    origins = flights['ORIGIN'].astype('category')
+    dests = flights['DEST'].astype('category')
+    n_dests = len(dests.cat.categories)
+
+    keys = origins.cat.codes.to_numpy().astype('int64') * n_dests + dests.cat.codes.to_numpy()
+    group_ids, keys = pd.factorize(keys, sort = True)
+
+    index = pd.MultiIndex.from_arrays([
+        pd.Categorical.from_codes(keys // n_dests, origins.cat.categories),
+        pd.Categorical.from_codes(keys % n_dests, dests.cat.categories)
+    ], names = ROUTE_KEYS)
+
+    return group_ids, index
+
+
+def group_first(group_ids: np.ndarray, n_groups: int, values: pd.Series) -> np.ndarray:
+    """
+    First non-missing value of every group (like groupby 'first').
+    """
+    valid = np.flatnonzero(values.notna().to_numpy())
+    first_rows = valid[~pd.Series(group_ids[valid]).duplicated().to_numpy()]
+
+    return values.iloc[first_rows].set_axis(group_ids[first_rows]).reindex(range(n_groups)).values
+
+
+def group_sums(group_ids: np.ndarray, n_groups: int, values: pd.Series) -> tuple:
+    """
+    Sum and count of non-missing `values` in every group, in a single vectorized pass (np.bincount).
+    """
+    values = values.to_numpy(dtype = 'float64', na_value = np.nan)
+    present = ~np.isnan(values)
+
+    sums = np.bincount(group_ids, weights = np.where(present, values, 0), minlength = n_groups)
+    counts = np.bincount(group_ids, weights = present, minlength = n_groups).astype('int64')
+
+    return sums, counts
+
+
+def group_unique_joined(group_ids: np.ndarray, n_groups: int, values: pd.Series) -> np.ndarray:
+    """
+    Distinct `values` of every group joined with ', ', in order of their first appearance.
+
+    Equivalent of `', '.join(x.unique())` per group, but without calling Python for every group.
+    """
+    values = values.astype('category')
+    codes = values.cat.codes.to_numpy().astype('int64')
+
+    # first row of every distinct (group, value) pair, ordered by group and then by appearance
+    pairs = pd.Series(group_ids.astype('int64') * (len(values.cat.categories) + 1) + codes)
+    first_rows = np.flatnonzero(~pairs.duplicated().to_numpy() & (codes >= 0))
+    first_rows = first_rows[np.argsort(group_ids[first_rows], kind = 'stable')]
+
+    labels = np.asarray(values.cat.categories.astype(str) + ', ', dtype = object)
+    starts = np.flatnonzero(np.diff(group_ids[first_rows], prepend = -1))
+
+    joined = np.full(n_groups, '', dtype = object)
+    joined[group_ids[first_rows[starts]]] = pd.Series(np.add.reduceat(labels[codes[first_rows]], starts)).str[:-2].to_numpy()
+
+    return joined
+
+
+def split_joined(joined: pd.Series) -> tuple:
+    """
+    Number of values of every ', '-joined list (see `group_unique_joined`) and values of all lists one after another.
+
+    Every distinct list is split only once - routes share a few combinations of airlines.
+    """
+    codes, lists = pd.factorize(joined) # missing list is -1
+    parts = pd.Series(lists, dtype = object).str.split(', ')
+    list_lengths = parts.str.len().to_numpy(dtype = 'int64')
+    list_starts = np.cumsum(list_lengths) - list_lengths
+
+    lengths = np.where(codes >= 0, list_lengths[codes], 0)
+    starts = np.repeat(list_starts[codes] - (np.cumsum(lengths) - lengths), lengths) # shift of value positions of every list
+    values = np.concatenate(parts.to_numpy()) if len(parts) else np.array([], dtype = object)
+
+    return lengths, pd.Series(values[starts + np.arange(lengths.sum())], dtype = object)
+
+
+def add_route_means(routes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Derive '<COLUMN>_mean' aggregates from '<COLUMN>_sum' and '<COLUMN>_count'.
+
+    Means are float64, like pandas groupby mean of flights read from CSV.
+    """
+    means = {}
+    for col in MEAN_COLS:
+        means[f'{col}_mean'] = routes[f'{col}_sum'] / routes[f'{col}_count'].where(routes[f'{col}_count'] > 0)
+
+    return pd.concat([routes.drop(columns = list(means), errors = 'ignore'), pd.DataFrame(means, dtype = 'float64')], axis = 1)
+
+
+def build_route_index(flights: pd.DataFrame) -> pd.DataFrame:
+    """
+    Materialize aggregates of every (ORIGIN, DEST) route.
+
+    All firsts, sums, counts, means and distinct airline lists are computed with vectorized passes
+    over route ids of the rows, without per-route Python callbacks. Returned frame is indexed by sorted
+    (ORIGIN, DEST) MultiIndex, so routes of a single origin are a contiguous slice of it
+    (see `routes_from_origin`). Flights with a missing ORIGIN or DEST belong to no route, like in groupby.
+    """
+    keyed = flights[ROUTE_KEYS].notna().all(axis = 1).to_numpy()
+    if not keyed.all(): # missing key (code -1) would shift the route id into a neighbouring route
+        flights = flights[keyed]
+
+    group_ids, index = route_ids(flights)
+    n_groups = len(index)
+
+    aggregates = {}
+    for col in FIRST_COLS:
+        aggregates[f'{col}_first'] = group_first(group_ids, n_groups, flights[col])
+
+    for col in UNIQUE_COLS:
+        aggregates[f'{col}_unique'] = group_unique_joined(group_ids, n_groups, flights[col])
+
+    for col in MEAN_COLS:
+        sums, counts = group_sums(group_ids, n_groups, flights[col])
+        if is_integer_dtype(flights[col]):
+            sums = sums.astype('int64') # keep integer sums, e.g. number of cancelled flights
+        aggregates[f'{col}_sum'] = sums
+        aggregates[f'{col}_count'] = counts
+
+    routes = pd.DataFrame(aggregates, index = index)
+
+    return add_route_means(routes)
+
+
+def route_index_from_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Route index out of flat frame of route aggregates computed elsewhere (e.g. by a query engine).
+
+    `frame` has ORIGIN and DEST columns and '<COLUMN>_first', '<COLUMN>_unique', '<COLUMN>_sum'
+    and '<COLUMN>_count' aggregates. Result has the same layout as `build_route_index`.
+    """
+    frame = frame.astype({key: str for key in ROUTE_KEYS}).sort_values(ROUTE_KEYS)
+    index = pd.MultiIndex.from_arrays([frame[key].astype('category') for key in ROUTE_KEYS], names = ROUTE_KEYS)
+
+    columns = [f'{col}_first' for col in FIRST_COLS] + [f'{col}_unique' for col in UNIQUE_COLS]
+    columns += [f'{col}_{aggregate}' for col in MEAN_COLS for aggregate in ('sum', 'count')]
+    routes = frame[columns].set_axis(index)
+
+    # dtypes of `build_route_index`
+    routes = routes.astype({f'{col}_first': 'category' for col in FIRST_COLS if not is_integer_dtype(routes[f'{col}_first'])})
+    routes = routes.astype({f'{col}_count': 'int64' for col in MEAN_COLS})
+
+    return add_route_means(routes)
+
+
+def routes_from_origin(routes: pd.DataFrame, origin: str) -> pd.DataFrame:
+    """
+    Get aggregates of all routes from `origin` out of route index.
+
+    Index is sorted, so this is a binary search plus a slice instead of a scan of all flights.
+    """
+    try:
+        return routes.xs(origin, level = 'ORIGIN', drop_level = False)
+    except KeyError:
+        return routes.iloc[:0] # no flights from origin
+
+
+def merge_route_indexes(indexes: list) -> pd.DataFrame:
+    """
+    Merge route indexes built from consecutive chunks of flights into one.
+
+    Result is the same as `build_route_index` of all chunks concatenated: firsts come from the earliest
+    chunk, distinct airline lists keep order of first appearance and sums and counts are added.
+    """
+    combined = pd.concat(indexes).reset_index()
+    combined[ROUTE_KEYS] = combined[ROUTE_KEYS].astype(str) # categories of separate chunks differ
+
+    # routes of a single index keep their aggregates, only routes of several indexes are merged
+    shared = combined.duplicated(ROUTE_KEYS, keep = False).to_numpy()
+    routes = combined[shared]
+
+    group_ids, index = route_ids(routes)
+    n_groups = len(index)
+
+    aggregates = {}
+    for col in FIRST_COLS:
+        aggregates[f'{col}_first'] = group_first(group_ids, n_groups, routes[f'{col}_first'])
+
+    for col in UNIQUE_COLS:
+        lengths, values = split_joined(routes[f'{col}_unique'])
+        aggregates[f'{col}_unique'] = group_unique_joined(np.repeat(group_ids, lengths), n_groups, values)
+
+    for col in MEAN_COLS:
+        sums = np.bincount(group_ids, weights = routes[f'{col}_sum'], minlength = n_groups)
+        if is_integer_dtype(routes[f'{col}_sum']):
+            sums = sums.astype('int64')
+        aggregates[f'{col}_sum'] = sums
+        aggregates[f'{col}_count'] = np.bincount(group_ids, weights = routes[f'{col}_count'], minlength = n_groups).astype('int64')
+
+    merged = pd.DataFrame(aggregates, index = index).reset_index()
+
+    return route_index_from_frame(pd.concat([combined[~shared], merged], ignore_index = True))
+
+
+def aggregate_flights_chunks(chunks, sample_size: int = SAMPLE_SIZE, random_state: int = 2024) -> dict:
+    """
+    Fold chunks of flights into aggregates, keeping only the aggregates in memory:
+
+    - 'routes': route index (see `build_route_index`),
+    - 'statistics': `stats_utils.ColumnStatistics` of every numeric column,
+    - 'sample': uniform random sample of `sample_size` flights,
+    - 'rows': number of flights.
+    """
+    rng = np.random.default_rng(random_state)
+    routes = statistics = sample = sample_keys = None
+    rows = 0
+
+    for chunk in chunks:
+        numeric_cols = list(chunk.select_dtypes(include = ['number']).columns)
+        dtypes = chunk.dtypes.to_dict()
+
+        chunk_routes = build_route_index(chunk)
+        chunk_statistics = ColumnStatistics.from_frame(chunk, numeric_cols)
+
+        if routes is None:
+            routes, statistics = chunk_routes, chunk_statistics
+        else:
+            routes = merge_route_indexes([routes, chunk_routes])
+            statistics = statistics.merge(chunk_statistics)
+
+        # sample = rows with the smallest random keys seen so far
+        chunk_keys = rng.random(len(chunk))
+        candidates = np.argsort(chunk_keys)[:sample_size]
+        if sample is None:
+            sample, sample_keys = chunk.iloc[candidates], chunk_keys[candidates]
+        else:
+            sample = pd.concat([sample, chunk.iloc[candidates]])
+            sample_keys = np.concatenate([sample_keys, chunk_keys[candidates]])
+            kept = np.argsort(sample_keys)[:sample_size]
+            sample, sample_keys = sample.iloc[kept], sample_keys[kept]
+
+        rows += len(chunk)
+
+    # categoricals of separate chunks are merged as plain strings
+    categorical_dtypes = {col: 'category' for col, dtype in dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+    sample = sample.astype(categorical_dtypes)
+
+    return {'routes': routes, 'statistics': statistics, 'sample': sample, 'rows': rows}
+
+
+def merge_samples(samples: list, rows: list, sample_size: int = SAMPLE_SIZE, random_state: int = 2024) -> pd.DataFrame:
+    """
+    Uniform random sample of `sample_size` flights out of uniform samples of disjoint sets of `rows` flights.
+
+    Number of flights drawn from every sample follows multivariate hypergeometric distribution of `rows`,
+    like when sampling all flights at once.
+    """
+    rng = np.random.default_rng(random_state)
+    counts = rng.multivariate_hypergeometric(rows, min(sample_size, sum(rows)))
+
+    sample = pd.concat([part.sample(n = count, random_state = random_state) for part, count in zip(samples, counts)])
+
+    # categoricals of separate samples are merged as plain strings
+    categorical_dtypes = {col: 'category' for col in samples[0].select_dtypes(include = ['category']).columns}
+    return sample.astype(categorical_dtypes)
+
+
+def merge_flights_aggregates(aggregates: list, sample_size: int = SAMPLE_SIZE, random_state: int = 2024) -> dict:
+    """
+    Merge aggregates of disjoint sets of flights (see `aggregate_flights_chunks`), e.g. of loaded flights and of newly
+    appended months, into aggregates of all of them without reading the flights again.
+
+    Only aggregates present in the first of `aggregates` are merged ('sample' needs 'rows' of all of them).
+    """
+    merged = {}
+    if 'routes' in aggregates[0]:
+        merged['routes'] = merge_route_indexes([part['routes'] for part in aggregates])
+    if 'statistics' in aggregates[0]:
+        merged['statistics'] = functools.reduce(ColumnStatistics.merge, [part['statistics'] for part in aggregates])
+    if 'sample' in aggregates[0]:
+        rows = [part['rows'] for part in aggregates]
+        merged['sample'] = merge_samples([part['sample'] for part in aggregates], rows, sample_size, random_state)
+    if 'rows' in aggregates[0]:
+        merged['rows'] = sum(part['rows'] for part in aggregates)
+
+    return merged
@@ -1,52 +1,210 @@
 from shiny.express import ui, input, render, output, expressify, session
-from shinywidgets import render_widget, render_plotly, render_altair
+from shinywidgets import render_widget, render_plotly, render_altair, reactive_read
 from shiny import reactive
+from shiny.session import session_context
+from starlette.responses import JSONResponse
+import asyncio
+import tempfile
 
 
 from utils import *
 from map_utils import *
+from task_utils import run_in_pool, restart_task
+from metrics_utils import METRICS, DIAGNOSTICS_PANEL, ProfileCapture, timed
 
 
-## Altair and dependencies
-import altair as alt
-import anywidget
-import jsonschema
-import toolz
+## Altair and its dependencies (anywidget, jsonschema, toolz) are imported by charts on first render,
+## warm-up imports them in background after startup (see utils.DATA)
 
 
 
 ui.page_opts(title = "U.S Flights", fillable = True)
 
+## Heavy computations run as extended tasks in worker pool (see task_utils), so they do not block the event loop
+## shared by all sessions. Changed inputs restart the task - superseded invocations are dropped and outputs
+## show progress until the result of the latest one arrives.
+
+@reactive.extended_task
+@timed()
+async def summary_task(origin: str, months: tuple, airlines: tuple):
+    # percentiles come from sketches of all flights, the cached summary is not modified
+    return await run_in_pool(lambda: {**summarize_from_origin(filter_routes(origin, months, airlines), origin),
+                                      'percentiles': route_percentiles(origin)})
+
+
+@reactive.extended_task
+@timed()
+async def map_routes_task(origin: str, months: tuple, airlines: tuple, revision: int, network: tuple):
+    # routes summary (or network tables) is cached for layer manager, widgets of the layer are then built in event loop
+    if network is None:
+        await run_in_pool(lambda: summarize_routes_from_origin(filter_routes(origin, months, airlines), origin))
+    else:
+        await run_in_pool(network_summary, origin, network, months, airlines)
+    return origin, months, airlines, revision, network
+
+
+@reactive.extended_task
+@timed()
+async def correlation_task(columns: tuple):
+    return await run_in_pool(correlate_columns, columns)
+
+
+@reactive.extended_task
+@timed()
+async def describe_task(columns: tuple):
+    return await run_in_pool(describe_columns, columns)
+
+
+@reactive.extended_task
+@timed()
+async def distribution_task(var: str, color: str):
+    return var, color, await run_in_pool(distribution_counts, var, None if color == 'None' else color)
+
+
+@reactive.extended_task
+@timed()
+async def density_task(var1: str, var2: str, x_range: tuple, y_range: tuple):
+    # zoom and pan change selection continuously - restarts cancel the sleep, so only the last zoom is computed.
+    # The grid is cached for `density_chart`, the chart is then built in event loop
+    await asyncio.sleep(ZOOM_DEBOUNCE)
+    await run_in_pool(zoomed_density, var1, var2, x_range, y_range)
+    return var1, var2, x_range, y_range
+
+
+@reactive.effect
+@timed()
+def start_flights_tasks():
+    origin = input.origin().split(',')[0]
+    restart_task(summary_task, origin, *flights_filter())
+    restart_task(map_routes_task, origin, *flights_filter(), data_revision(), map_network()) # layers of older data are not reused
+
+
+@reactive.effect
+@timed()
+def start_statistics_tasks():
+    restart_task(correlation_task, tuple(numerical_data().columns))
+    restart_task(describe_task, tuple(numerical_data().columns))
+
+
+@reactive.effect
+@timed()
+def start_distribution_task():
+    data_revision()
+    restart_task(distribution_task, input.distribution_var(), input.distribution_color())
+
+
 @reactive.calc
+@timed()
 def origin_dest_summary():
     """
     Dynamic statistics calculation for ORIGIN -> DEST route.
     """
-    summaries = summarize_from_origin(FLIGHTS, input.origin().split(',')[0])
+    summaries = summary_task.result()
     return summaries
 
 
+@reactive.poll(lambda: DATA.revision, DATA_POLL_INTERVAL)
+def data_revision():
+    """
+    Revision of data, changes when appended flights are published (see `ingest_appended_flights`) - results depending
+    on data are then computed again.
+    """
+    return DATA.revision
+
+
+@reactive.effect
+@reactive.event(data_revision, ignore_init = True)
+@timed()
+def refresh_dataset_inputs():
+    """
+    Show origins and months of appended flights in inputs, selections are kept.
+    """
+    ui.update_select('origin', choices = DATA.ORIGIN_AIRPORTS, selected = input.origin())
+    ui.update_select('destination', choices = DATA.ORIGIN_AIRPORTS, selected = input.destination())
+    ui.update_select('raw_origin', choices = airport_choices(), selected = input.raw_origin())
+    ui.update_select('raw_dest', choices = airport_choices(), selected = input.raw_dest())
+
+    # ranges ending at the last month of data grow with it
+    previous_end, end = months_dates(dataset_months())[1], months_dates(DATA.MONTHS)[1]
+    if str(input.months()[1]) == previous_end:
+        ui.update_date_range('months', end = end)
+    if str(input.raw_dates()[1]) == previous_end:
+        ui.update_date_range('raw_dates', end = end)
+    dataset_months.set(DATA.MONTHS)
+
+
+dataset_months = reactive.value(DATA.MONTHS) # months of data shown in date inputs
+
+
+@reactive.calc
+@timed()
+def flights_filter():
+    """
+    Months ('YYYY-MM' first and last) and airlines (all if empty) of flights summarized in Flights tab.
+    """
+    start, end = input.months()
+    return (str(start)[:7], str(end)[:7]), tuple(input.airlines() or ()) # nothing selected is None
+
+
+@reactive.calc
+@timed()
+def map_network():
+    """
+    Network mode of the map: ('connections', dest, weight), ('hubs',) or None for direct routes from origin.
+    """
+    if input.map_mode() == 'connections':
+        return 'connections', input.destination().split(',')[0], input.path_weight()
+    if input.map_mode() == 'hubs':
+        return ('hubs',)
+    return None
+
+
 @reactive.calc
+@timed()
 def numerical_data():
     """
     Return numerical data of FLIGHTS_SAMPLE dataset.
     """
-    numerical_columns = FLIGHTS_SAMPLE.select_dtypes(include=['number'])
-    numerical_columns = numerical_columns.drop(['CANCELLED', 'DIVERTED', 'DOT_CODE', 'FL_NUMBER'], axis = 1)
+    data_revision()
+    numerical_columns = DATA.FLIGHTS_SAMPLE[NUMERIC_COLS]
 
     return numerical_columns
 
-@reactive.calc
-def flights_data():
+def airport_choices() -> dict:
+    """
+    Choices of airport inputs of Raw data table: {code: 'ORIGIN, ORIGIN_CITY'} with '' for all airports.
+    """
+    return {'': 'All', **{origin.split(',')[0]: origin for origin in DATA.ORIGIN_AIRPORTS}}
+
+def density_chart(var1: str, var2: str, x_range: tuple = None, y_range: tuple = None):
     """
-    Return FLIGHTS_SAMPLE dataset
+    Heatmap of number of flights in cells of `var1` x `var2` grid, binned on server (see `density_grid`).
+    Zooming or panning it ('zoom' selection) recomputes finer grid of the visible area.
     """
-    return FLIGHTS_SAMPLE
+    import altair as alt
+
+    grid = xy_density(var1, var2) if x_range is None else zoomed_density(var1, var2, x_range, y_range)
+    x_scale = alt.Scale(domain = list(x_range)) if x_range is not None else alt.Undefined
+    y_scale = alt.Scale(domain = list(y_range)) if y_range is not None else alt.Undefined
+
+    zoom = alt.selection_interval(name = 'zoom', bind = 'scales')
+    chart = alt.Chart(grid).mark_rect(clip = True).encode( # zoomed grid covers snapped ranges, wider than the view
+        x=alt.X('x:Q', title=var1, scale=x_scale),
+        x2='x_end:Q',
+        y=alt.Y('y:Q', title=var2, scale=y_scale),
+        y2='y_end:Q',
+        color=alt.Color('count:Q', title='Flights', scale=alt.Scale(type='log')),
+        tooltip=[alt.Tooltip('x:Q', title=var1), alt.Tooltip('y:Q', title=var2), alt.Tooltip('count:Q', title='Flights')]
+    ).add_params(zoom)
+
+    return chart
 
 
 
 # Application
 
+first_day, last_day = months_dates(DATA.MONTHS) # range of date inputs
+
 
 ######################################(FLIGHTS TAB)######################################
 with ui.nav_panel('Flights'): 
@@ -56,7 +214,25 @@ with ui.nav_panel('Flights'):
 
         #################################(FLIGHTS.SIDEBAR)
         with ui.sidebar(width = 600):
-            ui.input_select('origin', 'Origin', choices=ORIGIN_AIRPORTS)
+            ui.input_select('origin', 'Origin', choices=DATA.ORIGIN_AIRPORTS)
+
+            @render.text
+            @timed()
+            def flights_status():
+                if map_routes_task.status() == 'running':
+                    return f"Loading routes from {input.origin().split(',')[0]}..."
+                return ''
+
+            with ui.layout_columns():
+                ui.input_date_range('months', 'Months', start = first_day, end = last_day, format = 'yyyy-mm', startview = 'year')
+                ui.input_selectize('airlines', 'Airlines', choices = list(AIRLINE_COLORS), multiple = True,
+                                   options = {'placeholder': 'All airlines'})
+
+            with ui.layout_columns():
+                ui.input_radio_buttons('map_mode', 'Map', choices = MAP_MODES, inline = True)
+                with ui.panel_conditional("input.map_mode === 'connections'"):
+                    ui.input_select('destination', 'Destination', choices = DATA.ORIGIN_AIRPORTS)
+                    ui.input_radio_buttons('path_weight', 'Best path', choices = PATH_WEIGHT_CHOICES, inline = True)
 
             with ui.accordion():
                 ########################################### ORIGIN -> DEST STATISTICS                
@@ -65,12 +241,14 @@ with ui.nav_panel('Flights'):
                         with ui.nav_panel('Airlines'): # Airport info
                             ui.markdown('*Info about airlines for route.*')
                             @render.data_frame
+                            @timed()
                             def airports_summary():
                                 summaries = origin_dest_summary()
                                 return summaries['airports']
                         with ui.nav_panel('DEP/ARR'):
                             ui.markdown('Info about departure/arrival times (minutes).')
                             @render.data_frame
+                            @timed()
                             def times_summary():
                                 summaries = origin_dest_summary()
                                 return summaries['times']
@@ -79,6 +257,7 @@ with ui.nav_panel('Flights'):
                             ui.markdown('*Info about in flight times.*')
 
                             @render.data_frame
+                            @timed()
                             def inflights_summary():
                                 summaries = origin_dest_summary()
                                 return summaries['in_flight_times']
@@ -87,6 +266,7 @@ with ui.nav_panel('Flights'):
                             ui.markdown('*Info about durations and distances.*')
 
                             @render.data_frame
+                            @timed()
                             def duration_distance_summary():
                                 summaries = origin_dest_summary()
 
@@ -96,10 +276,61 @@ with ui.nav_panel('Flights'):
                             ui.markdown('*Sum of cancelled or diverted flights.*')
 
                             @render.data_frame
+                            @timed()
                             def flight_status_summary():
                                 summaries = origin_dest_summary()
 
                                 return summaries['flight_status']
+
+                        with ui.nav_panel('Percentiles'):
+                            ui.markdown('*Percentiles of delays and durations (minutes) of all flights from origin, regardless of months and airlines chosen. '
+                                        'Values are within 2% of the exact ones.*')
+                            ui.input_select('percentile_var', 'Variable', choices = SKETCH_COLUMNS)
+
+                            @render_altair
+                            @timed()
+                            def percentile_histogram():
+                                import altair as alt
+
+                                origin = input.origin().split(',')[0]
+                                data_revision()
+                                histogram, percentiles = origin_distribution(origin, input.percentile_var())
+
+                                bars = alt.Chart(histogram).mark_bar(opacity = 0.7).encode(
+                                    x = alt.X('start:Q', bin = 'binned', title = f'{input.percentile_var()} (up to p99)'),
+                                    x2 = 'end:Q',
+                                    y = alt.Y('count:Q', title = 'Count'),
+                                    tooltip = ['start', 'end', alt.Tooltip('count:Q', title = 'Count')]
+                                )
+                                rules = alt.Chart(percentiles.rename_axis('percentile').reset_index(name = 'value').dropna()).mark_rule(color = 'firebrick').encode(
+                                    x = 'value:Q',
+                                    tooltip = ['percentile', alt.Tooltip('value:Q', format = '.1f')]
+                                )
+
+                                return (bars + rules).properties(height = 200)
+
+                            @render.data_frame
+                            @timed()
+                            def percentiles_summary():
+                                summaries = origin_dest_summary()
+
+                                return summaries['percentiles'].round(1).reset_index()
+
+                ########################################### NETWORK
+                with ui.accordion_panel('Network'):
+                    ui.markdown('*Connections from origin to destination or hubs of the network, as chosen in Map above.*')
+
+                    @render.data_frame
+                    @timed()
+                    def network_table():
+                        origin, months, airlines, _, network = map_routes_task.result()
+                        if network is None:
+                            return None
+
+                        table = network_summary(origin, network, months, airlines)
+                        if network[0] == 'hubs':
+                            table = table.reset_index()
+                        return table.round({'distance': 0, 'delay': 1, 'pagerank': 4})
                 
 
 
@@ -107,15 +338,25 @@ with ui.nav_panel('Flights'):
         #################################(FLIGHTS.MAP WIDGET)
         with ui.card():
             @render_widget
+            @timed()
             def map():
                 m = Map(scroll_wheel_zoom = True, zoom = 3)
+
+                def release_map():
+                    # widgets of the map and its cached layers stay in memory until closed, closing them sends
+                    # messages to the (ended) session of their comms
+                    with session_context(session):
+                        close_layer_manager(m)
+
+                session.on_ended(release_map)
                 
                 return m
             @reactive.effect
+            @timed()
             def update_map():
-                clear_map(map.widget)
-                selected_origin = input.origin().split(',')[0]
-                draw_routes(map.widget, selected_origin)
+                view = map_routes_task.result() # (origin, months, airlines, revision, network) with its tables computed
+                bounds = reactive_read(map.widget, 'bounds') # panning and zooming draws routes reaching the view
+                get_layer_manager(map.widget).show(*view, bounds = bounds) # swaps cached per-view layers
 
 
 
@@ -124,10 +365,53 @@ with ui.nav_panel('Data'):
     with ui.navset_pill():
         #################################(Data.RAW_DATA)
         with ui.nav_panel('Raw data'): 
+            with ui.layout_columns():
+                ui.input_select('raw_origin', 'Origin', choices = airport_choices())
+                ui.input_select('raw_dest', 'Destination', choices = airport_choices())
+                ui.input_select('raw_airline', 'Airline', choices = ['All'] + list(AIRLINE_COLORS))
+                ui.input_date_range('raw_dates', 'Dates', start = first_day, end = last_day)
+            with ui.layout_columns():
+                ui.input_select('raw_sort', 'Sort by', choices = ['None'] + FLIGHTS_COLUMNS)
+                ui.input_radio_buttons('raw_order', 'Order', choices = {'asc': 'Ascending', 'desc': 'Descending'}, inline = True)
+                ui.input_numeric('raw_page', 'Page', value = 1, min = 1)
+
             with ui.card():
+                @render.text
+                @timed()
+                def raw_data_info():
+                    page, total = raw_data_page()
+                    first = (raw_page_number() - 1) * PAGE_SIZE
+                    return f'Flights {min(first + 1, total):,} - {first + len(page):,} of {total:,}'
+
                 @render.data_frame
+                @timed()
                 def raw_data():
-                    return FLIGHTS_SAMPLE
+                    page, total = raw_data_page()
+                    return page
+
+            @reactive.calc
+            @timed()
+            def raw_page_number():
+                return max(int(input.raw_page() or 1), 1)
+
+            @reactive.calc
+            @timed()
+            def raw_data_page():
+                """
+                Visible page of Raw data table - filtered, sorted and paged on server over all flights.
+                """
+                data_revision()
+                filters = [('FL_DATE', '>=', str(input.raw_dates()[0])), ('FL_DATE', '<=', str(input.raw_dates()[1]))]
+                if input.raw_origin():
+                    filters.append(('ORIGIN', '==', input.raw_origin()))
+                if input.raw_dest():
+                    filters.append(('DEST', '==', input.raw_dest()))
+                if input.raw_airline() != 'All':
+                    filters.append(('AIRLINE', '==', input.raw_airline()))
+
+                sort_by = None if input.raw_sort() == 'None' else input.raw_sort()
+
+                return flights_page(tuple(filters), sort_by, input.raw_order() == 'asc', raw_page_number())
                 
 
 
@@ -140,9 +424,11 @@ with ui.nav_panel('Data'):
                     #################################(Data.STATICSTICS.CORRELATIONS)
                     with ui.accordion_panel('Correlations'):
                         @render_widget
+                        @timed()
                         def corr_mat():
-                            numerical_columns = numerical_data()  # Assuming numerical_data() returns your dataset
-                            correlation_matrix = numerical_columns.corr().round(3)
+                            import altair as alt
+
+                            correlation_matrix = correlation_task.result().round(3) # shared by all sessions
                             
                             # Flatten the correlation matrix for Altair heatmap
                             corr_flat = pd.DataFrame(correlation_matrix.stack(), columns=['correlation']).reset_index()
@@ -163,17 +449,23 @@ with ui.nav_panel('Data'):
                     #################################(Data.STATICSTICS.DESCRIPTIVE_STATISTICS)
                     with ui.accordion_panel('Descriptive statistics'):
                         @render.data_frame
+                        @timed()
                         def descriptive_stats():
-                            numerical_columns = numerical_data()
-                            summary_stats = numerical_columns.describe()
-                            stat_names = summary_stats.index
-
-                            summary_stats['Statistic'] = stat_names
-
-                            summary_stats = summary_stats[['Statistic'] + summary_stats.columns[:-1].tolist()]
+                            # cached result is shared by all sessions - add Statistic column to a copy
+                            summary_stats = describe_task.result().rename_axis('Statistic').reset_index()
                         
                             return summary_stats                   
 
+                    #################################(Data.STATICSTICS.AIRLINE_PERCENTILES)
+                    with ui.accordion_panel('Airline percentiles'):
+                        ui.markdown('*Percentiles of delays and durations (minutes) of all flights of every airline.*')
+
+                        @render.data_frame
+                        @timed()
+                        def airline_percentiles_table():
+                            data_revision()
+                            return airline_percentiles().round(1).reset_index()
+
         #################################(Data.INTARRACTIONS)     
         with ui.nav_panel('Interractions'):
             with ui.layout_columns():
@@ -183,16 +475,53 @@ with ui.nav_panel('Data'):
             
             with ui.card():
                 @render_altair
+                @timed()
                 def xy_plot():
-                    numericals = numerical_data()
+                    import altair as alt
+
+                    data_revision()
+                    var1, var2 = input.var1(), input.var2()
+                    # one Vega point per flight only for small data, density grid otherwise
+                    if xy_point_count(var1, var2) > XY_POINTS_THRESHOLD:
+                        return density_chart(var1, var2)
+
+                    numericals = xy_points(var1, var2)
                     chart = alt.Chart(numericals).mark_point().encode(
-                        x=input.var1(),
-                        y=input.var2(),
-                        tooltip=[input.var1(), input.var2()]  # Define tooltips for variables var1 and var2
+                        x=var1,
+                        y=var2,
+                        tooltip=[var1, var2]  # Define tooltips for variables var1 and var2
                     ).interactive()  # Enable interactivity (zoom, pan, etc.)
 
                     return chart
 
+                @reactive.effect
+                @timed()
+                def refine_xy_density():
+                    widget = xy_plot.widget
+                    if widget is None:
+                        return
+
+                    # selections are replaced together with chart - depend on both
+                    selections = reactive_read(widget, 'selections')
+                    if 'zoom' not in selections.trait_names():
+                        return # scatter plot
+                    zoom = reactive_read(selections, 'zoom').value
+
+                    if 'x' in zoom and 'y' in zoom:
+                        with reactive.isolate():
+                            var1, var2 = input.var1(), input.var2()
+                        restart_task(density_task, var1, var2, tuple(zoom['x']), tuple(zoom['y']))
+
+                @reactive.effect
+                @timed()
+                def show_xy_density():
+                    var1, var2, x_range, y_range = density_task.result()
+                    with reactive.isolate():
+                        if (var1, var2) != (input.var1(), input.var2()) or xy_plot.widget is None:
+                            return # variables changed while the grid was computed
+
+                    xy_plot.widget.chart = density_chart(var1, var2, x_range, y_range)
+
 
 
 
@@ -202,64 +531,35 @@ with ui.nav_panel('Data'):
         with ui.nav_panel('Distributions'):
             with ui.layout_columns():
                 with ui.card():
-                    ui.input_select('distribution_var', 'Select variable', choices=list(FLIGHTS.columns))
+                    ui.input_select('distribution_var', 'Select variable', choices=FLIGHTS_COLUMNS)
                 with ui.card():
                     ui.input_select('distribution_color', 'Color by', choices=['None', 'AIRLINE', 'ORIGIN_CITY', 'DEST_CITY'])
 
             with ui.card():
                 @render_altair
+                @timed()
                 def histogram_or_barplot():
-                    var = input.distribution_var()
-                    color = input.distribution_color()
-                    data = flights_data()  # Assuming flights_data() returns your dataset
-                    
-                    if color != 'None':
-                        if color != var:
-                            data = data[[var, color]]
-                            if is_numeric_dtype(data[var]):
-                                chart = alt.Chart(data).mark_bar(opacity=0.7).encode(
-                                    x=alt.X(var, bin=alt.Bin(maxbins=30)),
-                                    y='count()',
-                                    color=alt.Color(color, legend=alt.Legend(title=color)),
-                                    tooltip=[var, alt.Tooltip('count()', title='Count')]
-                                )
-                            else:
-                                chart = alt.Chart(data).mark_bar().encode(
-                                    x=var,
-                                    y='count()',
-                                    color=alt.Color(color, legend=alt.Legend(title=color)),
-                                    tooltip=[var, alt.Tooltip('count()', title='Count')]
-                                )
-                        else:
-                            data = data[[var]]
-                            if is_numeric_dtype(data[var]):
-                                chart = alt.Chart(data).mark_bar(opacity=0.7).encode(
-                                    x=alt.X(var, bin=alt.Bin(maxbins=30)),
-                                    y='count()',
-                                    color=alt.Color(var, legend=alt.Legend(title=var)),
-                                    tooltip=[var, alt.Tooltip('count()', title='Count')]
-                                )
-                            else:
-                                chart = alt.Chart(data).mark_bar().encode(
-                                    x=var,
-                                    y='count()',
-                                    color=alt.Color(var, legend=alt.Legend(title=var)),
-                                    tooltip=[var, alt.Tooltip('count()', title='Count')]
-                                )
+                    import altair as alt
+
+                    # bins and counts over all flights are computed on server (cached per var and color)
+                    var, color, data = distribution_task.result()
+
+                    if FLIGHTS_DTYPES[var] != 'category':
+                        x = alt.X(f'{var}:Q', bin = 'binned', title = var)
+                        encoding = {'x': x, 'x2': f'{var}_end:Q'}
+                        mark = {'opacity': 0.7}
                     else:
-                        data = data[[var]]
-                        if is_numeric_dtype(data[var]):
-                            chart = alt.Chart(data).mark_bar(opacity=0.7).encode(
-                                x=alt.X(var, bin=alt.Bin(maxbins=30)),
-                                y='count()',
-                                tooltip=[var, alt.Tooltip('count()', title='Count')]
-                            )
-                        else:
-                            chart = alt.Chart(data).mark_bar().encode(
-                                x=var,
-                                y='count()',
-                                tooltip=[var, alt.Tooltip('count()', title='Count')]
-                            )
+                        encoding = {'x': f'{var}:N'}
+                        mark = {}
+
+                    if color != 'None':
+                        encoding['color'] = alt.Color(f'{color}:N', legend=alt.Legend(title=color))
+
+                    chart = alt.Chart(data).mark_bar(**mark).encode(
+                        y=alt.Y('count:Q', title='Count', stack=True),
+                        tooltip=[var, alt.Tooltip('count:Q', title='Count')],
+                        **encoding
+                    )
                     
                     # Add interactive selection
                     selection = alt.selection_multi(fields=[color], bind='legend')
@@ -270,6 +570,76 @@ with ui.nav_panel('Data'):
                         
 
 
+######################################(DIAGNOSTICS TAB)######################################
+if DIAGNOSTICS_PANEL: # enabled with FLIGHTS_DIAGNOSTICS=1
+    with ui.nav_panel('Diagnostics'):
+        profile = ProfileCapture() # opt-in cProfile capture of this session
+        _ = session.on_ended(profile.stop) # a capture left running would block profiling of the process
+
+        def metrics_snapshot() -> dict:
+            return {'metrics': METRICS.snapshot(), 'cache': RESULT_CACHE.stats(), 'load_s': dict(DATA.timings)}
+
+        async def metrics_endpoint(request):
+            return JSONResponse(metrics_snapshot())
+
+        with ui.layout_columns():
+            ui.input_action_button('diagnostics_refresh', 'Refresh')
+            ui.input_action_button('profile_start', 'Start profiling')
+            ui.input_action_button('profile_stop', 'Stop profiling')
+
+            @render.ui
+            def metrics_link():
+                # machine-readable metrics of the process for scripts and monitoring
+                return ui.a('Metrics JSON', href = session.dynamic_route('metrics', metrics_endpoint), target = '_blank')
+
+        with ui.layout_columns(col_widths = [9, 3]):
+            with ui.card():
+                ui.card_header('Latencies and payloads of functions')
+
+                @render.data_frame
+                def diagnostics_functions():
+                    input.diagnostics_refresh()
+                    return METRICS.frame()
+
+            with ui.card():
+                ui.card_header('Result cache and loading')
+
+                @render.table
+                def diagnostics_cache():
+                    input.diagnostics_refresh()
+                    stats = {**RESULT_CACHE.stats(), **{f'{name} loaded in (s)': round(seconds, 3) for name, seconds in DATA.timings.items()}}
+                    return pd.DataFrame({'metric': list(stats), 'value': [str(value) for value in stats.values()]})
+
+        with ui.card():
+            ui.card_header('Profile')
+
+            @reactive.effect
+            @reactive.event(input.profile_start)
+            def start_profile():
+                if not profile.start():
+                    ui.notification_show('Other profile capture of this process is running.', type = 'warning')
+
+            @reactive.effect
+            @reactive.event(input.profile_stop)
+            def stop_profile():
+                profile.stop()
+
+            @render.code
+            def profile_report():
+                input.profile_stop()
+                return profile.report() or 'Start profiling, use the app and stop profiling to see where the time goes.'
+
+            @render.download(filename = 'profile.prof')
+            def profile_download():
+                if profile.stats is None:
+                    ui.notification_show('Nothing captured yet - start and stop profiling first.', type = 'warning')
+                    return
+                with tempfile.NamedTemporaryFile(suffix = '.prof') as f:
+                    profile.dump(f.name)
+                    with open(f.name, 'rb') as capture:
+                        yield capture.read()
+
+
 ui.nav_spacer()
 
 
@@ -277,7 +647,7 @@ ui.nav_spacer()
 with ui.nav_panel('Data description'):
     ui.markdown(f'Dataset used for this aplication is a sample of [Flight Delay and Cancellation Dataset (2019-2023)]({DATASET_SOURCE}). On the table below you can find description of individual columns:')
     with ui.card():
-        ui.markdown(DESCRIPTION_HTML)
+        ui.markdown(DATA.DESCRIPTION_HTML)
 
 
 
@@ -0,0 +1,226 @@
+"""
+This file contains benchmarks of hot paths of the application over synthetic flights (see synthetic_utils).
+
+Usage:
+
+    python benchmark.py --size 1m [--engine duckdb] [--loading streaming] [--repeat 5] [--check]
+
+Flights of the requested size are generated once into `dataset/synthetic/<size>` and the application data
+is loaded from there. Every run is appended to benchmark history (`dataset/synthetic/benchmark_history.jsonl`)
+and compared with the previous run of the same size, engine and loading on the same machine - slower results
+beyond the tolerance are reported as regressions (`--check` makes them fail the run).
+"""
+
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from synthetic_utils import SYNTHETIC_SIZES, ensure_synthetic_store
+
+
+#################################################################################
+
+# Variables
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+SYNTHETIC_DIR = DIR_PATH + '/dataset/synthetic' # stores of synthetic flights, one per size
+BENCHMARK_HISTORY = SYNTHETIC_DIR + '/benchmark_history.jsonl' # one JSON record per run, kept next to the stores it measures
+
+BENCHMARK_REPEAT = 5 # timed calls of every benchmark, the fastest one is compared
+REGRESSION_TOLERANCE = 0.25 # relative slowdown reported as regression
+REGRESSION_FLOOR_MS = 1.0 # differences below this are noise
+
+
+#################################################################################
+# Functions
+
+def load_app(store_path: str, engine: str, loading: str):
+    """
+    Import application modules with data loaded from `store_path`. Settings of utils are read from environment
+    at import, so they are set first.
+    """
+    os.environ['FLIGHTS_CSV'] = store_path + '.csv' # not present - the store is used as is
+    os.environ['FLIGHTS_STORE'] = store_path
+    os.environ['FLIGHTS_ENGINE'] = engine
+    os.environ['FLIGHTS_LOADING'] = loading
+    os.environ['FLIGHTS_SHARED'] = store_path + '_shared'
+
+    utils = importlib.import_module('utils')
+    map_utils = importlib.import_module('map_utils')
+
+    for name in ['ENGINE', 'ROUTES', 'CUBE', 'STATISTICS', 'ORIGIN_AIRPORTS', 'AIRPORT_COORDS', 'AIRPORT_GRID', 'SKETCHES']:
+        getattr(utils.DATA, name) # wait until warm-up loads values, so it does not run during benchmarks
+
+    return utils, map_utils
+
+
+def app_benchmarks(utils, map_utils) -> dict:
+    """
+    Benchmarks {name: function without arguments} of hot paths of the application.
+    """
+    from ipyleaflet import Map
+
+    data = utils.DATA
+    routes = data.ROUTES
+
+    # busiest origin and the origin in the middle of the ranking
+    flights_per_origin = routes['CRS_DEP_TIME_count'].groupby(level = 'ORIGIN', observed = True).sum().sort_values(ascending = False)
+    hub, regional = str(flights_per_origin.index[0]), str(flights_per_origin.index[len(flights_per_origin) // 2])
+    airline = str(routes.xs(hub, level = 'ORIGIN')['AIRLINE_first'].iloc[0])
+
+    airports = data.AIRPORT_COORDS.index.to_series().sample(1000, replace = True, random_state = 2024).tolist()
+    numeric = tuple(utils.NUMERIC_COLS)
+
+    def lookup_coords():
+        for airport in airports:
+            try:
+                utils.get_coords(data.AIRPORT_COORDS, airport)
+            except KeyError:
+                pass
+
+    return {
+        'summarize_from_origin[hub]': lambda: utils.summarize_from_origin(routes, hub),
+        'summarize_from_origin[regional]': lambda: utils.summarize_from_origin(routes, regional),
+        'summarize_routes_from_origin[hub]': lambda: utils.summarize_routes_from_origin(routes, hub),
+        'filter_routes[hub, year, airline]': lambda: utils.filter_routes(hub, ('2022-01', '2022-12'), (airline,)),
+        'get_coords[1000 airports]': lookup_coords,
+        'nearby_airports[hub, 50 miles]': lambda: utils.nearby_airports(hub),
+        'AirportGrid.in_bounds[contiguous US]': lambda: data.AIRPORT_GRID.in_bounds(((24, -125), (50, -66))),
+        'load_origin_airports': utils.load_origin_airports,
+        'draw_routes[hub]': lambda: map_utils.draw_routes(Map(), hub),
+        'find_connections[regional, hub]': lambda: utils.find_connections(regional, hub),
+        'find_path[regional, hub, delay]': lambda: utils.find_path(regional, hub, 'delay'),
+        'hub_centrality': lambda: utils.hub_centrality(),
+        'route_percentiles[hub]': lambda: utils.route_percentiles(hub),
+        'origin_distribution[hub, ARR_DELAY]': lambda: utils.origin_distribution(hub, 'ARR_DELAY'),
+        'describe_columns': lambda: utils.describe_columns(numeric),
+        'correlate_columns': lambda: utils.correlate_columns(numeric),
+        'distribution_counts[DEP_DELAY]': lambda: utils.distribution_counts('DEP_DELAY'),
+        'distribution_counts[DEP_DELAY, AIRLINE]': lambda: utils.distribution_counts('DEP_DELAY', 'AIRLINE'),
+        'xy_density[DEP_DELAY, ARR_DELAY]': lambda: utils.xy_density('DEP_DELAY', 'ARR_DELAY'),
+        'flights_page[sorted by ARR_DELAY]': lambda: utils.flights_page((), 'ARR_DELAY', False, 1)
+    }
+
+
+def time_benchmark(function, cache, repeat: int = BENCHMARK_REPEAT) -> dict:
+    """
+    Fastest and median time (ms) of `repeat` calls of `function`, each with empty result cache.
+    """
+    times = []
+    for _ in range(repeat):
+        cache.clear()
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {'min_ms': round(min(times), 3), 'median_ms': round(statistics.median(times), 3)}
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd = DIR_PATH, capture_output = True,
+                              text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_history(history_path: str) -> list:
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_run(history: list, run: dict) -> dict:
+    """
+    Latest run of history comparable with `run`: same size, engine, loading and machine.
+    """
+    keys = ['size', 'engine', 'loading', 'machine']
+    for record in reversed(history):
+        if all(record.get(key) == run[key] for key in keys):
+            return record
+    return None
+
+
+def compare_runs(previous: dict, run: dict, tolerance: float = REGRESSION_TOLERANCE) -> pd.DataFrame:
+    """
+    Fastest times of benchmarks of `run` against `previous` run, with regressions flagged.
+    """
+    rows = []
+    for name, result in run['results'].items():
+        before = (previous or {}).get('results', {}).get(name, {}).get('min_ms', np.nan)
+        after = result['min_ms']
+        regression = after > before * (1 + tolerance) and after - before > REGRESSION_FLOOR_MS
+        rows.append({'benchmark': name, 'previous_ms': before, 'min_ms': after, 'median_ms': result['median_ms'],
+                     'change': after / before - 1 if before else np.nan, 'regression': regression})
+
+    return pd.DataFrame(rows).set_index('benchmark')
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description = 'Benchmark hot paths of the application over synthetic flights.')
+    parser.add_argument('--size', default = '10k', help = f"number of flights, one of {', '.join(SYNTHETIC_SIZES)} or a number")
+    parser.add_argument('--engine', default = 'pandas', choices = ['pandas', 'polars', 'duckdb'])
+    parser.add_argument('--loading', default = 'memory', choices = ['memory', 'shared', 'streaming'])
+    parser.add_argument('--repeat', type = int, default = BENCHMARK_REPEAT)
+    parser.add_argument('--history', default = BENCHMARK_HISTORY, help = 'JSON lines file of recorded runs')
+    parser.add_argument('--tolerance', type = float, default = REGRESSION_TOLERANCE)
+    parser.add_argument('--no-record', action = 'store_true', help = 'do not append this run to history')
+    parser.add_argument('--check', action = 'store_true', help = 'exit with status 1 on regression')
+    args = parser.parse_args(argv)
+
+    rows = SYNTHETIC_SIZES[args.size] if args.size in SYNTHETIC_SIZES else int(args.size)
+    store_path = f'{SYNTHETIC_DIR}/{args.size}'
+
+    start = time.perf_counter()
+    ensure_synthetic_store(rows, store_path)
+    print(f'Synthetic store of {rows:,} flights ready in {time.perf_counter() - start:.1f} s')
+
+    utils, map_utils = load_app(store_path, args.engine, args.loading)
+    results = {}
+    for name, function in app_benchmarks(utils, map_utils).items():
+        results[name] = time_benchmark(function, utils.RESULT_CACHE, args.repeat)
+
+    run = {
+        'time': datetime.datetime.now().isoformat(timespec = 'seconds'),
+        'commit': git_commit(),
+        'size': args.size,
+        'rows': rows,
+        'engine': args.engine,
+        'loading': args.loading,
+        'machine': platform.node(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'load_s': {name: round(seconds, 3) for name, seconds in utils.DATA.timings.items()},
+        'results': results
+    }
+
+    history = read_history(args.history)
+    comparison = compare_runs(previous_run(history, run), run, args.tolerance)
+
+    print('Loading (s):', ', '.join(f'{name} {seconds}' for name, seconds in run['load_s'].items()))
+    print(comparison.to_string(float_format = '{:.3f}'.format))
+
+    if not args.no_record:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run) + '\n')
+
+    regressions = comparison.index[comparison['regression']].tolist()
+    if regressions:
+        print('Regressions:', ', '.join(regressions))
+
+    return 1 if regressions and args.check else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
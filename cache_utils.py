@@ -0,0 +1,160 @@
+"""
+This file contains process-wide memoization of results shared by all sessions of the application.
+
+Every Shiny session runs its own reactive calcs, so without a shared cache the same summary of an origin
+is computed once per session. `ResultCache` keeps results keyed by function and arguments in a size-bounded
+LRU, drops everything when dataset version changes and counts hits and misses.
+"""
+
+import functools
+import threading
+from collections import OrderedDict
+
+
+#################################################################################
+
+# Variables
+
+RESULT_CACHE_SIZE = 256 # results kept by RESULT_CACHE
+
+
+#################################################################################
+# Cache
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of function results tagged with dataset version.
+
+    Concurrent requests for the same missing key wait for the first one instead of computing it again.
+    """
+    def __init__(self, maxsize: int = RESULT_CACHE_SIZE, version = None):
+        self.maxsize = maxsize
+        self.version = version
+        self.entries = OrderedDict()
+        self.pending = {} # key -> threading.Event of computation in progress
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def set_version(self, version) -> None:
+        """
+        Set dataset version, dropping all results computed for any other version.
+        """
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def get_or_compute(self, key, compute):
+        """
+        Result stored under `key`, calling `compute()` and storing its result on miss.
+        """
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return self.entries[key]
+
+                event = self.pending.get(key)
+                if event is None:
+                    self.pending[key] = threading.Event()
+                    self.misses += 1
+                    version = self.version
+                    break
+
+            event.wait() # computed by other thread - look it up again
+
+        try:
+            result = compute()
+        finally:
+            with self.lock:
+                self.pending.pop(key).set()
+
+        with self.lock:
+            if version == self.version: # do not store results of outdated dataset
+                self.entries[key] = result
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last = False)
+                    self.evictions += 1
+
+        return result
+
+    def stats(self) -> dict:
+        """
+        Counters of the cache.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'version': self.version,
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+class IdentityKey:
+    """
+    Key of unhashable argument (e.g. frame) by its identity. The key holds the argument, so that its id
+    cannot be reused by another object while the result is cached.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, IdentityKey) and other.value is self.value
+
+
+#################################################################################
+# Functions
+
+def cache_key_part(value):
+    """
+    Hashable stand-in of argument. Unhashable arguments (frames of the dataset, route aggregates rolled up
+    for filters) are keyed by identity.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(cache_key_part(item) for item in value)
+    try:
+        hash(value)
+    except TypeError:
+        return IdentityKey(value)
+    return value
+
+
+def cached(cache: ResultCache):
+    """
+    Decorator memoizing function in `cache`, keyed by function and its arguments.
+
+    Cached results are shared - callers must not modify them in place.
+    """
+    def decorator(function):
+        name = f'{function.__module__}.{function.__qualname__}'
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (name, cache_key_part(args), cache_key_part(tuple(sorted(kwargs.items()))))
+            return cache.get_or_compute(key, lambda: function(*args, **kwargs))
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
+
+
+RESULT_CACHE = ResultCache() # shared by all sessions of the process
@@ -0,0 +1,112 @@
+"""
+This file contains lazily loaded data context of the application.
+
+Values of the context (flights, route index, statistics...) are registered as loaders and computed on first access,
+so that importing application modules is cheap. `warm_up` computes them in a background thread right after the server
+boots - sessions that need a value before it is ready wait only for that value.
+"""
+
+import atexit
+import importlib
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+WARM_UP_EXIT_TIMEOUT = 5.0 # seconds the interpreter waits at exit for the value being loaded by warm-up
+
+
+#################################################################################
+# Context
+
+class LazyContext:
+    """
+    Named values computed by their loaders once, on first access as attributes (e.g. `DATA.ROUTES`).
+
+    Loading is thread-safe: a value is computed by a single thread, others wait for it.
+    """
+    def __init__(self):
+        self._loaders = {}
+        self._values = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+        self.timings = {} # name -> seconds spent in loader
+        self.revision = 0 # number of `publish` calls, sessions poll it to pick up published values
+
+    def register(self, name: str, loader) -> None:
+        """
+        Register `loader` (function without arguments) computing value `name`.
+        """
+        self._loaders[name] = loader
+        self._locks[name] = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._loaders
+
+    def __getattr__(self, name: str):
+        if name.startswith('_') or name not in self._loaders:
+            raise AttributeError(name)
+
+        with self._locks[name]:
+            if name not in self._values:
+                start = time.perf_counter()
+                self._values[name] = self._loaders[name]()
+                self.timings[name] = time.perf_counter() - start
+                logger.info('Loaded %s in %.2f s', name, self.timings[name])
+
+        return self._values[name]
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._values
+
+    def reset(self, names: list = None) -> None:
+        """
+        Forget loaded values (all of them by default), they are loaded again on next access.
+        """
+        with self._lock:
+            for name in (names if names is not None else list(self._values)):
+                self._values.pop(name, None)
+
+    def publish(self, values: dict) -> None:
+        """
+        Replace loaded values with new ones at once (e.g. data merged with newly appended flights).
+        """
+        with self._lock:
+            self._values.update(values)
+            self.revision += 1
+
+    def warm_up(self, names: list = None, imports: list = (), hooks: list = ()) -> threading.Thread:
+        """
+        Load values `names` (all registered by default) and import modules `imports` in a daemon thread.
+        Functions `hooks` are called right after the imports.
+        """
+        names = list(self._loaders) if names is None else names
+        stopped = threading.Event()
+
+        def run():
+            for module in imports:
+                importlib.import_module(module)
+            for hook in hooks:
+                hook()
+            for name in names:
+                if stopped.is_set():
+                    return
+                try:
+                    getattr(self, name)
+                except Exception:
+                    # failure is raised again to the session that accesses the value
+                    logger.exception('Warm-up of %s failed', name)
+
+        def stop():
+            # no value is started at exit and a short query being loaded may finish, long loaders (conversion
+            # of CSV into the store) do not hold up the exit - the store is swapped into place only when complete
+            stopped.set()
+            thread.join(WARM_UP_EXIT_TIMEOUT)
+
+        thread = threading.Thread(target = run, name = 'data-warm-up', daemon = True)
+        thread.start()
+        atexit.register(stop)
+
+        return thread
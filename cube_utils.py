@@ -0,0 +1,172 @@
+"""
+This file contains utilities for aggregate cube of flights over ORIGIN x DEST x AIRLINE x MONTH.
+
+Cells of the cube hold number of flights, sums and counts of MEAN_COLS and the row of their first flight, so that
+route aggregates of any range of months and set of airlines are rolled up from cells of the origin instead of scanning
+flights again.
+"""
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+
+from aggregate_utils import UNIQUE_COLS, MEAN_COLS, route_ids, group_first, group_unique_joined, add_route_means, routes_from_origin
+
+
+#################################################################################
+
+# Variables
+
+CUBE_KEYS = ['ORIGIN', 'DEST', 'AIRLINE', 'MONTH'] # MONTH is 'YYYY-MM' of FL_DATE
+AIRLINE_INFO_COLS = ['AIRLINE_DOT', 'AIRLINE_CODE', 'DOT_CODE'] # attributes of airline, joined to cells on roll-up
+
+# Columns of FLIGHTS needed to build cube
+CUBE_COLUMNS = ['ORIGIN', 'DEST', 'AIRLINE', 'FL_DATE'] + AIRLINE_INFO_COLS + MEAN_COLS
+
+
+#################################################################################
+# Functions
+
+def flight_months(dates: pd.Series) -> pd.Categorical:
+    """
+    'YYYY-MM' month of every 'YYYY-MM-DD' date, computed once per distinct date (missing for missing date).
+    """
+    dates = dates.astype('category')
+    months = pd.Categorical(dates.cat.categories.astype(str).str[:7])
+    codes = dates.cat.codes.to_numpy()
+
+    return pd.Categorical.from_codes(np.where(codes >= 0, months.codes[codes], -1), months.categories)
+
+
+def build_cube(flights: pd.DataFrame, start_row: int = 0) -> pd.DataFrame:
+    """
+    Non-empty cells of `flights` indexed by sorted (ORIGIN, DEST, AIRLINE, MONTH) with number of flights ('FLIGHTS'),
+    '<COLUMN>_sum', '<COLUMN>_count' aggregates of MEAN_COLS and row of the first flight of the cell in the dataset
+    ('FIRST_ROW', rows of `flights` start at `start_row`), computed with vectorized passes like route index.
+    Flights with a missing key belong to no cell.
+    """
+    keys = [flights[col].astype('category').array for col in CUBE_KEYS[:-1]] + [flight_months(flights['FL_DATE'])]
+
+    # missing key has code -1, which would shift the cell key into a neighbouring cell
+    rows = np.flatnonzero(np.logical_and.reduce([key.codes >= 0 for key in keys]))
+    keys = [key.take(rows) for key in keys]
+
+    # cell key of every flight out of codes of its keys
+    cell_keys = np.zeros(len(rows), dtype = 'int64')
+    for key in keys:
+        cell_keys = cell_keys * len(key.categories) + key.codes
+    cell_ids, cell_keys = pd.factorize(cell_keys, sort = True)
+    n_cells = len(cell_keys)
+
+    levels = []
+    for key in reversed(keys):
+        levels.insert(0, pd.Categorical.from_codes(cell_keys % len(key.categories), key.categories.astype(str)))
+        cell_keys = cell_keys // len(key.categories)
+
+    cells = {'FLIGHTS': np.bincount(cell_ids, minlength = n_cells), 'FIRST_ROW': start_row + rows[np.unique(cell_ids, return_index = True)[1]]}
+    for col in MEAN_COLS:
+        values = flights[col].to_numpy(dtype = 'float64', na_value = np.nan)[rows]
+        present = ~np.isnan(values)
+        sums = np.bincount(cell_ids, weights = np.where(present, values, 0), minlength = n_cells)
+        cells[f'{col}_sum'] = sums.astype('int64') if is_integer_dtype(flights[col]) else sums
+        cells[f'{col}_count'] = np.bincount(cell_ids, weights = present, minlength = n_cells).astype('int64')
+
+    return pd.DataFrame(cells, index = pd.MultiIndex.from_arrays(levels, names = CUBE_KEYS))
+
+
+def merge_cubes(cubes: list) -> pd.DataFrame:
+    """
+    Merge cubes built from separate chunks of flights, adding aggregates of cells present in several of them
+    (the first row of a cell is the smallest one).
+    """
+    combined = pd.concat(cubes)
+    combined.index = combined.index.set_levels([level.astype(str) for level in combined.index.levels])
+
+    # cells of a single cube (e.g. of newly appended months) are only sorted in
+    shared = combined.index.duplicated(keep = False)
+    groups = combined[shared].groupby(level = CUBE_KEYS, sort = True)
+    merged = groups.sum().assign(FIRST_ROW = groups['FIRST_ROW'].min())
+
+    return pd.concat([combined[~shared], merged]).sort_index()
+
+
+def airline_info(flights: pd.DataFrame) -> pd.DataFrame:
+    """
+    First AIRLINE_DOT, AIRLINE_CODE and DOT_CODE of every airline, indexed by AIRLINE.
+    """
+    info = flights[['AIRLINE'] + AIRLINE_INFO_COLS].dropna(subset = ['AIRLINE']).drop_duplicates('AIRLINE')
+    return info.astype({'AIRLINE': str}).set_index('AIRLINE')
+
+
+def aggregate_cube_chunks(chunks, start_row: int = 0) -> dict:
+    """
+    Fold chunks of flights (with CUBE_COLUMNS, in order of the dataset from row `start_row`) into:
+
+    - 'cube': cells of all flights (see `build_cube`),
+    - 'airlines': attributes of every airline (see `airline_info`).
+    """
+    aggregates = []
+    for chunk in chunks:
+        aggregates.append({'cube': build_cube(chunk, start_row), 'airlines': airline_info(chunk)})
+        start_row += len(chunk)
+
+    return merge_cube_aggregates(aggregates)
+
+
+def merge_cube_aggregates(aggregates: list) -> dict:
+    """
+    Merge cubes and airline attributes (see `aggregate_cube_chunks`) of separate sets of flights,
+    e.g. of loaded flights and of newly appended months. Attributes of an airline come from the first set.
+    """
+    infos = pd.concat([part['airlines'] for part in aggregates])
+    return {'cube': merge_cubes([part['cube'] for part in aggregates]), 'airlines': infos[~infos.index.duplicated()].sort_index()}
+
+
+def roll_up_routes(cube: dict, routes: pd.DataFrame, origin: str, months: tuple = None, airlines: tuple = None) -> pd.DataFrame:
+    """
+    Route aggregates of flights from `origin` within `months` ('YYYY-MM' first and last, inclusive) by `airlines`
+    (all by default), rolled up from cells of `cube` (see `aggregate_cube_chunks`).
+
+    Result has the layout of route index (see `aggregate_utils.build_route_index`). Cities of routes come from
+    route index `routes`, airlines of a route are listed in order of their first flight, like in route index.
+    """
+    cells = routes_from_origin(cube['cube'], origin)
+
+    mask = np.ones(len(cells), dtype = bool)
+    if months is not None:
+        cell_months = cells.index.get_level_values('MONTH')
+        mask &= (cell_months >= months[0]) & (cell_months <= months[1])
+    if airlines:
+        mask &= cells.index.get_level_values('AIRLINE').isin(airlines)
+    cells = cells[mask]
+
+    # airlines of every route ordered by their first flight within selected cells
+    groups = cells.groupby(level = ['ORIGIN', 'DEST', 'AIRLINE'], observed = True)
+    route_airlines = groups.sum().assign(FIRST_ROW = groups['FIRST_ROW'].min()).reset_index()
+    route_airlines = route_airlines.sort_values(['ORIGIN', 'DEST', 'FIRST_ROW'], kind = 'stable')
+    route_airlines = route_airlines.join(cube['airlines'], on = 'AIRLINE')
+
+    group_ids, index = route_ids(route_airlines)
+    n_groups = len(index)
+
+    # cities are attributes of route, not of its flights
+    origin_routes = routes_from_origin(routes, origin)
+    dests = origin_routes.index.get_level_values('DEST').astype(str)
+    aggregates = {
+        'ORIGIN_CITY_first': origin_routes['ORIGIN_CITY_first'].set_axis(dests).reindex(index.get_level_values('DEST').astype(str)).values,
+        'DEST_CITY_first': origin_routes['DEST_CITY_first'].set_axis(dests).reindex(index.get_level_values('DEST').astype(str)).values,
+        'AIRLINE_first': group_first(group_ids, n_groups, route_airlines['AIRLINE'].astype('category')),
+        'DOT_CODE_first': group_first(group_ids, n_groups, route_airlines['DOT_CODE'])
+    }
+
+    for col in UNIQUE_COLS:
+        aggregates[f'{col}_unique'] = group_unique_joined(group_ids, n_groups, route_airlines[col])
+
+    for col in MEAN_COLS:
+        sums = np.bincount(group_ids, weights = route_airlines[f'{col}_sum'], minlength = n_groups)
+        if is_integer_dtype(route_airlines[f'{col}_sum']):
+            sums = sums.astype('int64')
+        aggregates[f'{col}_sum'] = sums
+        aggregates[f'{col}_count'] = np.bincount(group_ids, weights = route_airlines[f'{col}_count'], minlength = n_groups).astype('int64')
+
+    return add_route_means(pd.DataFrame(aggregates, index = index))
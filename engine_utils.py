@@ -0,0 +1,371 @@
+"""
+This file contains interchangeable query engines that compute aggregates of flights for the application.
+
+Every engine exposes the same methods:
+
+- route_index() - aggregates of every (ORIGIN, DEST) route (see `aggregate_utils.build_route_index`),
+- origins() - 'ORIGIN, ORIGIN_CITY' of every origin, in order of first appearance,
+- column_statistics(columns) - means, (co)variances, min, max and value counts of numeric columns
+  (see `stats_utils.ColumnStatistics`),
+- sample(n) - random sample of flights,
+- iter_chunks(columns) - flights with `columns` in chunks of rows, for one-pass aggregations,
+- page(filters, sort_by, ascending, offset, limit) - page of filtered and sorted flights and number of all matching
+  flights (see `table_utils`),
+- append(flights, aggregates, files, version) - include `flights` appended to Parquet store in `files`
+  (see `storage_utils.append_flights_store`) with their `aggregates` (see `aggregate_utils.aggregate_flights_chunks`),
+- version - version of the dataset the engine reads (see `storage_utils.store_version`),
+- files - Parquet files of the store the engine reads (see `storage_utils.store_files`).
+
+Engines:
+
+- 'pandas' - pandas over FLIGHTS held in memory (FLIGHTS_LOADING='memory'), over FLIGHTS mapped from files
+  shared by all worker processes (FLIGHTS_LOADING='shared') or over chunks of Parquet store folded into aggregates
+  (FLIGHTS_LOADING='streaming'),
+- 'polars' - Polars lazy frames over Parquet store,
+- 'duckdb' - embedded DuckDB over Parquet store.
+
+Columnar engines never hold FLIGHTS in pandas, they run multi-core group-bys directly over Parquet store.
+"""
+
+import numpy as np
+import pandas as pd
+
+from storage_utils import CSV_CHUNKSIZE, FLIGHTS_DTYPES, ensure_flights_store, load_flights, iter_flights_store, count_flights_store, flights_dataset, optimize_dtypes, store_version, store_files, concat_flights
+from aggregate_utils import ROUTE_KEYS, FIRST_COLS, UNIQUE_COLS, MEAN_COLS, build_route_index, route_index_from_frame, aggregate_flights_chunks, merge_flights_aggregates
+from stats_utils import chunk_statistics, frame_statistics
+from shared_utils import publish_frames, attach_frames, shared_version, shared_lock
+from table_utils import PAGE_SIZE, FILTER_OPERATORS, page_of_frame, page_of_dataset
+
+
+#################################################################################
+
+# Variables
+
+ENGINES = ['pandas', 'polars', 'duckdb']
+
+SHARED_FRAMES = ['flights', 'routes'] # frames published by PandasSharedEngine
+
+
+#################################################################################
+# Engines
+
+class PandasEngine:
+    """
+    Aggregates computed with pandas over FLIGHTS held in memory.
+    """
+    name = 'pandas'
+
+    def __init__(self, csv_path: str, store_path: str):
+        self.flights = load_flights(csv_path, store_path)
+        self.version = store_version(store_path)
+        self.files = store_files(store_path)
+
+    def route_index(self) -> pd.DataFrame:
+        return build_route_index(self.flights)
+
+    def origins(self) -> list:
+        # deduplicate before concatenating - ORIGIN and ORIGIN_CITY are categoricals
+        origins = self.flights[['ORIGIN', 'ORIGIN_CITY']].drop_duplicates()
+        return (origins['ORIGIN'].astype(str) + ', ' + origins['ORIGIN_CITY'].astype(str)).tolist()
+
+    def column_statistics(self, columns: list):
+        return frame_statistics(self.flights, columns)
+
+    def sample(self, n: int, random_state: int = 2024) -> pd.DataFrame:
+        return self.flights.sample(n = n, random_state = random_state)
+
+    def iter_chunks(self, columns: list, chunksize: int = CSV_CHUNKSIZE):
+        for start in range(0, len(self.flights), chunksize):
+            yield self.flights.iloc[start:start + chunksize][columns]
+
+    def page(self, filters: list, sort_by: str = None, ascending: bool = True, offset: int = 0, limit: int = PAGE_SIZE) -> tuple:
+        return page_of_frame(self.flights, filters, sort_by, ascending, offset, limit)
+
+    def append(self, flights: pd.DataFrame, aggregates: dict, files: list, version: str) -> None:
+        self.flights = concat_flights([self.flights, flights])
+        self.files, self.version = self.files + files, version
+
+
+class PandasSharedEngine(PandasEngine):
+    """
+    Aggregates computed with pandas over FLIGHTS mapped from Arrow IPC files shared by all worker processes.
+
+    The first worker publishes flights together with their route index, the other workers
+    (and workers started later) only map the published files.
+    """
+    def __init__(self, csv_path: str, store_path: str, shared_path: str):
+        self.shared_path = shared_path
+
+        with shared_lock(shared_path):
+            ensure_flights_store(csv_path, store_path)
+            self.version = store_version(store_path)
+            self.files = store_files(store_path)
+
+            if shared_version(shared_path) != self.version:
+                flights = load_flights(csv_path, store_path)
+                publish_frames({'flights': flights, 'routes': build_route_index(flights)}, shared_path, self.version)
+                del flights # workers, including this one, use mapped copy
+
+        self.frames = attach_frames(shared_path, SHARED_FRAMES)
+        self.flights = self.frames['flights']
+
+    def route_index(self) -> pd.DataFrame:
+        return self.frames['routes']
+
+    def append(self, flights: pd.DataFrame, aggregates: dict, files: list, version: str) -> None:
+        with shared_lock(self.shared_path):
+            if shared_version(self.shared_path) != version: # the first worker publishes merged frames, others map them
+                merged = merge_flights_aggregates([{'routes': self.frames['routes']}, aggregates])
+                publish_frames({'flights': concat_flights([self.flights, flights]), **merged}, self.shared_path, version)
+
+        self.frames = attach_frames(self.shared_path, SHARED_FRAMES)
+        self.flights = self.frames['flights']
+        self.files, self.version = self.files + files, version
+
+
+class PandasStreamingEngine:
+    """
+    Aggregates computed with pandas over chunks of Parquet store, only the aggregates are kept in memory.
+    """
+    name = 'pandas'
+
+    def __init__(self, csv_path: str, store_path: str, sample_size: int):
+        ensure_flights_store(csv_path, store_path)
+        self.version = store_version(store_path)
+        self.files = store_files(store_path)
+        self.flights = None
+        self.store_path = store_path
+        self.sample_size = sample_size
+        self.aggregates = aggregate_flights_chunks(iter_flights_store(store_path), sample_size = sample_size)
+
+    def route_index(self) -> pd.DataFrame:
+        return self.aggregates['routes']
+
+    def origins(self) -> list:
+        routes = self.aggregates['routes']
+        origins = routes['ORIGIN_CITY_first'].groupby(level = 'ORIGIN', observed = True, sort = True).first()
+        return (origins.index.astype(str) + ', ' + origins.astype(str)).tolist()
+
+    def column_statistics(self, columns: list):
+        return self.aggregates['statistics'].select(columns)
+
+    def sample(self, n: int, random_state: int = 2024) -> pd.DataFrame:
+        return self.aggregates['sample'].head(n)
+
+    def iter_chunks(self, columns: list):
+        return iter_flights_store(self.store_path, columns)
+
+    def page(self, filters: list, sort_by: str = None, ascending: bool = True, offset: int = 0, limit: int = PAGE_SIZE) -> tuple:
+        # filters are pushed down to Parquet scan, only sort keys are read until rows of the page are known
+        dataset = flights_dataset(self.store_path)
+        return page_of_dataset(dataset, dataset.schema.names, filters, sort_by, ascending, offset, limit)
+
+    def append(self, flights: pd.DataFrame, aggregates: dict, files: list, version: str) -> None:
+        # chunks are read from the store, which already holds the files - only aggregates are merged
+        self.aggregates = merge_flights_aggregates([self.aggregates, aggregates], sample_size = self.sample_size)
+        self.files, self.version = self.files + files, version
+
+
+class DuckDBEngine:
+    """
+    Aggregates computed by embedded DuckDB directly over Parquet store.
+
+    Rows are ordered by (file name, row number in file) - the order of the CSV, in which pandas reads the store
+    (see `storage_utils`), so that 'first' aggregates and order of distinct airlines match the pandas engine.
+    """
+    name = 'duckdb'
+
+    def __init__(self, csv_path: str, store_path: str):
+        try:
+            import duckdb
+        except ImportError:
+            raise ImportError("FLIGHTS_ENGINE='duckdb' requires duckdb package (pip install duckdb)") from None
+
+        ensure_flights_store(csv_path, store_path)
+        self.version = store_version(store_path)
+        self.files = store_files(store_path)
+        self.store_path = store_path
+        self.flights = None
+        self.connection = duckdb.connect()
+        self.connection.execute(f"""
+            CREATE VIEW flights AS
+            SELECT * FROM read_parquet('{store_path}/**/*.parquet', hive_partitioning = false, filename = true, file_row_number = true)
+        """)
+
+    def query(self, sql: str) -> pd.DataFrame:
+        # connection must not be shared by threads (sessions, warm-up) - every query gets its own cursor
+        with self.connection.cursor() as cursor:
+            return cursor.execute(sql).df()
+
+    def route_index(self) -> pd.DataFrame:
+        aggregations = [f"first({col} ORDER BY filename, file_row_number) FILTER (WHERE {col} IS NOT NULL) AS {col}_first" for col in FIRST_COLS]
+        for col in MEAN_COLS:
+            sum_type = 'BIGINT' if FLIGHTS_DTYPES[col].startswith('int') else 'DOUBLE'
+            # sum of no values is 0 like in pandas, not NULL - appended flights are added to it (see `merge_route_indexes`)
+            aggregations.append(f'CAST(coalesce(sum({col}), 0) AS {sum_type}) AS {col}_sum, count({col}) AS {col}_count')
+
+        routes = self.query(f"SELECT ORIGIN, DEST, {', '.join(aggregations)} FROM flights GROUP BY ORIGIN, DEST")
+
+        # distinct values ordered by their first appearance within route
+        for col in UNIQUE_COLS:
+            unique = self.query(f"""
+                SELECT ORIGIN, DEST, string_agg({col}, ', ' ORDER BY position) AS {col}_unique
+                FROM (
+                    SELECT ORIGIN, DEST, {col}, min({{'file': filename, 'row': file_row_number}}) AS position
+                    FROM flights WHERE {col} IS NOT NULL GROUP BY ORIGIN, DEST, {col}
+                )
+                GROUP BY ORIGIN, DEST
+            """)
+            routes = routes.merge(unique, on = ROUTE_KEYS, how = 'left')
+
+        return route_index_from_frame(routes)
+
+    def origins(self) -> list:
+        origins = self.query("""
+            SELECT ORIGIN, first(ORIGIN_CITY ORDER BY filename, file_row_number) AS ORIGIN_CITY
+            FROM flights GROUP BY ORIGIN ORDER BY min({'file': filename, 'row': file_row_number})
+        """)
+        return (origins['ORIGIN'] + ', ' + origins['ORIGIN_CITY']).tolist()
+
+    def column_statistics(self, columns: list):
+        # co-moments of all column pairs - one pass over chunks of the store
+        return chunk_statistics(iter_flights_store(self.store_path, columns), columns)
+
+    def sample(self, n: int, random_state: int = 2024) -> pd.DataFrame:
+        sample = self.query(f"SELECT * EXCLUDE (filename, file_row_number) FROM flights USING SAMPLE reservoir({n} ROWS) REPEATABLE ({random_state})")
+        return optimize_dtypes(sample)
+
+    def iter_chunks(self, columns: list):
+        return iter_flights_store(self.store_path, columns)
+
+    def page(self, filters: list, sort_by: str = None, ascending: bool = True, offset: int = 0, limit: int = PAGE_SIZE) -> tuple:
+        # column names and operators come from known lists, values are bound as parameters
+        for col, op, _ in filters:
+            if col not in FLIGHTS_DTYPES or op not in FILTER_OPERATORS:
+                raise ValueError(f'Invalid filter on {col!r} with {op!r}')
+        conditions = [f'"{col}" {op} ?' for col, op, _ in filters]
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        values = [value for _, _, value in filters]
+
+        order = 'filename, file_row_number' # order of the store
+        if sort_by is not None:
+            if sort_by not in FLIGHTS_DTYPES:
+                raise ValueError(f'Invalid sort column {sort_by!r}')
+            order = f'"{sort_by}" {"ASC" if ascending else "DESC"} NULLS LAST, {order}'
+
+        with self.connection.cursor() as cursor:
+            page = cursor.execute(f"SELECT * EXCLUDE (filename, file_row_number) FROM flights {where} ORDER BY {order} LIMIT {int(limit)} OFFSET {int(offset)}", values).df()
+            total = cursor.execute(f"SELECT count(*) FROM flights {where}", values).fetchone()[0]
+
+        return optimize_dtypes(page), total
+
+    def append(self, flights: pd.DataFrame, aggregates: dict, files: list, version: str) -> None:
+        # the view expands its glob on every query, so it reads appended files already
+        self.files, self.version = self.files + files, version
+
+
+class PolarsEngine:
+    """
+    Aggregates computed by Polars lazy frames directly over Parquet store.
+
+    Files are scanned in order of their names and groups keep order of their rows - the order of the CSV, like
+    in DuckDB engine, so that 'first' aggregates and order of distinct airlines match the pandas engine.
+    """
+    name = 'polars'
+
+    def __init__(self, csv_path: str, store_path: str):
+        try:
+            import polars
+        except ImportError:
+            raise ImportError("FLIGHTS_ENGINE='polars' requires polars package (pip install polars)") from None
+
+        ensure_flights_store(csv_path, store_path)
+        self.version = store_version(store_path)
+        self.files = store_files(store_path)
+        self.store_path = store_path
+        self.pl = polars
+        self.flights = None
+        self.scan = self.scan_store()
+
+    def scan_store(self):
+        return self.pl.scan_parquet(f'{self.store_path}/**/*.parquet', hive_partitioning = False)
+
+    def route_index(self) -> pd.DataFrame:
+        pl = self.pl
+
+        # within every group polars keeps rows in order of the store
+        aggregations = [pl.col(col).drop_nulls().first().alias(f'{col}_first') for col in FIRST_COLS]
+        aggregations += [
+            pl.col(col).drop_nulls().cast(pl.String).unique(maintain_order = True).str.join(', ').alias(f'{col}_unique')
+            for col in UNIQUE_COLS
+        ]
+        for col in MEAN_COLS:
+            sum_type = pl.Int64 if FLIGHTS_DTYPES[col].startswith('int') else pl.Float64
+            aggregations += [pl.col(col).cast(sum_type).sum().alias(f'{col}_sum'), pl.col(col).count().alias(f'{col}_count')]
+
+        routes = self.scan.group_by(ROUTE_KEYS).agg(aggregations).collect().to_pandas()
+
+        return route_index_from_frame(routes)
+
+    def origins(self) -> list:
+        pl = self.pl
+        origins = self.scan.select(['ORIGIN', 'ORIGIN_CITY']).unique(subset = ['ORIGIN'], keep = 'first', maintain_order = True).collect()
+        return [f'{origin}, {city}' for origin, city in origins.iter_rows()]
+
+    def column_statistics(self, columns: list):
+        # co-moments of all column pairs - one pass over chunks of the store
+        return chunk_statistics(iter_flights_store(self.store_path, columns), columns)
+
+    def sample(self, n: int, random_state: int = 2024) -> pd.DataFrame:
+        # draw row numbers first, so that only sampled rows are materialized
+        rows = self.scan.select(self.pl.len()).collect().item()
+        positions = np.sort(np.random.default_rng(random_state).choice(rows, size = min(n, rows), replace = False))
+
+        sample = self.scan.with_row_index('ROW').filter(self.pl.col('ROW').is_in(positions)).drop('ROW').collect().to_pandas()
+        return optimize_dtypes(sample)
+
+    def iter_chunks(self, columns: list):
+        return iter_flights_store(self.store_path, columns)
+
+    def page(self, filters: list, sort_by: str = None, ascending: bool = True, offset: int = 0, limit: int = PAGE_SIZE) -> tuple:
+        pl = self.pl
+
+        def column(col):
+            # categoricals are compared and sorted as strings, like in other engines
+            return pl.col(col).cast(pl.String) if FLIGHTS_DTYPES[col] == 'category' else pl.col(col)
+
+        rows = self.scan
+        for col, op, value in filters:
+            rows = rows.filter(FILTER_OPERATORS[op](column(col), value))
+        if sort_by is not None:
+            rows = rows.sort(column(sort_by), descending = not ascending, nulls_last = True, maintain_order = True)
+
+        page = rows.slice(offset, limit).collect().to_pandas()
+        total = rows.select(pl.len()).collect().item()
+
+        return optimize_dtypes(page), total
+
+    def append(self, flights: pd.DataFrame, aggregates: dict, files: list, version: str) -> None:
+        self.scan = self.scan_store() # files matched by the glob are listed when the scan is created
+        self.files, self.version = self.files + files, version
+
+
+#################################################################################
+# Functions
+
+def create_engine(name: str, csv_path: str, store_path: str, loading: str = 'memory', sample_size: int = 1000, shared_path: str = None):
+    """
+    Create query engine by name (one of ENGINES). `loading` and `shared_path` apply only to pandas engine.
+    """
+    if name == 'pandas':
+        if loading == 'streaming':
+            return PandasStreamingEngine(csv_path, store_path, sample_size)
+        if loading == 'shared':
+            return PandasSharedEngine(csv_path, store_path, shared_path)
+        return PandasEngine(csv_path, store_path)
+    if name == 'polars':
+        return PolarsEngine(csv_path, store_path)
+    if name == 'duckdb':
+        return DuckDBEngine(csv_path, store_path)
+
+    raise ValueError(f'Unknown flights engine {name!r}, expected one of {ENGINES}')
@@ -0,0 +1,170 @@
+"""
+This file contains headless export of summaries of Flights tab for every origin into partitioned Parquet files.
+
+Usage:
+
+    python export.py [--output dataset/flights_export] [--workers 8] [--batch 10] [--origins JFK LAX]
+
+Tables of every origin of ORIGIN_AIRPORTS (panels of `utils.summarize_from_origin`, routes of
+`utils.summarize_routes_from_origin` and percentiles of `utils.route_percentiles`, over all flights) are written into
+`<output>/<table>/ORIGIN=<code>/` (Hive partitioning - `pd.read_parquet('<output>/<table>')` reads
+a table of all origins back, with ORIGIN column restored from the directories).
+
+Data is loaded once by the main process (from FLIGHTS_CSV / FLIGHTS_STORE like the application) before the pool
+of workers is started. Workers are forked and share its memory, so none of them reads or copies the data. Where fork
+is not available (Windows, macOS) every worker loads data itself - with FLIGHTS_LOADING=shared workers map
+Arrow files published by the first one instead. Workers write files of their origins and send back only row counts,
+summaries are never pickled between processes.
+
+The export is written into `<output>.tmp` and replaces `<output>` when complete, so readers never see a partial one.
+"""
+
+import argparse
+import functools
+import importlib
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+#################################################################################
+
+# Variables
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+EXPORT_PATH = os.environ.get('FLIGHTS_EXPORT', DIR_PATH + '/dataset/flights_export')
+
+EXPORT_WORKERS = os.cpu_count() or 1
+EXPORT_BATCH = 10 # origins per task of a worker, small enough to balance busy and quiet origins between workers
+PROGRESS_INTERVAL = 2.0 # seconds between progress lines
+
+APP = None # utils module of the process, inherited by forked workers
+
+
+#################################################################################
+# Functions
+
+def load_app():
+    """
+    Import utils with data of the application. The store is not watched for appended months during export.
+    """
+    global APP
+    if APP is None:
+        os.environ.setdefault('FLIGHTS_WATCH', '0')
+        APP = importlib.import_module('utils')
+        APP.WARM_UP.join() # all values are loaded and no thread of warm-up is running when workers are forked
+
+    return APP
+
+
+def origin_tables(origin: str) -> dict:
+    """
+    Tables {name: frame} of `origin` as shown in Flights tab for all months and airlines.
+    """
+    routes = APP.DATA.ROUTES
+
+    return {
+        **APP.summarize_from_origin(routes, origin),
+        'routes': APP.summarize_routes_from_origin(routes, origin),
+        'percentiles': APP.route_percentiles(origin).reset_index()
+    }
+
+
+def export_origins(origins: list, output: str) -> tuple:
+    """
+    Write tables of `origins` into partitions of `output`, return number of origins and of rows written.
+    Runs in worker processes - tables of all origins of the batch are converted to Arrow and written at once.
+    """
+    load_app()
+    tables = {}
+    for origin in origins:
+        for name, table in origin_tables(origin).items():
+            tables.setdefault(name, []).append(table.assign(ORIGIN = origin))
+
+    rows = 0
+    for name, parts in tables.items():
+        table = pa.Table.from_pandas(pd.concat(parts, ignore_index = True), preserve_index = False)
+        pq.write_to_dataset(table, f'{output}/{name}', partition_cols = ['ORIGIN'], basename_template = f'part-{origins[0]}-{{i}}.parquet')
+        rows += table.num_rows
+
+    APP.RESULT_CACHE.clear() # summaries are written, the worker does not keep them
+    return len(origins), rows
+
+
+def pool_context():
+    """
+    Start method of workers: fork shares memory of loaded data, spawn makes every worker load it.
+    """
+    return multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+def export_summaries(origins: list, output: str, workers: int = EXPORT_WORKERS, batch: int = EXPORT_BATCH) -> int:
+    """
+    Export tables of `origins` into `output` on a pool of `workers` processes, printing progress and throughput.
+    Returns number of rows written.
+    """
+    tmp_path = output + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors = True)
+
+    # lookups of route index and sketches are built before fork, not once per worker
+    origin_tables(origins[0])
+    APP.RESULT_CACHE.clear()
+
+    batches = [origins[i:i + batch] for i in range(0, len(origins), batch)]
+    start = last_report = time.perf_counter()
+    done, rows = 0, 0
+    with pool_context().Pool(workers, initializer = load_app) as pool:
+        for batch_origins, batch_rows in pool.imap_unordered(functools.partial(export_origins, output = tmp_path), batches):
+            done, rows = done + batch_origins, rows + batch_rows
+            now = time.perf_counter()
+            if now - last_report >= PROGRESS_INTERVAL or done == len(origins):
+                elapsed = now - start
+                print(f'{done:,}/{len(origins):,} origins, {rows:,} rows in {elapsed:.1f} s '
+                      f'({done / elapsed:.1f} origins/s, {rows / elapsed:,.0f} rows/s)')
+                last_report = now
+
+    shutil.rmtree(output, ignore_errors = True)
+    os.rename(tmp_path, output)
+
+    return rows
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description = 'Export summaries of Flights tab for every origin into partitioned Parquet files.')
+    parser.add_argument('--output', default = EXPORT_PATH, help = 'directory of the export (FLIGHTS_EXPORT), replaced when complete')
+    parser.add_argument('--workers', type = int, default = EXPORT_WORKERS, help = 'worker processes')
+    parser.add_argument('--batch', type = int, default = EXPORT_BATCH, help = 'origins per task of a worker')
+    parser.add_argument('--origins', nargs = '+', help = 'airport codes to export (all origins by default)')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    load_app()
+    print(f'Data loaded in {time.perf_counter() - start:.1f} s')
+
+    all_origins = [choice.split(',')[0] for choice in APP.DATA.ORIGIN_AIRPORTS]
+    origins = all_origins if args.origins is None else [origin for origin in args.origins if origin in all_origins]
+    unknown = sorted(set(args.origins or []) - set(all_origins))
+    if unknown:
+        print(f"Not origins of any flight: {', '.join(unknown)}", file = sys.stderr)
+        return 1
+    if not origins:
+        print('No origins to export', file = sys.stderr)
+        return 1
+
+    start = time.perf_counter()
+    rows = export_summaries(origins, args.output, max(args.workers, 1), max(args.batch, 1))
+    elapsed = time.perf_counter() - start
+    print(f'{len(origins):,} origins ({rows:,} rows) exported into {args.output} in {elapsed:.1f} s '
+          f'({len(origins) / elapsed:.1f} origins/s)')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+This file contains utilities for looking up coordinates of airports and spatial queries over them.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+#################################################################################
+
+# Variables
+
+EARTH_RADIUS_MILES = 3958.8
+MILES_PER_DEGREE = np.pi * EARTH_RADIUS_MILES / 180 # along a meridian
+GRID_CELL_DEGREES = 2.0 # side of cells of airport grid, ~140 miles of latitude
+
+
+#################################################################################
+# Functions
+
+def build_coords_index(codes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Keyed index of airport coordinates: Latitude and Longitude indexed by unique Airport Code.
+
+    Lookups by code go through hash table of pandas Index instead of scanning the whole table.
+    """
+    coords = codes.drop_duplicates('Airport Code').set_index('Airport Code')[['Latitude', 'Longitude']]
+
+    return coords
+
+
+def lookup_coords(coords: pd.DataFrame, airports: list) -> tuple:
+    """
+    Resolve coordinates of many airports in one call.
+
+    Returns frame of Latitude and Longitude indexed by found airports (in order of `airports`)
+    and list of airports that have no coordinates.
+    """
+    found = coords.reindex(airports)
+    missing = found['Latitude'].isna()
+
+    return found[~missing], found.index[missing].tolist()
+
+
+def haversine_miles(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distances (miles) from point (lat, lon) to points (lats, lons), all in degrees.
+    """
+    lat, lon, lats, lons = np.radians(lat), np.radians(lon), np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def routes_in_bounds(origin_coords: tuple, dests_coords: pd.DataFrame, bounds: tuple) -> np.ndarray:
+    """
+    Mask of ORIGIN -> DEST lines (drawn straight on the map) which may cross the map view
+    `bounds` ((south, west), (north, east)): bounding boxes of lines and the view overlap.
+    """
+    (south, west), (north, east) = bounds
+    lats, lons = dests_coords['Latitude'].to_numpy(), dests_coords['Longitude'].to_numpy()
+
+    return (
+        (np.minimum(lats, origin_coords[0]) <= north) & (np.maximum(lats, origin_coords[0]) >= south) &
+        (np.minimum(lons, origin_coords[1]) <= east) & (np.maximum(lons, origin_coords[1]) >= west)
+    )
+
+
+def pad_bounds(bounds: tuple, padding: float) -> tuple:
+    """
+    Map view `bounds` ((south, west), (north, east)) extended by `padding` of their height and width on every side.
+    """
+    (south, west), (north, east) = bounds
+    height, width = (north - south) * padding, (east - west) * padding
+
+    return (max(south - height, -90), west - width), (min(north + height, 90), east + width)
+
+
+#################################################################################
+# Spatial index
+
+class AirportGrid:
+    """
+    Spatial index of airport coordinates: airports bucketed into GRID_CELL_DEGREES cells of latitude/longitude grid.
+
+    Airports are sorted by cell (row-major), so cells of one grid row within a longitude range are a contiguous
+    slice found by binary search. Queries check exact distances or bounds only for airports of cells overlapping
+    the searched area.
+    """
+
+    def __init__(self, coords: pd.DataFrame, cell_degrees: float = GRID_CELL_DEGREES):
+        coords = coords.dropna(subset = ['Latitude', 'Longitude'])
+        self.cell_degrees = cell_degrees
+        self.n_cols = int(np.ceil(360 / cell_degrees))
+
+        cells = self.cell(coords['Latitude'].to_numpy(), coords['Longitude'].to_numpy())
+        order = np.argsort(cells, kind = 'stable')
+
+        self.cells = cells[order]
+        self.codes = coords.index.to_numpy()[order]
+        self.lats = coords['Latitude'].to_numpy()[order]
+        self.lons = coords['Longitude'].to_numpy()[order]
+
+    def rows(self, lats):
+        return np.clip(np.floor((np.asarray(lats) + 90) / self.cell_degrees), 0, np.ceil(180 / self.cell_degrees) - 1).astype(int)
+
+    def cols(self, lons):
+        return (np.floor((np.asarray(lons) + 180) / self.cell_degrees) % self.n_cols).astype(int)
+
+    def cell(self, lats, lons):
+        return self.rows(lats) * self.n_cols + self.cols(lons)
+
+    def candidates(self, south: float, west: float, north: float, east: float) -> np.ndarray:
+        """
+        Positions of airports in cells overlapping the box. Longitudes beyond +-180 wrap around.
+        """
+        rows = np.arange(self.rows(south), self.rows(north) + 1)
+        if east - west >= 360:
+            col_ranges = [(0, self.n_cols - 1)]
+        else:
+            first, last = self.cols(west), self.cols(east)
+            col_ranges = [(first, last)] if first <= last else [(first, self.n_cols - 1), (0, last)]
+
+        positions = []
+        for first, last in col_ranges:
+            starts = np.searchsorted(self.cells, rows * self.n_cols + first, side = 'left')
+            ends = np.searchsorted(self.cells, rows * self.n_cols + last, side = 'right')
+            positions += [np.arange(start, end) for start, end in zip(starts, ends) if end > start]
+
+        return np.concatenate(positions) if positions else np.empty(0, dtype = int)
+
+    def in_bounds(self, bounds: tuple) -> np.ndarray:
+        """
+        Codes of airports within map view `bounds` ((south, west), (north, east)).
+        """
+        (south, west), (north, east) = bounds
+        positions = self.candidates(south, max(west, -180), north, min(east, 180))
+        lats, lons = self.lats[positions], self.lons[positions]
+        inside = (lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)
+
+        return self.codes[positions[inside]]
+
+    def within(self, lat: float, lon: float, miles: float) -> pd.Series:
+        """
+        Distances (miles) of airports within `miles` of point (lat, lon), indexed by airport code, nearest first.
+        """
+        lat_degrees = miles / MILES_PER_DEGREE
+        cos_lat = np.cos(np.radians(min(abs(lat) + lat_degrees, 90)))
+        lon_degrees = 360 if cos_lat < 1e-6 else min(lat_degrees / cos_lat, 360)
+
+        positions = self.candidates(lat - lat_degrees, lon - lon_degrees, lat + lat_degrees, lon + lon_degrees)
+        distances = haversine_miles(lat, lon, self.lats[positions], self.lons[positions])
+        inside = np.flatnonzero(distances <= miles)
+        inside = inside[np.argsort(distances[inside], kind = 'stable')] # sorted before the Series is built, it is cheaper
+
+        return pd.Series(distances[inside], index = pd.Index(self.codes[positions[inside]], name = 'Airport Code'), name = 'miles')
@@ -0,0 +1,56 @@
+"""
+This file contains ingestion of new months of flights into the Parquet store of the application.
+
+Usage:
+
+    python ingest.py path/to/flights_2024_01.csv [--store dataset/flights_store]
+
+Flights of the CSV (in the format of the dataset) are appended to the store as new files, files already in the store
+are not rewritten. Running applications check the store every FLIGHTS_WATCH seconds and merge only aggregates
+of the appended files into their data (see `utils.ingest_appended_flights`), no restart is needed.
+
+The store is rebuilt from FLIGHTS_CSV when the CSV changes - appended months are then dropped unless they are
+added to the CSV too.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+from storage_utils import append_flights_store, count_flights_store
+
+
+#################################################################################
+
+# Variables
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+FLIGHTS_STORE = os.environ.get('FLIGHTS_STORE', DIR_PATH + '/dataset/flights_store') # same default as utils
+
+
+#################################################################################
+# Functions
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(description = 'Append new months of flights to the Parquet store of the application.')
+    parser.add_argument('csv', nargs = '+', help = 'CSV files of flights, e.g. one per month')
+    parser.add_argument('--store', default = FLIGHTS_STORE, help = 'Parquet store of the application (FLIGHTS_STORE)')
+    args = parser.parse_args(argv)
+
+    for csv_path in args.csv:
+        start = time.perf_counter()
+        try:
+            files = append_flights_store(csv_path, args.store)
+        except (FileNotFoundError, ValueError) as e:
+            print(f'{csv_path} not appended: {e}', file = sys.stderr)
+            return 1
+
+        rows = count_flights_store(args.store, files = files)
+        print(f'{csv_path}: {rows:,} flights appended in {len(files)} files in {time.perf_counter() - start:.1f} s')
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,11 +2,38 @@
 This file contains utilities for ipyleaflet.Map widget in Flights tab of application.
 """
 
-from ipyleaflet import Map, Marker, LayerGroup, WidgetControl, CircleMarker, Polyline, TileLayer, AwesomeIcon, AntPath
+from ipyleaflet import Map, Marker, LayerGroup, WidgetControl, CircleMarker, Polyline, TileLayer, AwesomeIcon, AntPath, GeoJSON
 
 from ipywidgets import HTML
 
-from utils import FLIGHTS, AIRLINE_COLORS, CODES, summarize_routes_from_origin, get_coords
+import logging
+import sys
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from utils import DATA, AIRLINE_COLORS, filter_routes, summarize_routes_from_origin, get_coords, nearby_airports, find_connections, find_path, hub_centrality
+from geo_utils import lookup_coords, routes_in_bounds, pad_bounds
+from metrics_utils import instrument_module
+
+
+logger = logging.getLogger(__name__)
+
+ROUTES_RENDERING_MODE = 'geojson' # 'geojson' - two GeoJSON layers per origin, 'widgets' - Marker and AntPath per route
+LAYER_CACHE_SIZE = 8 # number of origins whose built routes layers are kept per map
+LAYER_MANAGERS = weakref.WeakKeyDictionary() # Map -> MapLayerManager
+VIEWPORT_PADDING = 0.5 # routes are drawn for the map view extended by this share of its size on every side
+NEARBY_AIRPORTS_LISTED = 5 # nearest airports listed in airport popups
+
+# Modes of the map in Flights tab: direct routes from origin or network modes (see `build_network_layer`)
+MAP_MODES = {'routes': 'Direct routes', 'connections': 'Connections', 'hubs': 'Hubs'}
+PATH_WEIGHT_CHOICES = {'distance': 'Shortest', 'delay': 'Least delay'}
+CONNECTIONS_DRAWN = 20 # shortest connections drawn on the map
+HUBS_DRAWN = 50 # most central airports drawn on the map
+NETWORK_COLORS = {'Direct': '#2ca02c', '1 stop': '#ff7f0e', '2 stops': '#d62728', 'Best path': '#1f77b4'}
+HUB_COLOR = '#6a3d9a'
 
 
 
@@ -30,15 +57,29 @@ def clear_map(map: Map) -> None:
             map.remove_control(item)
 
 
-def get_marker_description(code: str, city: str) -> HTML:
-    mess = HTML()
-    mess.value = f"""<center> Airport <i> <b>{code} </b> </i> <br> in <br> <b> <i> {city} </i> </b> <br> </center> """
-    
-    return mess
+def marker_description_html(code: str, city: str, nearby = None) -> str:
+    """
+    Popup of airport, with airports nearby (Series of distances in miles indexed by code) if given.
+    """
+    description = f"""<center> Airport <i> <b>{code} </b> </i> <br> in <br> <b> <i> {city} </i> </b> <br> </center> """
+    if nearby is not None and len(nearby):
+        listed = ', '.join(f'{airport} ({miles:.0f} mi)' for airport, miles in nearby.head(NEARBY_AIRPORTS_LISTED).items())
+        description += f"""<center> <small> Nearby: {listed} </small> </center> """
+
+    return description
+
+
+def describe_airport(code: str, city: str) -> str:
+    try:
+        nearby = nearby_airports(code)
+    except KeyError:
+        nearby = None
 
-def get_route_description(origin, origin_city, dest, dest_city, distance, elapsed_time):
-    mess = HTML()
-    mess.value = f"""
+    return marker_description_html(code, city, nearby)
+
+
+def route_description_html(origin, origin_city, dest, dest_city, distance, elapsed_time) -> str:
+    return f"""
         <div>
             <center> Route: </center> <br>
             <b>{origin} ({origin_city})</b> <br>
@@ -54,93 +95,588 @@ def get_route_description(origin, origin_city, dest, dest_city, distance, elapse
             <i> Elapsed Time Arrival: {elapsed_time} (minutes) </i>
             
         """
-    
 
-    return mess
 
+class LazyPopup:
+    """
+    Single popup widget shared by many map features.
 
+    Content for a feature is generated only when the feature is clicked for the first time
+    (`describe(key)` returns its HTML) and is cached per feature key afterwards.
+    """
 
+    def __init__(self, describe):
+        self.describe = describe
+        self.descriptions = {} # feature key -> HTML content
+        self.widget = HTML()
 
-def draw_routes(map: Map, selected_origin: str) -> None:
-    routes_summary = summarize_routes_from_origin(FLIGHTS, selected_origin) # get routes from selected origin and statistics
+    def show(self, key) -> None:
+        if key not in self.descriptions:
+            self.descriptions[key] = self.describe(key)
+        self.widget.value = self.descriptions[key]
+
+
+def routes_popups(selected_origin: str, origin_city: str, routes_summary) -> tuple:
+    """
+    Lazy popups of airports (keyed by airport code) and routes (keyed by DEST) from selected origin.
+    """
+    routes = routes_summary.set_index(routes_summary['DEST'].astype(str))
+    cities = dict(zip(routes.index, routes['DEST_CITY']), **{selected_origin: origin_city})
+
+    def describe_route(dest):
+        route = routes.loc[dest]
+        return route_description_html(selected_origin, origin_city, dest, route['DEST_CITY'], route['mean_distance'], route['mean_elapsed_time'])
+
+    markers_popup = LazyPopup(lambda code: describe_airport(code, cities[code]))
+    lines_popup = LazyPopup(describe_route)
+
+    return markers_popup, lines_popup
+
+
+
+
+def build_routes_layer(selected_origin: str, mode: str = ROUTES_RENDERING_MODE, months: tuple = None, airlines: tuple = ()) -> tuple:
+    """
+    Build routes layer (see `RoutesLayer`) with ORIGIN marker, DEST markers and ORIGIN -> DEST lines of routes
+    from selected origin. Features of routes are added to the map by its `reveal`.
+
+    `mode` is either 'geojson' (lines and points as GeoJSON layers) or 'widgets'
+    (separate Marker and AntPath widget for every destination). Only flights within `months` by `airlines`
+    are summarized (see `filter_routes`).
+
+    Returns the layer (None if there are no coords of ORIGIN), colors of airlines flying the routes and coords of ORIGIN.
+    """
+    routes = filter_routes(selected_origin, months, airlines)
+    routes_summary = summarize_routes_from_origin(routes, selected_origin) # get routes from selected origin and statistics
     
-    # draw airlines legend
+    # airlines legend contents
     airlines = routes_summary['AIRLINE'].tolist()
     airline_colors = {airline: AIRLINE_COLORS[airline] for airline in set(airlines)}
-
-    legend = create_airline_legend(airline_colors)
-    widget = WidgetControl(widget = legend, position = 'topright')
-    map.add(widget)
     
-    # create ORIGIN marker
-    origin_coords = get_coords(CODES, selected_origin)
-    origin_city = routes_summary['ORIGIN_CITY'][0]
+    try:
+        origin_coords = tuple(get_coords(DATA.AIRPORT_COORDS, selected_origin).values())
+    except KeyError as e:
+        logger.warning('Routes from %s not drawn: %s', selected_origin, e)
+        return None, airline_colors, None
 
+    # resolve coords of all DEST airports at once, routes to airports without coords are not drawn
+    dests_coords, missing_dests = lookup_coords(DATA.AIRPORT_COORDS, routes_summary['DEST'].astype(str).tolist())
+    if missing_dests:
+        logger.warning('No coordinates for airports %s - routes from %s to them not drawn', missing_dests, selected_origin)
 
-    origin_marker = CircleMarker(location = tuple(origin_coords.values()), title = selected_origin, draggable = False, color = 'green')
-    
-    origin_marker.popup = get_marker_description(code = selected_origin, city = origin_city)
-    
+    routes_summary = routes_summary[~routes_summary['DEST'].isin(missing_dests)]
+    if routes_summary.empty: # no flights match filters
+        return None, airline_colors, origin_coords
 
-    # create DEST markers and ORIGIN -> DEST lines
-    
-    # LayerGroups() increase efficency a lot
-    markers_layer = LayerGroup()
-    lines_layer = LayerGroup()
+    return RoutesLayer(selected_origin, origin_coords, routes_summary, dests_coords, mode), airline_colors, origin_coords
+
+
+def known_bounds(bounds: tuple) -> tuple:
+    """
+    Map view bounds ((south, west), (north, east)) synced from the browser, None before the map reported them.
+    """
+    if not bounds or bounds[0][0] >= bounds[1][0]:
+        return None
+    return bounds
+
+
+def centered_bounds(bounds: tuple, center: tuple) -> tuple:
+    """
+    Bounds of the same size as `bounds` centered at `center` - the view after the map is moved there.
+    """
+    (south, west), (north, east) = bounds
+    lat, lon = center
+    half_height, half_width = (north - south) / 2, (east - west) / 2
+
+    return (lat - half_height, lon - half_width), (lat + half_height, lon + half_width)
+
+
+class RoutesLayer:
+    """
+    Routes from selected origin, materialized as map features only where the map shows them.
+
+    `layer` is a LayerGroup of lines, DEST markers and ORIGIN marker. `reveal(bounds)` adds features which
+    are not drawn yet and reach the map view padded by VIEWPORT_PADDING: lines crossing it and markers of airports
+    within it (see `geo_utils.AirportGrid`). Panning or zooming out adds more features, drawn ones stay.
+    Popups are shared by all features (see `LazyPopup`).
+    """
 
+    def __init__(self, selected_origin: str, origin_coords: tuple, routes_summary, dests_coords, mode: str = ROUTES_RENDERING_MODE):
+        self.selected_origin = selected_origin
+        self.origin_coords = origin_coords
+        self.routes_summary = routes_summary
+        self.dests_coords = dests_coords
+        self.mode = mode
+        self.lines_drawn = np.zeros(len(routes_summary), dtype = bool)
+        self.markers_drawn = np.zeros(len(routes_summary), dtype = bool)
+
+        origin_city = routes_summary['ORIGIN_CITY'].iloc[0]
+        self.markers_popup, self.lines_popup = routes_popups(selected_origin, origin_city, routes_summary)
+
+        # markers are drawn above lines, ORIGIN above DEST markers
+        self.lines_layer = LayerGroup()
+        self.markers_layer = LayerGroup()
+        self.layer = LayerGroup(layers = [self.lines_layer, self.markers_layer, self.origin_marker()])
+
+    @property
+    def complete(self) -> bool:
+        return bool(self.lines_drawn.all() and self.markers_drawn.all())
+
+    def origin_marker(self):
+        if self.mode == 'geojson':
+            marker = GeoJSON(
+                data = {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [self.origin_coords[1], self.origin_coords[0]]},
+                        'properties': {'code': self.selected_origin, 'origin': True}},
+                point_style = {'radius': 8, 'weight': 1, 'fillOpacity': 0.8},
+                style_callback = route_style
+            )
+        else:
+            marker = CircleMarker(location = self.origin_coords, title = self.selected_origin, draggable = False, color = 'green')
+
+        marker.popup = self.markers_popup.widget
+        marker.on_click(lambda **kwargs: self.markers_popup.show(self.selected_origin))
+
+        return marker
+
+    def reveal(self, bounds: tuple = None) -> int:
+        """
+        Add features of routes reaching map view `bounds` ((south, west), (north, east)), of all routes
+        if bounds are None. Returns number of added features.
+        """
+        if bounds is None:
+            lines, markers = ~self.lines_drawn, ~self.markers_drawn
+        else:
+            bounds = pad_bounds(bounds, VIEWPORT_PADDING)
+            lines = routes_in_bounds(self.origin_coords, self.dests_coords, bounds) & ~self.lines_drawn
+            markers = self.dests_coords.index.isin(DATA.AIRPORT_GRID.in_bounds(bounds)) & ~self.markers_drawn
+
+        geojson = self.mode == 'geojson'
+        if lines.any():
+            build = routes_geojson_layer if geojson else routes_widgets_layer
+            self.lines_layer.add(build(self.origin_coords, self.routes_summary[lines], self.dests_coords[lines], self.lines_popup))
+            self.lines_drawn |= lines
+        if markers.any():
+            build = markers_geojson_layer if geojson else markers_widgets_layer
+            self.markers_layer.add(build(self.routes_summary[markers], self.dests_coords[markers], self.markers_popup))
+            self.markers_drawn |= markers
+
+        return int(lines.sum() + markers.sum())
+
+
+def markers_widgets_layer(routes_summary, dests_coords, markers_popup: LazyPopup) -> LayerGroup:
+    """
+    DEST markers of routes, separate Marker widget for every destination.
+    """
+    markers_layer = LayerGroup() # LayerGroups() increase efficency a lot
     airport_icon = AwesomeIcon(name = 'plane') # Airport icon that will be drawn on marker 
 
-    for id, row in routes_summary.iterrows():
-        dest = row['DEST'] # DEST airport shortcuts
-        dest_city = row['DEST_CITY']
-        airline = row['AIRLINE']
-
-        distance = row['mean_distance']
-        elapsed_time = row['mean_elapsed_time']
-
-        try:
-            dest_coords = get_coords(CODES, dest) # calculate DEST airport coords
-        except:
-            pass # skip in case there are no coords for airport
-        
-        # create DEST marker 
-        dest_marker = Marker(location = tuple(dest_coords.values()), title = dest, draggable = False) # create DEST marker
+    for dest, dest_coords in zip(routes_summary['DEST'].astype(str), dests_coords.itertuples(index = False)):
+        dest_marker = Marker(location = (dest_coords.Latitude, dest_coords.Longitude), title = dest, draggable = False)
         dest_marker.icon = airport_icon
-        dest_marker.popup = get_marker_description(code = dest, city = dest_city)
-
-        # create ORIGIN -> DEST line
-        color = AIRLINE_COLORS[airline] # color of current airline
-
-        # line = Polyline(
-        #     locations = [
-        #         tuple(origin_coords.values()),
-        #         tuple(dest_coords.values()),
-        #     ],
-        #     color = color
-        # )
+        dest_marker.popup = markers_popup.widget
+        dest_marker.on_click(lambda dest = dest, **kwargs: markers_popup.show(dest))
+
+        markers_layer.add(dest_marker)
+
+    return markers_layer
+
+
+def routes_widgets_layer(origin_coords: tuple, routes_summary, dests_coords, lines_popup: LazyPopup) -> LayerGroup:
+    """
+    ORIGIN -> DEST lines of routes, separate AntPath widget for every destination.
+    """
+    lines_layer = LayerGroup()
+
+    for dest, airline, dest_coords in zip(routes_summary['DEST'].astype(str), routes_summary['AIRLINE'], dests_coords.itertuples(index = False)):
         line = AntPath(
             locations = [
-                tuple(origin_coords.values()),
-                tuple(dest_coords.values()),
+                origin_coords,
+                (dest_coords.Latitude, dest_coords.Longitude),
             ],
-            color = color,
+            color = AIRLINE_COLORS[airline], # color of airline flying the route
             hardware_accelerated = True,
             delay = 1200,
             weight = 4
         )
 
-        line.popup = get_route_description(selected_origin, origin_city, dest, dest_city, distance, elapsed_time)
+        line.popup = lines_popup.widget
+        line.on_click(lambda dest = dest, **kwargs: lines_popup.show(dest))
 
-        # add markers and lines to layer groups
-        markers_layer.add(dest_marker)
         lines_layer.add(line)
-    
-    # add layers to the map
-    map.add(lines_layer)
-    markers_layer.add(origin_marker)
-    map.add(markers_layer)
 
-    map.center = tuple(origin_coords.values()) # center the map at ORIGIN marker
+    return lines_layer
+
+
+def route_style(feature: dict) -> dict:
+    """
+    Style of GeoJSON route or airport feature, driven by its properties.
+    """
+    properties = feature['properties']
+    if feature['geometry']['type'] == 'LineString':
+        return {'color': AIRLINE_COLORS[properties['airline']], 'weight': 4, 'opacity': 0.8}
+    if properties['origin']:
+        return {'color': 'green', 'fillColor': 'green', 'radius': 8}
+
+    return {'color': '#3388ff', 'fillColor': '#3388ff', 'radius': 5}
+
+
+def markers_geojson_layer(routes_summary, dests_coords, markers_popup: LazyPopup) -> GeoJSON:
+    """
+    DEST markers of routes as points of one GeoJSON layer.
+
+    Styles come from feature properties (see `route_style`). Features carry only their keys -
+    popup content is generated on first click from the routes summary (see `LazyPopup`).
+    """
+    points = [{
+        'type': 'Feature',
+        'geometry': {'type': 'Point', 'coordinates': [dest_coords.Longitude, dest_coords.Latitude]}, # GeoJSON positions are [lon, lat]
+        'properties': {'code': dest, 'origin': False}
+    } for dest, dest_coords in zip(routes_summary['DEST'].astype(str), dests_coords.itertuples(index = False))]
+
+    markers_layer = GeoJSON(
+        data = {'type': 'FeatureCollection', 'features': points},
+        point_style = {'radius': 5, 'weight': 1, 'fillOpacity': 0.8},
+        style_callback = route_style
+    )
+
+    # popup is bound to whole layer, clicked feature fills its content
+    markers_layer.popup = markers_popup.widget
+    markers_layer.on_click(lambda feature, **kwargs: markers_popup.show(feature['properties']['code']))
+
+    return markers_layer
+
+
+def routes_geojson_layer(origin_coords: tuple, routes_summary, dests_coords, lines_popup: LazyPopup) -> GeoJSON:
+    """
+    ORIGIN -> DEST lines of routes as lines of one GeoJSON layer, styled and described like `markers_geojson_layer`.
+    """
+    origin_point = [origin_coords[1], origin_coords[0]]
+    lines = [{
+        'type': 'Feature',
+        'geometry': {'type': 'LineString', 'coordinates': [origin_point, [dest_coords.Longitude, dest_coords.Latitude]]},
+        'properties': {'dest': dest, 'airline': airline}
+    } for dest, airline, dest_coords in zip(routes_summary['DEST'].astype(str), routes_summary['AIRLINE'], dests_coords.itertuples(index = False))]
+
+    lines_layer = GeoJSON(
+        data = {'type': 'FeatureCollection', 'features': lines},
+        style_callback = route_style,
+        hover_style = {'weight': 6, 'opacity': 1}
+    )
+
+    lines_layer.popup = lines_popup.widget
+    lines_layer.on_click(lambda feature, **kwargs: lines_popup.show(feature['properties']['dest']))
+
+    return lines_layer
+
+
+class NetworkLayer:
+    """
+    Layer of network mode of the map (connections or hubs). It has few features, so it is drawn whole
+    and showing it with other bounds adds nothing (same interface as `RoutesLayer`).
+    """
+    complete = True
+
+    def __init__(self, layer: LayerGroup):
+        self.layer = layer
+
+    def reveal(self, bounds: tuple = None) -> int:
+        return 0
+
+
+def network_style(feature: dict) -> dict:
+    """
+    Style of GeoJSON feature of network layers, driven by its properties.
+    """
+    properties = feature['properties']
+    if feature['geometry']['type'] == 'LineString':
+        return {'color': properties['color'], 'weight': properties['weight'], 'opacity': 0.8}
+
+    return {'color': properties['color'], 'fillColor': properties['color'], 'radius': properties['radius']}
+
+
+def connection_description_html(connection) -> str:
+    return f"""
+        <div>
+            <center> <b> {connection['route']} </b> </center> <br>
+            <i> Stops: {connection['stops']} </i> <br>
+            <i> Distance: {connection['distance']:.0f} (miles) </i> <br>
+            <i> Mean arrival delay: {connection['delay']:.1f} (minutes) </i> <br>
+            <i> Flights on the least served leg: {connection['flights']:.0f} </i>
+        </div>
+        """
+
+
+def hub_description_html(code: str, hub) -> str:
+    return f"""
+        <div>
+            <center> Hub <b> {code} </b> </center> <br>
+            <i> Destinations: {hub['destinations']} </i> <br>
+            <i> Origins: {hub['origins']} </i> <br>
+            <i> Departing flights: {hub['flights']} </i> <br>
+            <i> PageRank: {hub['pagerank']:.4f} </i>
+        </div>
+        """
+
+
+def network_points_layer(points: list, popup: LazyPopup, key: str) -> GeoJSON:
+    """
+    GeoJSON layer of `points` features, describing the clicked one in `popup` by its `key` property.
+    """
+    layer = GeoJSON(data = {'type': 'FeatureCollection', 'features': points}, point_style = {'weight': 1, 'fillOpacity': 0.7},
+                    style_callback = network_style)
+    layer.popup = popup.widget
+    layer.on_click(lambda feature, **kwargs: popup.show(feature['properties'][key]))
+
+    return layer
+
+
+def point_feature(coords, **properties) -> dict:
+    return {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [coords.Longitude, coords.Latitude]}, 'properties': properties}
+
+
+def connections_layer(selected_origin: str, dest: str, weight: str, months: tuple = None, airlines: tuple = ()) -> LayerGroup:
+    """
+    CONNECTIONS_DRAWN shortest connections from selected origin to `dest` colored by number of stops, with the best
+    path by `weight` above them, and their airports. None if there are no connections.
+    """
+    connections = find_connections(selected_origin, dest, months, airlines).head(CONNECTIONS_DRAWN)
+    best_path = find_path(selected_origin, dest, weight, months, airlines)
+    if connections.empty and best_path.empty:
+        return None
+
+    best_route = ' → '.join([selected_origin] + best_path['DEST'].tolist()) if not best_path.empty else None
+    if best_route is not None and best_route not in set(connections['route']):
+        best_connection = {'route': best_route, 'stops': len(best_path) - 1, 'distance': best_path['distance'].sum(),
+                           'delay': best_path['delay'].sum(), 'flights': best_path['flights'].min()}
+        connections = pd.concat([connections, pd.DataFrame([best_connection])], ignore_index = True)
+
+    paths = connections['route'].str.split(' → ')
+    airports = list(dict.fromkeys(airport for path in paths for airport in path))
+    coords, missing = lookup_coords(DATA.AIRPORT_COORDS, airports)
+    if missing:
+        logger.warning('No coordinates for airports %s - connections through them not drawn', missing)
+
+    described = connections.set_index('route')
+    lines_popup = LazyPopup(lambda route: connection_description_html(described.loc[route].to_dict() | {'route': route}))
+    cities = dict(origin.split(', ', 1) for origin in DATA.ORIGIN_AIRPORTS)
+    markers_popup = LazyPopup(lambda code: describe_airport(code, cities.get(code, '')))
+
+    lines = []
+    for route, path, stops in zip(connections['route'], paths, connections['stops']):
+        if any(airport in missing for airport in path):
+            continue
+        best = route == best_route
+        lines.append({
+            'type': 'Feature',
+            'geometry': {'type': 'LineString', 'coordinates': [[coords.at[a, 'Longitude'], coords.at[a, 'Latitude']] for a in path]},
+            'properties': {'route': route, 'color': NETWORK_COLORS['Best path'] if best else list(NETWORK_COLORS.values())[stops],
+                           'weight': 7 if best else 3}
+        })
+    lines.sort(key = lambda line: line['properties']['route'] == best_route) # best path is drawn last, above others
+
+    lines_layer = GeoJSON(data = {'type': 'FeatureCollection', 'features': lines}, style_callback = network_style,
+                          hover_style = {'opacity': 1})
+    lines_layer.popup = lines_popup.widget
+    lines_layer.on_click(lambda feature, **kwargs: lines_popup.show(feature['properties']['route']))
+
+    points = [point_feature(airport_coords, code = code, color = 'green' if code in (selected_origin, dest) else '#3388ff',
+                            radius = 8 if code in (selected_origin, dest) else 5)
+              for code, airport_coords in zip(coords.index, coords.itertuples(index = False))]
+
+    return LayerGroup(layers = [lines_layer, network_points_layer(points, markers_popup, 'code')])
+
+
+def hubs_layer(months: tuple = None, airlines: tuple = ()) -> LayerGroup:
+    """
+    HUBS_DRAWN most central airports (see `utils.hub_centrality`) as circles sized by their PageRank.
+    """
+    hubs = hub_centrality(months, airlines).head(HUBS_DRAWN)
+    coords, _ = lookup_coords(DATA.AIRPORT_COORDS, hubs.index.tolist())
+    if coords.empty:
+        return None
+
+    popup = LazyPopup(lambda code: hub_description_html(code, hubs.loc[code]))
+    top_rank = hubs['pagerank'].iloc[0]
+    points = [point_feature(airport_coords, code = code, color = HUB_COLOR, radius = float(4 + 16 * np.sqrt(hubs.at[code, 'pagerank'] / top_rank)))
+              for code, airport_coords in zip(coords.index, coords.itertuples(index = False))]
+
+    return LayerGroup(layers = [network_points_layer(points, popup, 'code')])
+
+
+def build_network_layer(selected_origin: str, network: tuple, months: tuple = None, airlines: tuple = ()) -> tuple:
+    """
+    Build layer of network mode of the map: ('connections', dest, weight) - connections from selected origin
+    to `dest`, ('hubs',) - hubs of the network, both of flights within `months` by `airlines`.
+
+    Returns the layer (None if there is nothing to draw), legend colors and coords of selected origin, like `build_routes_layer`.
+    """
+    try:
+        origin_coords = tuple(get_coords(DATA.AIRPORT_COORDS, selected_origin).values())
+    except KeyError:
+        origin_coords = None
+
+    if network[0] == 'connections':
+        layer, legend = connections_layer(selected_origin, network[1], network[2], months, airlines), NETWORK_COLORS
+    else:
+        layer, legend = hubs_layer(months, airlines), {'Hub (sized by PageRank)': HUB_COLOR}
+
+    return (NetworkLayer(layer) if layer is not None else None), legend, origin_coords
+
+
+def draw_routes(map: Map, selected_origin: str) -> None:
+    """
+    Draw airlines legend and routes from selected origin on the map.
+    """
+    routes_layer, airline_colors, origin_coords = build_routes_layer(selected_origin)
+
+    map.add(WidgetControl(widget = create_airline_legend(airline_colors), position = 'topright'))
+
+    if routes_layer is not None:
+        routes_layer.reveal() # all routes
+        map.add(routes_layer.layer)
+        map.center = origin_coords # center the map at ORIGIN marker
+
+
+def close_layer(layer) -> None:
+    """
+    Close widget models of layer, its sublayers, popups and icons, so they are released on both sides of the websocket.
+    """
+    for sublayer in getattr(layer, 'layers', ()):
+        close_layer(sublayer)
+
+    for widget in (getattr(layer, 'popup', None), getattr(layer, 'icon', None)):
+        if widget is not None:
+            for submodel in (getattr(widget, 'layout', None), getattr(widget, 'style', None)):
+                if submodel is not None:
+                    submodel.close()
+            widget.close()
+
+    layer.close()
+
+
+class MapLayerManager:
+    """
+    Swaps routes layers of selected origins on ipyleaflet.Map as whole units, drawing their routes as the map
+    view reaches them (see `RoutesLayer`).
+
+    Built layers of `cache_size` most recently selected views (origin with months and airlines filters and revision
+    of data, see `context_utils.LazyContext.publish`) are kept
+    in LRU cache, so switching back to one of them only adds a single, already synced LayerGroup instead of
+    re-creating its widgets. Airlines legend is created once and only its contents are updated when airlines change.
+    """
+
+    def __init__(self, map: Map, cache_size: int = LAYER_CACHE_SIZE):
+        self.map_ref = weakref.ref(map) # the manager is a value of LAYER_MANAGERS keyed by the map, it must not keep the map alive
+        self.cache_size = max(cache_size, 1)
+        self.layers = OrderedDict() # (origin, months, airlines, revision, network) -> (RoutesLayer or NetworkLayer, legend colors, origin coords)
+        self.current_view = None
+
+        self.airline_colors = None
+        self.legend = HTML()
+        self.map.add(WidgetControl(widget = self.legend, position = 'topright'))
+
+    @property
+    def map(self) -> Map:
+        return self.map_ref()
+
+    def get_layer(self, view: tuple) -> tuple:
+        """
+        Get layer of view (origin, months, airlines, revision, network) from cache or build it.
+        """
+        if view in self.layers:
+            self.layers.move_to_end(view)
+        else:
+            origin, months, airlines, _, network = view
+            if network is None:
+                self.layers[view] = build_routes_layer(origin, months = months, airlines = airlines)
+            else:
+                self.layers[view] = build_network_layer(origin, network, months = months, airlines = airlines)
+
+        return self.layers[view]
+
+    def evict(self) -> None:
+        """
+        Close least recently used layers above cache size (currently drawn layer is never evicted).
+        """
+        for view in list(self.layers):
+            if len(self.layers) <= self.cache_size:
+                break
+            if view != self.current_view:
+                routes_layer, _, _ = self.layers.pop(view)
+                if routes_layer is not None:
+                    close_layer(routes_layer.layer)
+
+    def update_legend(self, airline_colors: dict, title: str = 'Airline Colors Legend') -> None:
+        """
+        Update legend contents only if airlines (or other legend items) differ from the ones drawn.
+        """
+        if airline_colors != self.airline_colors:
+            self.legend.value = airline_legend_html(airline_colors, title)
+            self.airline_colors = airline_colors
+
+    def show(self, origin: str, months: tuple = None, airlines: tuple = (), revision: int = 0, network: tuple = None,
+             bounds: tuple = None) -> None:
+        """
+        Replace drawn routes with routes from origin within `months` by `airlines`, built from `revision` of data
+        (layers of older revisions are not reused), or with layer of `network` mode (see `build_network_layer`).
+        Only routes visible within map view `bounds` are drawn (all if bounds are not known yet), showing the same
+        view again with other bounds adds routes visible there.
+        """
+        bounds = known_bounds(bounds)
+        view = (origin, months, tuple(airlines), revision, network)
+        if view == self.current_view:
+            routes_layer = self.layers[view][0]
+            if routes_layer is not None and not routes_layer.complete:
+                routes_layer.reveal(bounds)
+            return
+
+        routes_layer, airline_colors, origin_coords = self.get_layer(view)
+
+        if self.current_view is not None:
+            current_layer = self.layers[self.current_view][0]
+            if current_layer is not None and current_layer.layer in self.map.layers:
+                self.map.remove_layer(current_layer.layer)
+
+        if routes_layer is not None:
+            if (self.current_view is None or origin != self.current_view[0]) and origin_coords is not None:
+                self.map.center = origin_coords # center the map at new ORIGIN marker, filters and modes keep the view
+                bounds = centered_bounds(bounds, origin_coords) if bounds is not None else None
+            routes_layer.reveal(bounds)
+            self.map.add(routes_layer.layer)
+
+        self.update_legend(airline_colors, 'Airline Colors Legend' if network is None else 'Network Legend')
+        self.current_view = view
+        self.evict()
+
+
+def get_layer_manager(map: Map) -> MapLayerManager:
+    """
+    Get layer manager of the map, create one on first use.
+    """
+    if map not in LAYER_MANAGERS:
+        LAYER_MANAGERS[map] = MapLayerManager(map)
+
+    return LAYER_MANAGERS[map]
+
+
+def close_layer_manager(map: Map) -> None:
+    """
+    Close the map with its cached layers and legend when its session ends - widgets stay registered in ipywidgets
+    (and so in memory) until they are closed.
+    """
+    manager = LAYER_MANAGERS.pop(map, None)
+    if manager is not None:
+        for routes_layer, _, _ in manager.layers.values():
+            if routes_layer is not None:
+                close_layer(routes_layer.layer)
+        manager.layers.clear()
+        manager.legend.close()
+
+    for control in list(map.controls):
+        control.close()
+    for layer in list(map.layers):
+        close_layer(layer)
+    map.close()
 
 
 
@@ -150,6 +686,14 @@ def create_airline_legend(airline_colors: dict) -> HTML:
     """
     Create legend widget of airlines 
     """
+    # Create the HTML widget and return it
+    return HTML(value=airline_legend_html(airline_colors))
+
+
+def airline_legend_html(airline_colors: dict, title: str = 'Airline Colors Legend') -> str:
+    """
+    HTML content of airlines legend (or of other items with colors)
+    """
     # Start the HTML content with styles
     html_content = """
                 <style>
@@ -174,7 +718,8 @@ def create_airline_legend(airline_colors: dict) -> HTML:
                     }
                 </style>
                 <div>
-                    <h2>Airline Colors Legend</h2>
+                    """
+    html_content += f"""<h2>{title}</h2>
                     <ul class="legend">
                     """
     
@@ -192,10 +737,7 @@ def create_airline_legend(airline_colors: dict) -> HTML:
     opacity_style = "<style>.color-box { opacity: 0.8; }</style>"
     html_content = html_content.replace("</style>", f"{opacity_style}</style>")
     
-    # Create the HTML widget and return it
-    return HTML(value=html_content)
-
-
-
+    return html_content
 
 
+instrument_module(sys.modules[__name__]) # latencies of functions and layer manager methods above (see metrics_utils)
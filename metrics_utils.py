@@ -0,0 +1,353 @@
+"""
+This file contains instrumentation of the application: latencies and payload sizes of its functions.
+
+Functions of utils and map_utils modules are wrapped by `instrument_module`, reactive calcs, effects and renders
+of the app by `timed`. Every call records its latency into a histogram with logarithmic buckets and the size of its
+result (frames, strings), so that the time of a slow view can be split between aggregation, building of widgets and
+serialization of charts. Metrics are shown in Diagnostics panel of the app and can be logged as JSON lines.
+"""
+
+import bisect
+import cProfile
+import functools
+import inspect
+import io
+import json
+import logging
+import os
+import pstats
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+#################################################################################
+
+# Variables
+
+METRICS_ENABLED = os.environ.get('FLIGHTS_METRICS', '1') != '0' # instrumentation costs microseconds per call, tens per frame of result
+METRICS_LOG_INTERVAL = float(os.environ.get('FLIGHTS_METRICS_LOG', '0')) # seconds between JSON log lines, 0 - off
+DIAGNOSTICS_PANEL = os.environ.get('FLIGHTS_DIAGNOSTICS', '0') == '1' # Diagnostics nav panel is hidden unless enabled
+
+# Upper bounds of latency histogram buckets (ms), the last bucket is unbounded
+LATENCY_BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+PROFILE_TOP = 40 # functions listed in profile report
+
+
+#################################################################################
+# Metrics
+
+class LatencyHistogram:
+    """
+    Counts of latencies in LATENCY_BUCKETS_MS with their sum and maximum. Quantiles are upper bounds of buckets.
+    """
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1) # plain list and bisect - numpy costs microseconds per call
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> float:
+        position = int(np.searchsorted(np.cumsum(self.counts), q * self.count))
+        return float(LATENCY_BUCKETS_MS[position]) if position < len(LATENCY_BUCKETS_MS) else self.max_ms
+
+
+class Metrics:
+    """
+    Thread-safe registry of latency histograms and payload sizes of instrumented functions, keyed by name.
+    """
+    def __init__(self):
+        self.latencies = {}
+        self.payloads = {} # name -> [number of measured results, sum of bytes, max bytes]
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def observe(self, name: str, ms: float, payload: int = None, error: bool = False) -> None:
+        with self.lock:
+            histogram = self.latencies.get(name)
+            if histogram is None:
+                histogram = self.latencies[name] = LatencyHistogram()
+            histogram.observe(ms)
+            if payload is not None:
+                sizes = self.payloads.setdefault(name, [0, 0, 0])
+                sizes[0] += 1
+                sizes[1] += payload
+                sizes[2] = max(sizes[2], payload)
+            if error:
+                self.errors[name] = self.errors.get(name, 0) + 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.latencies.clear()
+            self.payloads.clear()
+            self.errors.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Machine-readable metrics: {name: {calls, errors, mean/p50/p90/p99/max latency, payload sizes, histogram}}.
+        """
+        with self.lock:
+            snapshot = {}
+            for name, histogram in self.latencies.items():
+                payload = self.payloads.get(name)
+                snapshot[name] = {
+                    'calls': histogram.count,
+                    'errors': self.errors.get(name, 0),
+                    'mean_ms': histogram.total_ms / histogram.count,
+                    'p50_ms': histogram.quantile(0.5),
+                    'p90_ms': histogram.quantile(0.9),
+                    'p99_ms': histogram.quantile(0.99),
+                    'max_ms': histogram.max_ms,
+                    'total_ms': histogram.total_ms,
+                    'mean_payload_bytes': payload[1] / payload[0] if payload else None,
+                    'max_payload_bytes': payload[2] if payload else None,
+                    'histogram': dict(zip([f'<={bound:g}' for bound in LATENCY_BUCKETS_MS] + ['inf'], histogram.counts))
+                }
+
+        return snapshot
+
+    def frame(self) -> pd.DataFrame:
+        """
+        Metrics as a table sorted by total time spent in functions.
+        """
+        snapshot = self.snapshot()
+        if not snapshot:
+            return pd.DataFrame(columns = ['function', 'calls', 'errors', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms', 'total_ms'])
+
+        metrics = pd.DataFrame.from_dict(snapshot, orient = 'index').drop(columns = 'histogram')
+        metrics = metrics.sort_values('total_ms', ascending = False).rename_axis('function').reset_index()
+
+        return metrics.round(3)
+
+
+METRICS = Metrics() # shared by all sessions of the process
+
+
+#################################################################################
+# Functions
+
+def payload_size(value) -> int:
+    """
+    Size in bytes of result of function: bytes of columns of frames (and of dicts or tuples of them), length of strings.
+    None for other values.
+
+    Index is left out and object columns count only their pointers - `memory_usage` of a frame with MultiIndex takes milliseconds,
+    and results are sized on every call, cache hits included.
+    """
+    if isinstance(value, pd.DataFrame):
+        return sum(col.array.nbytes for _, col in value.items())
+    if isinstance(value, pd.Series):
+        return value.array.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (dict, tuple, list)):
+        sizes = [payload_size(item) for item in (value.values() if isinstance(value, dict) else value)]
+        sizes = [size for size in sizes if size is not None]
+        return sum(sizes) if sizes else None
+    return None
+
+
+def timed(name: str = None, metrics: Metrics = METRICS):
+    """
+    Decorator recording latency and payload size of every call of function (also async) into `metrics`
+    under `name` ('<module>.<qualified name>' by default, Shiny Express app file has no module - its file name is used).
+    """
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+        module = function.__module__ or os.path.splitext(os.path.basename(function.__code__.co_filename))[0]
+        key = name or f'{module}.{function.__qualname__}'
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                start, result, error = time.perf_counter(), None, True
+                try:
+                    result = await function(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    metrics.observe(key, (time.perf_counter() - start) * 1000, payload_size(result), error)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start, result, error = time.perf_counter(), None, True
+                try:
+                    result = function(*args, **kwargs)
+                    error = False
+                    return result
+                finally:
+                    metrics.observe(key, (time.perf_counter() - start) * 1000, payload_size(result), error)
+
+        wrapper.__instrumented__ = True
+        return wrapper
+
+    return decorator
+
+
+def instrument_module(module, metrics: Metrics = METRICS) -> None:
+    """
+    Wrap public functions defined in `module` and public methods of its classes with `timed`.
+
+    Calls inside the module go through its globals, so they are timed too. Modules importing names
+    from `module` afterwards get the wrapped functions.
+    """
+    if not METRICS_ENABLED:
+        return
+
+    for attribute, value in list(vars(module).items()):
+        if attribute.startswith('_') or getattr(value, '__module__', None) != module.__name__:
+            continue
+        if inspect.isfunction(value) and not getattr(value, '__instrumented__', False):
+            setattr(module, attribute, timed(metrics = metrics)(value))
+        elif inspect.isclass(value):
+            for method_name, method in list(vars(value).items()):
+                if inspect.isfunction(method) and not method_name.startswith('_') and not getattr(method, '__instrumented__', False):
+                    setattr(value, method_name, timed(metrics = metrics)(method))
+
+
+def instrument_altair(metrics: Metrics = METRICS) -> None:
+    """
+    Time serialization of Altair charts (`to_dict`, called when a chart is sent to the browser).
+    """
+    if not METRICS_ENABLED:
+        return
+
+    import altair as alt
+
+    if not getattr(alt.TopLevelMixin.to_dict, '__instrumented__', False):
+        alt.TopLevelMixin.to_dict = timed('altair.to_dict', metrics)(alt.TopLevelMixin.to_dict)
+
+
+def start_metrics_log(interval: float = METRICS_LOG_INTERVAL, metrics: Metrics = METRICS) -> threading.Thread:
+    """
+    Log snapshot of `metrics` as a JSON line every `interval` seconds in a daemon thread (nothing if `interval` is 0).
+    """
+    if not METRICS_ENABLED or interval <= 0:
+        return None
+
+    if not logger.handlers: # the stream is opt-in, so it is shown whatever the level of root logger
+        logger.addHandler(logging.StreamHandler())
+        logger.setLevel(logging.INFO)
+
+    def run():
+        while True:
+            time.sleep(interval)
+            logger.info(json.dumps({'time': time.time(), 'metrics': metrics.snapshot()}))
+
+    thread = threading.Thread(target = run, name = 'metrics-log', daemon = True)
+    thread.start()
+
+    return thread
+
+
+#################################################################################
+# Profiling
+
+class ProfileCapture:
+    """
+    Opt-in cProfile capture of the event loop thread and of tasks run in worker pool (see `profiled_task`),
+    started and stopped from Diagnostics panel.
+
+    cProfile profiles the thread it is enabled in - the event loop shared by all sessions of the process,
+    so the capture also contains work of other sessions running at the same time. Tasks of the pool are profiled
+    one by one in their threads and added to the capture when they end.
+    """
+    lock = threading.Lock() # one capture per process at a time
+    active = None # capture running in the process
+    task_lock = threading.Lock() # guards profiles of tasks added from worker threads
+
+    def __init__(self):
+        self.profile = None
+        self.task_profiles = []
+        self.stats = None
+
+    @property
+    def running(self) -> bool:
+        return self.profile is not None
+
+    def start(self) -> bool:
+        """
+        Start capture, False if other capture of the process is running.
+        """
+        if self.running or not ProfileCapture.lock.acquire(blocking = False):
+            return False
+        self.task_profiles = []
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+        ProfileCapture.active = self
+        return True
+
+    def stop(self) -> None:
+        """
+        Stop capture (also when its session ends, so the process can be profiled again). Tasks still running
+        are left out.
+        """
+        if not self.running:
+            return
+        self.profile.disable()
+        ProfileCapture.active = None
+        with ProfileCapture.task_lock:
+            self.stats = pstats.Stats(self.profile)
+            for task_profile in self.task_profiles:
+                self.stats.add(task_profile)
+            self.profile = None
+        ProfileCapture.lock.release()
+
+    def add_task(self, profile: cProfile.Profile) -> None:
+        with ProfileCapture.task_lock:
+            if self.running:
+                self.task_profiles.append(profile)
+
+    def report(self, top: int = PROFILE_TOP) -> str:
+        """
+        Functions of the last capture with the most cumulative time.
+        """
+        if self.stats is None:
+            return ''
+        output = io.StringIO()
+        self.stats.stream = output
+        self.stats.sort_stats('cumulative').print_stats(top)
+        return output.getvalue()
+
+    def dump(self, path: str) -> None:
+        """
+        Write the last capture in pstats format (for snakeviz, pstats...).
+        """
+        self.stats.dump_stats(path)
+
+
+def profiled_task(function):
+    """
+    Wrap `function` submitted to a worker thread, so that its calls are added to the capture running in the process
+    (cProfile does not see other threads than the one it is enabled in). Unchanged when nothing is captured.
+    """
+    capture = ProfileCapture.active
+    if capture is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            capture.add_task(profile)
+
+    return wrapper
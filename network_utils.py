@@ -0,0 +1,278 @@
+"""
+This file contains the route graph of airports and connectivity queries over it for the network modes of the map.
+
+Airports are nodes and routes are directed edges in compressed sparse row (CSR) layout: edges leaving an airport
+are a contiguous slice of plain arrays, so neighbours are found by slicing. Connections are enumerated by
+vectorized expansion of these slices, best paths by heap-based search and hub centrality by power iteration.
+"""
+
+import heapq
+
+import numpy as np
+import pandas as pd
+
+
+#################################################################################
+
+# Variables
+
+EDGE_COLUMNS = ['flights', 'distance', 'delay'] # weights of routes: number of flights, mean DISTANCE, mean ARR_DELAY
+PATH_WEIGHTS = ['distance', 'delay'] # best path is the shortest one or the one with least delay
+LEG_TIE_BREAK = 1e-6 # added to weight of every leg, so paths of equal weight with fewer legs are preferred
+
+PAGERANK_DAMPING = 0.85
+PAGERANK_TOLERANCE = 1e-10
+PAGERANK_ITERATIONS = 100
+
+
+#################################################################################
+# Functions
+
+def route_index_edges(routes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Edges of route graph (EDGE_COLUMNS indexed by ORIGIN, DEST) out of route index of all flights
+    (see `aggregate_utils.build_route_index`). Every flight has scheduled departure, so its count is number of flights.
+    """
+    return pd.DataFrame({
+        'flights': routes['CRS_DEP_TIME_count'],
+        'distance': routes['DISTANCE_mean'],
+        'delay': routes['ARR_DELAY_mean']
+    })
+
+
+def cube_edges(cube: pd.DataFrame, months: tuple = None, airlines: tuple = ()) -> pd.DataFrame:
+    """
+    Edges of route graph of flights within `months` ('YYYY-MM' first and last) by `airlines` (all if empty),
+    rolled up from cells of cube (see `cube_utils.build_cube`) with filters evaluated once per level value
+    and sums of routes computed in vectorized passes (np.bincount) over level codes.
+    """
+    index = cube.index
+    levels = dict(zip(index.names, index.levels))
+    codes = dict(zip(index.names, index.codes))
+
+    mask = np.ones(len(cube), dtype = bool)
+    if months is not None:
+        month_selected = (levels['MONTH'] >= months[0]) & (levels['MONTH'] <= months[1])
+        mask &= np.asarray(month_selected)[codes['MONTH']]
+    if airlines:
+        mask &= np.asarray(levels['AIRLINE'].isin(airlines))[codes['AIRLINE']]
+
+    n_dests = len(levels['DEST'])
+    route_ids, keys = pd.factorize(codes['ORIGIN'][mask].astype('int64') * n_dests + codes['DEST'][mask], sort = True)
+    sums = {col: np.bincount(route_ids, weights = cube[col].to_numpy()[mask], minlength = len(keys))
+            for col in ['FLIGHTS', 'DISTANCE_sum', 'DISTANCE_count', 'ARR_DELAY_sum', 'ARR_DELAY_count']}
+
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        return pd.DataFrame({
+            'flights': sums['FLIGHTS'],
+            'distance': np.where(sums['DISTANCE_count'] > 0, sums['DISTANCE_sum'] / sums['DISTANCE_count'], np.nan),
+            'delay': np.where(sums['ARR_DELAY_count'] > 0, sums['ARR_DELAY_sum'] / sums['ARR_DELAY_count'], np.nan)
+        }, index = pd.MultiIndex.from_arrays([levels['ORIGIN'][keys // n_dests], levels['DEST'][keys % n_dests]], names = ['ORIGIN', 'DEST']))
+
+
+#################################################################################
+# Route graph
+
+class RouteGraph:
+    """
+    Directed graph of airports in CSR layout.
+
+    Airports are nodes numbered by their position in sorted `airports`. Edges leaving node i are positions
+    `indptr[i]:indptr[i + 1]` of `sources`, `indices` (DEST nodes) and of weights `flights`, `distance` (miles) and
+    `delay` (minutes of ARR_DELAY, negative for early arrivals). Edges entering node i are positions
+    `in_indptr[i]:in_indptr[i + 1]` of `in_edges` (reverse CSR).
+    """
+
+    def __init__(self, edges: pd.DataFrame):
+        # nodes out of distinct airports (levels of the index), edges out of level codes
+        index = edges.index.remove_unused_levels()
+        origins, dests = (index.levels[index.names.index(key)].astype(str) for key in ['ORIGIN', 'DEST'])
+        self.airports = origins.union(dests).rename('AIRPORT')
+        n = len(self.airports)
+
+        sources = self.airports.get_indexer(origins)[index.codes[index.names.index('ORIGIN')]]
+        indices = self.airports.get_indexer(dests)[index.codes[index.names.index('DEST')]]
+        order = np.lexsort((indices, sources))
+
+        self.sources = sources[order]
+        self.indices = indices[order]
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(self.sources, minlength = n))])
+        for col in EDGE_COLUMNS:
+            setattr(self, col, edges[col].to_numpy(dtype = 'float64', na_value = np.nan)[order])
+
+        self.in_edges = np.argsort(self.indices, kind = 'stable')
+        self.in_indptr = np.concatenate([[0], np.cumsum(np.bincount(self.indices, minlength = n))])
+
+    def node(self, airport: str) -> int:
+        """
+        Node of airport, -1 if it has no routes.
+        """
+        return int(self.airports.get_indexer([airport])[0])
+
+    def out_edges(self, nodes: np.ndarray) -> tuple:
+        """
+        Edges leaving every node of `nodes` and position in `nodes` of the node each edge leaves.
+        """
+        starts, ends = self.indptr[nodes], self.indptr[nodes + 1]
+        lengths = ends - starts
+        positions = np.repeat(np.arange(len(nodes)), lengths)
+        edges = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths) + np.repeat(starts, lengths)
+
+        return edges, positions
+
+    def edges_into(self, node: int) -> np.ndarray:
+        """
+        Edge from every node into `node`, -1 where there is no such route.
+        """
+        edges = self.in_edges[self.in_indptr[node]:self.in_indptr[node + 1]]
+        lookup = np.full(len(self.airports), -1)
+        lookup[self.sources[edges]] = edges
+
+        return lookup
+
+    def edge_weights(self, weight: str) -> np.ndarray:
+        """
+        Non-negative weights of edges for path search: mean distance, or mean arrival delay with early arrivals
+        counted as no delay. Routes without the mean (all flights cancelled) are not used.
+        """
+        if weight not in PATH_WEIGHTS:
+            raise ValueError(f'Unknown path weight {weight!r}, expected one of {PATH_WEIGHTS}')
+        weights = self.distance if weight == 'distance' else np.clip(self.delay, 0, None)
+
+        return np.where(np.isnan(weights), np.inf, weights) + LEG_TIE_BREAK
+
+    def paths_frame(self, legs: list) -> pd.DataFrame:
+        """
+        Frame of paths given by their legs (one array of edges per leg, paths in rows): airports of the path,
+        number of stops, total distance and delay and the smallest number of flights of its legs.
+        """
+        codes = self.airports.to_numpy()
+        route = codes[self.sources[legs[0]]]
+        for leg in legs:
+            route = route + ' → ' + codes[self.indices[leg]]
+
+        return pd.DataFrame({
+            'route': route,
+            'stops': len(legs) - 1,
+            'distance': sum(self.distance[leg] for leg in legs),
+            'delay': sum(self.delay[leg] for leg in legs),
+            'flights': np.minimum.reduce([self.flights[leg] for leg in legs])
+        })
+
+    def connections(self, origin: str, dest: str, max_stops: int = 2, limit: int = None) -> pd.DataFrame:
+        """
+        Direct, one-stop and two-stop (up to `max_stops`) connections from `origin` to `dest` without revisiting
+        airports, shortest first (at most `limit`). Empty if either airport has no routes.
+        """
+        o, d = self.node(origin), self.node(dest)
+        paths = []
+        if o >= 0 and d >= 0 and o != d:
+            into_dest = self.edges_into(d)
+
+            first, _ = self.out_edges(np.array([o]))
+            if into_dest[o] >= 0:
+                paths.append([np.array([into_dest[o]])])
+
+            first = first[self.indices[first] != d]
+            stops = self.indices[first]
+            if max_stops >= 1:
+                reach = into_dest[stops] >= 0
+                paths.append([first[reach], into_dest[stops[reach]]])
+
+            if max_stops >= 2:
+                second, positions = self.out_edges(stops)
+                second_stops = self.indices[second]
+                reach = (into_dest[second_stops] >= 0) & (second_stops != o) & (second_stops != d)
+                paths.append([first[positions[reach]], second[reach], into_dest[second_stops[reach]]])
+
+        paths = [legs for legs in paths if len(legs[0])]
+        if not paths:
+            return pd.DataFrame({'route': pd.Series(dtype = object), 'stops': pd.Series(dtype = 'int64'),
+                                 **{col: pd.Series(dtype = 'float64') for col in ['distance', 'delay', 'flights']}})
+
+        # shortest paths are selected before frames of them (and their airports as text) are built
+        distances = np.concatenate([sum(self.distance[leg] for leg in legs) for legs in paths])
+        groups = np.repeat(np.arange(len(paths)), [len(legs[0]) for legs in paths])
+        selected = np.zeros(len(distances), dtype = bool)
+        selected[np.lexsort((groups, distances))[:limit]] = True
+
+        connections = pd.concat([self.paths_frame([leg[selected[groups == group]] for leg in legs]) for group, legs in enumerate(paths)],
+                                ignore_index = True)
+
+        return connections.sort_values(['distance', 'stops'], kind = 'stable', ignore_index = True)
+
+    def shortest_path(self, origin: str, dest: str, weight: str = 'distance') -> pd.DataFrame:
+        """
+        Legs (ORIGIN, DEST, flights, distance, delay) of the path from `origin` to `dest` with the least total
+        `weight` (see `edge_weights`), found by Dijkstra search over CSR slices. Empty if `dest` is not reachable.
+        """
+        weights = self.edge_weights(weight)
+        o, d = self.node(origin), self.node(dest)
+        n = len(self.airports)
+
+        best = np.full(n, np.inf)
+        via = np.full(n, -1) # edge of the best path into every node
+        done = np.zeros(n, dtype = bool)
+        heap = []
+        if o >= 0 and d >= 0:
+            best[o] = 0
+            heap.append((0.0, o))
+
+        while heap:
+            length, node = heapq.heappop(heap)
+            if done[node]:
+                continue
+            done[node] = True
+            if node == d:
+                break
+
+            edges = np.arange(self.indptr[node], self.indptr[node + 1])
+            lengths = length + weights[edges]
+            better = lengths < best[self.indices[edges]]
+            for edge, new_length in zip(edges[better], lengths[better]):
+                best[self.indices[edge]], via[self.indices[edge]] = new_length, edge
+                heapq.heappush(heap, (new_length, int(self.indices[edge])))
+
+        legs = []
+        node = d if d >= 0 and done[d] and o != d else -1
+        while node >= 0 and node != o:
+            legs.insert(0, via[node])
+            node = self.sources[via[node]]
+
+        legs = np.array(legs, dtype = 'int64')
+        codes = self.airports.to_numpy()
+
+        return pd.DataFrame({
+            'ORIGIN': codes[self.sources[legs]], 'DEST': codes[self.indices[legs]],
+            **{col: getattr(self, col)[legs] for col in EDGE_COLUMNS}
+        })
+
+    def centrality(self) -> pd.DataFrame:
+        """
+        Hub statistics of every airport: numbers of destinations and origins of its routes, departing flights and
+        PageRank of the network weighted by flights (share of time a passenger following flights spends at the airport),
+        highest PageRank first.
+        """
+        n = len(self.airports)
+        flights = np.nan_to_num(self.flights)
+        departing = np.bincount(self.sources, weights = flights, minlength = n)
+        sinks = departing == 0
+
+        rank = np.full(n, 1 / max(n, 1)) # no airports without flights of selected airlines
+        for _ in range(PAGERANK_ITERATIONS if n else 0):
+            shares = np.divide(rank, departing, out = np.zeros(n), where = ~sinks)
+            flow = np.bincount(self.indices, weights = shares[self.sources] * flights, minlength = n)
+            new_rank = (1 - PAGERANK_DAMPING) / n + PAGERANK_DAMPING * (flow + rank[sinks].sum() / n)
+            converged = np.abs(new_rank - rank).sum() < PAGERANK_TOLERANCE
+            rank = new_rank
+            if converged:
+                break
+
+        hubs = pd.DataFrame({
+            'destinations': np.diff(self.indptr),
+            'origins': np.diff(self.in_indptr),
+            'flights': departing.astype('int64'),
+            'pagerank': rank
+        }, index = self.airports)
+
+        return hubs.sort_values('pagerank', ascending = False, kind = 'stable')
@@ -0,0 +1,107 @@
+"""
+This file contains utilities for sharing flights data between worker processes of the application.
+
+One process publishes frames into uncompressed Arrow IPC files, every worker maps them into memory.
+Numeric columns of mapped frames point straight into the page cache of the files, so all workers share
+one copy of the data and a new worker starts without reading or parsing anything.
+"""
+
+import os
+from contextlib import contextmanager
+
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import is_float_dtype
+
+try:
+    import fcntl
+except ImportError: # not available on Windows - publishing is not guarded against concurrent workers there
+    fcntl = None
+
+
+#################################################################################
+
+# Variables
+
+VERSION_FILE = 'VERSION' # version of dataset published in shared directory, written last
+
+
+#################################################################################
+# Functions
+
+def frame_to_table(frame: pd.DataFrame) -> pa.Table:
+    """
+    Arrow table of `frame` that converts back to pandas without copying numeric columns.
+
+    Float columns keep NaN as values instead of Arrow nulls, which pandas would have to fill in a copy.
+    """
+    table = pa.Table.from_pandas(frame, preserve_index = True)
+
+    for col in frame.columns:
+        if is_float_dtype(frame[col]):
+            position = table.schema.get_field_index(col)
+            table = table.set_column(position, col, pa.array(frame[col].to_numpy(), from_pandas = False))
+
+    return table
+
+
+def publish_frames(frames: dict, shared_path: str, version: str) -> None:
+    """
+    Write `frames` ({name: frame}) into Arrow IPC files '<name>.arrow' of `shared_path` and mark them as `version`.
+
+    Files are replaced atomically, workers that already mapped previous files keep reading them.
+    """
+    os.makedirs(shared_path, exist_ok = True)
+
+    for name, frame in frames.items():
+        table = frame_to_table(frame)
+        path = os.path.join(shared_path, f'{name}.arrow')
+
+        with pa.OSFile(path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(path + '.tmp', path)
+
+    with open(os.path.join(shared_path, VERSION_FILE + '.tmp'), 'w') as f:
+        f.write(version)
+    os.replace(os.path.join(shared_path, VERSION_FILE + '.tmp'), os.path.join(shared_path, VERSION_FILE))
+
+
+def shared_version(shared_path: str) -> str:
+    """
+    Version of dataset published in `shared_path`, None if nothing is published.
+    """
+    try:
+        with open(os.path.join(shared_path, VERSION_FILE), 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def attach_frames(shared_path: str, names: list) -> dict:
+    """
+    Map frames `names` published in `shared_path` into memory. Numeric columns are read-only views of the files.
+    """
+    frames = {}
+    for name in names:
+        source = pa.memory_map(os.path.join(shared_path, f'{name}.arrow'))
+        frames[name] = pa.ipc.open_file(source).read_all().to_pandas(split_blocks = True)
+
+    return frames
+
+
+@contextmanager
+def shared_lock(shared_path: str):
+    """
+    Exclusive lock of `shared_path` across processes, so that only one worker publishes data.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(shared_path)), exist_ok = True)
+
+    with open(shared_path.rstrip('/') + '.lock', 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
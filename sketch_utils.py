@@ -0,0 +1,181 @@
+"""
+This file contains mergeable quantile sketches of delays and durations of flights, per route and per airline.
+
+A sketch is a histogram of values over fixed buckets of bounded relative width (DDSketch): bucket k > 0 holds
+values v with GAMMA**(k - 2) < v <= GAMMA**(k - 1), bucket -k the same negative values and bucket 0 values
+between -1 and 1. Quantiles read from a sketch are within SKETCH_ACCURACY of true values, sketches of separate
+chunks of flights are merged by adding counts of the same buckets and a sketch never has more than
+2 * MAX_BUCKET + 1 buckets, however many flights it counts.
+
+Sketches of many keys (routes, airlines) are kept in one frame indexed by (*keys, BUCKET) with counts of values
+of every SKETCH_COLUMNS column - only non-empty buckets are stored, like cells of cube (see cube_utils).
+"""
+
+import numpy as np
+import pandas as pd
+
+from stats_utils import histogram_edges
+
+
+#################################################################################
+
+# Variables
+
+SKETCH_COLUMNS = ['DEP_DELAY', 'ARR_DELAY', 'TAXI_OUT', 'TAXI_IN', 'ELAPSED_TIME'] # minutes, sketched per route and airline
+SKETCH_ACCURACY = 0.02 # relative error of quantiles read from sketches
+GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+MAX_BUCKET = int(np.ceil(np.log(1e5) / np.log(GAMMA))) + 1 # values beyond 100,000 minutes fall into the last bucket
+
+SKETCH_QUANTILES = {'p50': 0.5, 'p90': 0.9, 'p99': 0.99} # percentiles shown in the app
+
+ROUTE_SKETCH_KEYS = ['ORIGIN', 'DEST']
+AIRLINE_SKETCH_KEYS = ['AIRLINE']
+
+# Columns of FLIGHTS needed to build sketches
+SKETCH_FLIGHTS_COLUMNS = ROUTE_SKETCH_KEYS + AIRLINE_SKETCH_KEYS + SKETCH_COLUMNS
+
+
+#################################################################################
+# Functions
+
+def sketch_buckets(values: np.ndarray) -> np.ndarray:
+    """
+    Bucket of every value (values must not be missing).
+    """
+    magnitudes = np.abs(values)
+    with np.errstate(divide = 'ignore'):
+        buckets = np.ceil(np.log(np.maximum(magnitudes, 1)) / np.log(GAMMA)) + 1
+
+    buckets = np.where(magnitudes < 1, 0, np.minimum(buckets, MAX_BUCKET))
+
+    return (np.sign(values) * buckets).astype('int64')
+
+
+def bucket_values(buckets: np.ndarray) -> np.ndarray:
+    """
+    Value representing every bucket: the one with the same relative distance to both bounds of the bucket.
+    """
+    buckets = np.asarray(buckets)
+    magnitudes = 2 * GAMMA ** (np.abs(buckets) - 1) / (GAMMA + 1)
+
+    return np.where(buckets == 0, 0.0, np.sign(buckets) * magnitudes)
+
+
+def build_sketches(flights: pd.DataFrame, keys: list, columns: list = SKETCH_COLUMNS) -> pd.DataFrame:
+    """
+    Sketches of `columns` of flights within groups of `keys`: counts of values of every column indexed by sorted
+    (*keys, BUCKET), computed with vectorized passes (np.bincount) like cells of cube. Flights with a missing key
+    are not sketched.
+    """
+    n_buckets = 2 * MAX_BUCKET + 1
+    key_values = [flights[key].astype('category').array for key in keys]
+    keyed = np.logical_and.reduce([key.codes >= 0 for key in key_values]) # missing key (code -1) would shift the group key into a neighbouring group
+
+    group_keys = np.zeros(len(flights), dtype = 'int64')
+    for key in key_values:
+        group_keys = group_keys * len(key.categories) + key.codes
+
+    # cell of every value of every column, counted per column over cells of all columns
+    cells, present = [], []
+    for col in columns:
+        values = flights[col].to_numpy(dtype = 'float64', na_value = np.nan)
+        present.append(~np.isnan(values) & keyed)
+        cells.append(group_keys[present[-1]] * n_buckets + sketch_buckets(values[present[-1]]) + MAX_BUCKET)
+
+    cell_ids, cell_keys = pd.factorize(np.concatenate(cells), sort = True)
+    bounds = np.cumsum([0] + [len(col_cells) for col_cells in cells])
+    counts = {col: np.bincount(cell_ids[bounds[i]:bounds[i + 1]], minlength = len(cell_keys)).astype('int32')
+              for i, col in enumerate(columns)}
+
+    levels = [cell_keys % n_buckets - MAX_BUCKET]
+    group_keys = cell_keys // n_buckets
+    for key in reversed(key_values):
+        levels.insert(0, pd.Categorical.from_codes(group_keys % len(key.categories), key.categories.astype(str)))
+        group_keys = group_keys // len(key.categories)
+
+    return pd.DataFrame(counts, index = pd.MultiIndex.from_arrays(levels, names = keys + ['BUCKET']))
+
+
+def merge_sketches(sketches: list) -> pd.DataFrame:
+    """
+    Merge sketches built from separate chunks of flights, adding counts of buckets present in several of them.
+    """
+    combined = pd.concat(sketches)
+    combined.index = combined.index.set_levels([level.astype(str) for level in combined.index.levels[:-1]], level = list(range(combined.index.nlevels - 1)))
+
+    # buckets of a single chunk are only sorted in
+    shared = combined.index.duplicated(keep = False)
+    merged = combined[shared].groupby(level = list(combined.index.names), sort = True).sum()
+
+    return pd.concat([combined[~shared], merged]).sort_index()
+
+
+def aggregate_sketch_chunks(chunks) -> dict:
+    """
+    Fold chunks of flights (with SKETCH_FLIGHTS_COLUMNS) into sketches of SKETCH_COLUMNS:
+
+    - 'routes': per (ORIGIN, DEST),
+    - 'airlines': per AIRLINE.
+    """
+    return merge_sketch_aggregates([{
+        'routes': build_sketches(chunk, ROUTE_SKETCH_KEYS),
+        'airlines': build_sketches(chunk, AIRLINE_SKETCH_KEYS)
+    } for chunk in chunks])
+
+
+def merge_sketch_aggregates(aggregates: list) -> dict:
+    """
+    Merge sketches (see `aggregate_sketch_chunks`) of separate sets of flights, e.g. of loaded flights and of newly appended months.
+    """
+    return {name: merge_sketches([part[name] for part in aggregates]) for name in ['routes', 'airlines']}
+
+
+def sketch_quantiles(sketches: pd.DataFrame, column: str, quantiles: dict = SKETCH_QUANTILES) -> pd.DataFrame:
+    """
+    Quantiles {name: q} of `column` from every sketch of `sketches` (indexed by keys and BUCKET, sorted),
+    indexed by keys. A frame indexed by BUCKET only is a single sketch, its quantiles are one row.
+
+    Quantile q is the value of the bucket holding the value of rank q * (count - 1) (in all buckets of the
+    sketch, searched at once for all sketches over cumulative counts).
+    """
+    counts = sketches[column].to_numpy()
+    rows = np.flatnonzero(counts > 0)
+    counts = counts[rows]
+    index = sketches.index[rows]
+
+    if index.nlevels > 1:
+        groups, keys = pd.factorize(index.droplevel('BUCKET'), sort = False)
+        keys = pd.MultiIndex.from_tuples(keys, names = index.names[:-1]) if index.nlevels > 2 else pd.Index(keys, name = index.names[0])
+    else:
+        groups, keys = np.zeros(len(rows), dtype = 'int64'), pd.Index([column], name = 'column')
+    buckets = index.get_level_values('BUCKET').to_numpy()
+
+    cumulative = np.cumsum(counts)
+    totals = np.bincount(groups, weights = counts, minlength = len(keys))
+    starts = np.cumsum(totals) - totals # rows of a sketch are contiguous, so its counts start where the previous one ends
+
+    result = {}
+    for name, q in quantiles.items():
+        positions = np.searchsorted(cumulative, starts + q * (totals - 1), side = 'right')
+        values = bucket_values(buckets[np.minimum(positions, len(buckets) - 1)]) if len(buckets) else np.zeros(len(keys))
+        result[name] = np.where(totals > 0, values, np.nan) # empty single sketch has no quantiles
+
+    return pd.DataFrame(result, index = keys)
+
+
+def sketch_histogram(sketch: pd.Series, upper: float = None) -> pd.DataFrame:
+    """
+    Counts of single sketch (indexed by BUCKET) regrouped into bins of 'nice' width (see `stats_utils.histogram_edges`)
+    up to `upper` (all values by default), with 'start' and 'end' of every bin.
+    """
+    sketch = sketch[sketch > 0]
+    values = bucket_values(sketch.index.to_numpy())
+    inside = values <= (upper if upper is not None else np.inf)
+    values, counts = values[inside], sketch.to_numpy()[inside]
+    if not len(values):
+        return pd.DataFrame({'start': [], 'end': [], 'count': []})
+
+    edges = histogram_edges(values.min(), values.max())
+    binned, _ = np.histogram(values, bins = edges, weights = counts)
+
+    return pd.DataFrame({'start': edges[:-1], 'end': edges[1:], 'count': binned.astype('int64')})
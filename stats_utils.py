@@ -0,0 +1,291 @@
+"""
+This file contains utilities for mergeable summary statistics of flights columns.
+
+Statistics are computed chunk by chunk and merged, so that the whole dataset never has to be in memory.
+`ColumnStatistics` keeps numerically stable centered co-moments (parallel Welford) of many columns, from which
+means, variances, covariances and correlations follow, together with value counts for approximate quartiles.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+#################################################################################
+
+# Variables
+
+# values are counted rounded to multiples of resolution, quantiles are exact for data on this grid
+# (all numeric columns of flights are whole minutes or miles)
+QUANTILE_RESOLUTION = 1.0
+STATISTICS_CHUNKSIZE = 1_000_000 # rows of in-memory frame processed at once by `frame_statistics`
+HISTOGRAM_MAXBINS = 30 # bins of numeric variables in Distributions tab
+GRID_BINS = 60 # cells along every axis of density grid of two variables
+
+
+#################################################################################
+# Online statistics
+
+class ColumnStatistics:
+    """
+    Mergeable statistics of numeric columns: pairwise counts, means, centered second moments and co-moments,
+    min, max and value counts.
+
+    Every pair of columns uses only rows where both are present, like pandas corr(). Statistics of separate
+    chunks (or workers) are combined with pairwise update formulas of Chan et al., so the result does not
+    depend on how the data were split.
+    """
+    def __init__(self, columns: list, resolution: float = QUANTILE_RESOLUTION):
+        k = len(columns)
+        self.columns = list(columns)
+        self.resolution = resolution
+        self.n = np.zeros((k, k))
+        self.mean = np.zeros((k, k)) # mean[i, j] - mean of column i over rows where i and j are present
+        self.m2 = np.zeros((k, k)) # m2[i, j] - sum of squared deviations of column i over the same rows
+        self.comoment = np.zeros((k, k)) # sum of products of deviations of columns i and j
+        self.min = np.full(k, np.nan)
+        self.max = np.full(k, np.nan)
+        self.counts = [pd.Series(dtype = 'int64') for _ in range(k)] # value / resolution (rounded) -> number of rows
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, columns: list, resolution: float = QUANTILE_RESOLUTION):
+        """
+        Statistics of `columns` of a single chunk, computed with a few matrix products over all rows.
+        """
+        stats = cls(columns, resolution)
+        values = np.asfortranarray(frame[columns].to_numpy(dtype = 'float64', na_value = np.nan))
+        present = ~np.isnan(values)
+        weights = present.astype('float64')
+
+        counts = weights.sum(axis = 0)
+        if not counts.any():
+            return stats
+
+        # center by column means of the chunk to avoid cancellation in sums of squares
+        shift = np.divide(np.where(present, values, 0).sum(axis = 0), counts, out = np.zeros_like(counts), where = counts > 0)
+        centered = np.where(present, values - shift, 0)
+
+        n = weights.T @ weights
+        sums = centered.T @ weights # sums[i, j] - sum of centered column i over rows where j is present
+        safe_n = np.where(n > 0, n, 1)
+
+        stats.n = n
+        stats.mean = np.where(n > 0, shift[:, None] + sums / safe_n, 0)
+        stats.m2 = np.where(n > 0, (centered ** 2).T @ weights - sums ** 2 / safe_n, 0)
+        stats.comoment = np.where(n > 0, centered.T @ centered - sums * sums.T / safe_n, 0)
+
+        with np.errstate(all = 'ignore'): # columns without values
+            stats.min = np.nanmin(values, axis = 0)
+            stats.max = np.nanmax(values, axis = 0)
+
+        keys = np.asfortranarray(np.round(values / resolution)) # contiguous columns, NaN stays NaN
+        stats.counts = [pd.Series(keys[:, i]).value_counts() for i in range(len(columns))]
+
+        return stats
+
+    def merge(self, other: 'ColumnStatistics') -> 'ColumnStatistics':
+        """
+        Statistics of both parts together.
+        """
+        merged = ColumnStatistics(self.columns, self.resolution)
+        n = self.n + other.n
+        safe_n = np.where(n > 0, n, 1)
+        delta = other.mean - self.mean
+        weight = self.n * other.n / safe_n
+
+        merged.n = n
+        merged.mean = self.mean + delta * other.n / safe_n
+        merged.m2 = self.m2 + other.m2 + delta ** 2 * weight
+        merged.comoment = self.comoment + other.comoment + delta * delta.T * weight
+        merged.min = np.fmin(self.min, other.min)
+        merged.max = np.fmax(self.max, other.max)
+        merged.counts = [a.add(b, fill_value = 0).astype('int64') for a, b in zip(self.counts, other.counts)]
+
+        return merged
+
+    def select(self, columns: list) -> 'ColumnStatistics':
+        """
+        Statistics of subset of columns.
+        """
+        positions = [self.columns.index(col) for col in columns]
+        pairs = np.ix_(positions, positions)
+
+        selected = ColumnStatistics(columns, self.resolution)
+        selected.n, selected.mean = self.n[pairs], self.mean[pairs]
+        selected.m2, selected.comoment = self.m2[pairs], self.comoment[pairs]
+        selected.min, selected.max = self.min[positions], self.max[positions]
+        selected.counts = [self.counts[i] for i in positions]
+
+        return selected
+
+    def bounds(self, column: str) -> tuple:
+        """
+        Minimum and maximum of `column`.
+        """
+        position = self.columns.index(column)
+        return float(self.min[position]), float(self.max[position])
+
+    def quantiles(self, qs: list) -> pd.DataFrame:
+        """
+        Quantiles `qs` of every column (linear interpolation, like pandas quantile), indexed by q.
+        """
+        quantiles = {}
+        for col, counts in zip(self.columns, self.counts):
+            counts = counts.sort_index()
+            total = counts.sum()
+            if total == 0:
+                quantiles[col] = [np.nan] * len(qs)
+                continue
+
+            values = counts.index.to_numpy() * self.resolution
+            ends = np.cumsum(counts.to_numpy()) # last rank (exclusive) of every value
+            positions = np.asarray(qs) * (total - 1)
+            lower = values[np.searchsorted(ends, np.floor(positions), side = 'right')]
+            upper = values[np.searchsorted(ends, np.ceil(positions), side = 'right')]
+            quantiles[col] = lower + (upper - lower) * (positions - np.floor(positions))
+
+        return pd.DataFrame(quantiles, index = qs)
+
+    def correlation(self) -> pd.DataFrame:
+        """
+        Pearson correlation matrix (pairwise complete rows).
+        """
+        with np.errstate(all = 'ignore'):
+            corr = self.comoment / np.sqrt(self.m2 * self.m2.T)
+
+        corr = np.where(self.n > 1, corr, np.nan)
+        return pd.DataFrame(corr, index = self.columns, columns = self.columns)
+
+    def covariance(self) -> pd.DataFrame:
+        """
+        Sample covariance matrix (pairwise complete rows).
+        """
+        cov = np.divide(self.comoment, self.n - 1, out = np.full_like(self.comoment, np.nan), where = self.n > 1)
+        return pd.DataFrame(cov, index = self.columns, columns = self.columns)
+
+    def describe(self) -> pd.DataFrame:
+        """
+        Descriptive statistics in layout of pandas describe().
+        """
+        count = np.diag(self.n)
+        std = np.sqrt(np.divide(np.diag(self.m2), count - 1, out = np.full_like(count, np.nan), where = count > 1))
+
+        stats = pd.DataFrame({
+            'count': count,
+            'mean': np.where(count > 0, np.diag(self.mean), np.nan),
+            'std': std,
+            'min': self.min
+        }, index = self.columns).T
+
+        quartiles = self.quantiles([0.25, 0.5, 0.75]).rename(index = lambda q: f'{q:.0%}')
+        stats = pd.concat([stats, quartiles])
+        stats.loc['max'] = self.max
+
+        return stats
+
+
+def chunk_statistics(chunks, columns: list, resolution: float = QUANTILE_RESOLUTION) -> ColumnStatistics:
+    """
+    Statistics of `columns` over all chunks, in a single pass.
+    """
+    stats = ColumnStatistics(columns, resolution)
+    for chunk in chunks:
+        stats = stats.merge(ColumnStatistics.from_frame(chunk, columns, resolution))
+
+    return stats
+
+
+def frame_statistics(frame: pd.DataFrame, columns: list, chunksize: int = STATISTICS_CHUNKSIZE) -> ColumnStatistics:
+    """
+    Statistics of `columns` of in-memory frame, processed in chunks of rows to bound temporary memory.
+    """
+    chunks = (frame.iloc[start:start + chunksize] for start in range(0, len(frame), chunksize))
+    return chunk_statistics(chunks, columns)
+
+
+#################################################################################
+# Histograms
+
+def histogram_edges(vmin: float, vmax: float, maxbins: int = HISTOGRAM_MAXBINS) -> np.ndarray:
+    """
+    Edges of at most `maxbins` bins covering [vmin, vmax], with 'nice' width (1, 2 or 5 times power of 10)
+    like bins of Vega-Lite. Bounds of a column without values (NaN) or infinite ones give a single bin [0, 1].
+    """
+    if not (np.isfinite(vmin) and np.isfinite(vmax)):
+        return np.array([0.0, 1.0])
+
+    raw_step = max((vmax - vmin) / maxbins, 1e-12)
+    magnitude = 10 ** np.floor(np.log10(raw_step))
+    step = next(m * magnitude for m in (1, 2, 5, 10) if m * magnitude >= raw_step)
+
+    start = np.floor(vmin / step) * step
+    n_bins = max(int(np.ceil((vmax - start) / step)), 1)
+
+    return start + step * np.arange(n_bins + 1)
+
+
+def value_codes(values: pd.Series, edges: np.ndarray = None) -> tuple:
+    """
+    Integer code of every value (-1 for missing) and labels of codes: bin starts if `edges` are given,
+    otherwise distinct values.
+    """
+    if edges is not None:
+        numbers = values.to_numpy(dtype = 'float64', na_value = np.nan)
+        codes = np.clip(np.floor((numbers - edges[0]) / (edges[1] - edges[0])), 0, len(edges) - 2) # max falls into last bin
+        return np.where(np.isnan(numbers), -1, codes).astype('int64'), edges[:-1]
+
+    values = values.astype('category')
+    return values.cat.codes.to_numpy().astype('int64'), values.cat.categories
+
+
+def count_values(chunks, var: str, color: str = None, edges: np.ndarray = None) -> pd.Series:
+    """
+    Number of rows of every value (or bin, see `value_codes`) of `var` within every value of `color`,
+    counted over chunks of flights with np.bincount. Indexed by (var, color), or by var only if `color` is None.
+    Rows with missing `var` or `color` are not counted.
+    """
+    counts = []
+    for chunk in chunks:
+        var_codes, var_labels = value_codes(chunk[var], edges)
+        if color is None:
+            color_codes, n_colors = np.zeros(len(chunk), dtype = 'int64'), 1
+            index = pd.Index(var_labels, name = var)
+        else:
+            color_codes, color_labels = value_codes(chunk[color])
+            n_colors = len(color_labels)
+            index = pd.MultiIndex.from_product([var_labels, color_labels], names = [var, color])
+
+        valid = (var_codes >= 0) & (color_codes >= 0)
+        chunk_counts = np.bincount(var_codes[valid] * n_colors + color_codes[valid], minlength = len(index))
+
+        chunk_counts = pd.Series(chunk_counts, index = index)
+        counts.append(chunk_counts[chunk_counts > 0])
+
+    if not counts: # no chunks, e.g. of an empty store
+        index = pd.Index([], name = var) if color is None else pd.MultiIndex.from_arrays([[], []], names = [var, color])
+        return pd.Series([], index = index, dtype = 'int64')
+
+    # chunks have their own categories - merge by labels
+    counts = pd.concat(counts)
+    return counts.groupby(level = list(range(counts.index.nlevels)), sort = True).sum()
+
+
+def grid_counts(chunks, x: str, y: str, x_edges: np.ndarray, y_edges: np.ndarray) -> np.ndarray:
+    """
+    Number of rows in every cell of 2-D grid of `x` and `y` (shape len(x_edges) - 1 by len(y_edges) - 1),
+    counted over chunks of flights with np.bincount. Rows outside the grid or with missing values are not counted.
+    """
+    nx, ny = len(x_edges) - 1, len(y_edges) - 1
+    counts = np.zeros(nx * ny, dtype = 'int64')
+
+    for chunk in chunks:
+        cells = []
+        for col, edges, n in ((x, x_edges, nx), (y, y_edges, ny)):
+            values = chunk[col].to_numpy(dtype = 'float64', na_value = np.nan)
+            inside = (values >= edges[0]) & (values <= edges[-1]) # comparisons with NaN are False
+            cells.append((np.minimum(np.floor((values - edges[0]) / (edges[1] - edges[0])), n - 1), inside))
+
+        (x_cells, x_inside), (y_cells, y_inside) = cells
+        inside = x_inside & y_inside
+        counts += np.bincount((x_cells[inside] * ny + y_cells[inside]).astype('int64'), minlength = nx * ny)
+
+    return counts.reshape(nx, ny)
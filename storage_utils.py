@@ -0,0 +1,295 @@
+"""
+This file contains utilities for converting the flights CSV into a typed, partitioned Parquet store and reading it back.
+
+Every chunk of the CSV is one Parquet file of the store. Names of files sort in order of the CSV (and appended files
+after them), so that the store is read back with flights in the order of the CSV - 'first' aggregates and orders
+of first appearance (airline of a route, origins) are the same as of flights read from the CSV.
+"""
+
+import os
+import shutil
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+#################################################################################
+
+# Variables
+
+CSV_CHUNKSIZE = 1_000_000 # rows parsed per chunk during conversion
+LEGACY_PARTITION_COL = 'FL_YEAR' # stores partitioned by year (read grouped by year, not in CSV order) are rebuilt
+
+# Column types of the flights dataset. Repeated strings are stored as categoricals,
+# numbers are downcast to the narrowest type that holds them.
+FLIGHTS_DTYPES = {
+    'FL_DATE': 'category',
+    'AIRLINE': 'category',
+    'AIRLINE_DOT': 'category',
+    'AIRLINE_CODE': 'category',
+    'DOT_CODE': 'int32',
+    'FL_NUMBER': 'int16',
+    'ORIGIN': 'category',
+    'ORIGIN_CITY': 'category',
+    'DEST': 'category',
+    'DEST_CITY': 'category',
+    'CRS_DEP_TIME': 'int16',
+    'DEP_TIME': 'float32',
+    'DEP_DELAY': 'float32',
+    'TAXI_OUT': 'float32',
+    'WHEELS_OFF': 'float32',
+    'WHEELS_ON': 'float32',
+    'TAXI_IN': 'float32',
+    'CRS_ARR_TIME': 'int16',
+    'ARR_TIME': 'float32',
+    'ARR_DELAY': 'float32',
+    'CANCELLED': 'int8',
+    'CANCELLATION_CODE': 'category',
+    'DIVERTED': 'int8',
+    'CRS_ELAPSED_TIME': 'float32',
+    'ELAPSED_TIME': 'float32',
+    'AIR_TIME': 'float32',
+    'DISTANCE': 'float32',
+    'DELAY_DUE_CARRIER': 'float32',
+    'DELAY_DUE_WEATHER': 'float32',
+    'DELAY_DUE_NAS': 'float32',
+    'DELAY_DUE_SECURITY': 'float32',
+    'DELAY_DUE_LATE_AIRCRAFT': 'float32',
+}
+
+CATEGORICAL_COLS = [col for col, dtype in FLIGHTS_DTYPES.items() if dtype == 'category']
+
+
+#################################################################################
+# Functions
+
+def optimize_dtypes(flights: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast raw flights columns to the types in FLIGHTS_DTYPES and drop the CSV index column.
+    """
+    flights = flights.drop(columns = [col for col in flights.columns if col.startswith('Unnamed:')])
+    dtypes = {col: dtype for col, dtype in FLIGHTS_DTYPES.items() if col in flights.columns}
+
+    return flights.astype(dtypes)
+
+
+def write_flights_chunks(chunks, store_path: str) -> list:
+    """
+    Write every chunk of flights into a Parquet file of dataset `store_path`, named 'part-<time>-<chunk>.parquet'
+    so that files of later writes (appended flights) sort after the earlier ones. Returns names of the files.
+    """
+    os.makedirs(store_path, exist_ok = True)
+    prefix = f'part-{time.time_ns()}'
+
+    files = []
+    for i, chunk in enumerate(chunks):
+        files.append(f'{prefix}-{i:06d}.parquet')
+        pq.write_table(pa.Table.from_pandas(optimize_dtypes(chunk), preserve_index = False), os.path.join(store_path, files[-1]))
+
+    return files
+
+
+def write_flights_store(csv_path: str, store_path: str, chunksize: int = CSV_CHUNKSIZE) -> None:
+    """
+    Convert flights CSV into a Parquet dataset of its chunks, in order of the CSV.
+
+    CSV is parsed in chunks, so memory used by conversion does not depend on the size of the file.
+    """
+    categorical_dtypes = {col: 'category' for col in CATEGORICAL_COLS}
+
+    chunks = pd.read_csv(csv_path, dtype = categorical_dtypes, on_bad_lines = 'skip', chunksize = chunksize)
+    write_flights_chunks(chunks, store_path)
+
+
+def flights_dataset(store_path: str, files: list = None) -> ds.Dataset:
+    """
+    Parquet store as pyarrow dataset, or only its `files` (paths relative to `store_path`, see `store_files`).
+    """
+    if files is None:
+        return ds.dataset(store_path, format = 'parquet')
+
+    return ds.dataset([os.path.join(store_path, file) for file in files], format = 'parquet')
+
+
+def store_files(store_path: str) -> list:
+    """
+    Sorted paths of Parquet files of store, relative to `store_path`.
+    """
+    return sorted(os.path.relpath(path, store_path) for path in flights_dataset(store_path).files)
+
+
+def read_flights_store(store_path: str, columns: list = None, files: list = None) -> pd.DataFrame:
+    """
+    Read flights from Parquet store. Pass `columns` to read only the columns a view needs
+    and `files` to read only some files of the store (see `store_files`).
+    """
+    flights = flights_dataset(store_path, files).to_table(columns = columns).to_pandas()
+
+    # dictionaries of separate parquet files are merged in order of appearance - sort them,
+    # so that groupby on categorical columns returns the same order as on plain strings
+    for col in flights.select_dtypes(include = ['category']).columns:
+        flights[col] = flights[col].cat.reorder_categories(sorted(flights[col].cat.categories))
+
+    return flights
+
+
+def store_is_stale(csv_path: str, store_path: str) -> bool:
+    """
+    Check whether Parquet store has to be (re)built from CSV.
+    """
+    if not os.path.isdir(store_path):
+        return True
+    if not os.path.exists(csv_path):
+        return False
+
+    legacy = any(name.startswith(LEGACY_PARTITION_COL + '=') for name in os.listdir(store_path))
+    return legacy or os.path.getmtime(csv_path) > os.path.getmtime(store_path)
+
+
+def ensure_flights_store(csv_path: str, store_path: str) -> None:
+    """
+    Convert CSV to Parquet store only once, on first load or after CSV changes.
+
+    The store is converted into a staging directory and replaces the previous one only when complete, so a conversion
+    interrupted midway leaves no partial store that would look up to date with CSV.
+    """
+    if store_is_stale(csv_path, store_path):
+        staging_path = store_path.rstrip('/') + '.building'
+        previous_path = store_path.rstrip('/') + '.previous'
+        shutil.rmtree(staging_path, ignore_errors = True)
+
+        try:
+            write_flights_store(csv_path, staging_path)
+            shutil.rmtree(previous_path, ignore_errors = True)
+            if os.path.isdir(store_path):
+                os.replace(store_path, previous_path)
+            os.replace(staging_path, store_path)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors = True)
+            shutil.rmtree(previous_path, ignore_errors = True)
+
+        os.utime(store_path) # mark store as up to date with CSV
+
+
+def store_version(store_path: str) -> str:
+    """
+    Version of Parquet store, changes whenever store is (re)written.
+    """
+    return str(os.stat(store_path).st_mtime_ns)
+
+
+def load_flights(csv_path: str, store_path: str, columns: list = None) -> pd.DataFrame:
+    """
+    Load typed flights data into memory.
+    """
+    ensure_flights_store(csv_path, store_path)
+
+    return read_flights_store(store_path, columns)
+
+
+def iter_flights_store(store_path: str, columns: list = None, chunksize: int = CSV_CHUNKSIZE, filters: list = None):
+    """
+    Yield flights from Parquet store in chunks of at most `chunksize` rows, so that the whole dataset
+    never has to be in memory at once.
+
+    `filters` are (column, operator, value) conditions of pyarrow.parquet, evaluated while scanning the store.
+    """
+    dataset = flights_dataset(store_path)
+    expression = pq.filters_to_expression(filters) if filters else None
+
+    # scanner returns batches much smaller than chunksize - collect them into chunks of about chunksize rows
+    batches, rows = [], 0
+    for batch in dataset.to_batches(columns = columns, batch_size = chunksize, filter = expression):
+        if batch.num_rows == 0:
+            continue
+        batches.append(batch)
+        rows += batch.num_rows
+        if rows >= chunksize:
+            yield pa.Table.from_batches(batches).to_pandas()
+            batches, rows = [], 0
+
+    if rows > 0:
+        yield pa.Table.from_batches(batches).to_pandas()
+
+
+def count_flights_store(store_path: str, filters: list = None, files: list = None) -> int:
+    """
+    Number of flights in Parquet store (or in its `files`) matching `filters` (see `iter_flights_store`),
+    without reading rows when Parquet metadata suffice.
+    """
+    dataset = flights_dataset(store_path, files)
+
+    return dataset.count_rows(filter = pq.filters_to_expression(filters) if filters else None)
+
+
+def store_months(store_path: str) -> tuple:
+    """
+    First and last month ('YYYY-MM') of flights in Parquet store, from min and max FL_DATE in Parquet metadata
+    of its row groups, without reading rows (only row groups written without statistics are read).
+    """
+    dates = []
+    for file in store_files(store_path):
+        parquet_file = pq.ParquetFile(os.path.join(store_path, file))
+        column = parquet_file.schema_arrow.get_field_index('FL_DATE')
+
+        for i in range(parquet_file.metadata.num_row_groups):
+            statistics = parquet_file.metadata.row_group(i).column(column).statistics
+            if statistics is not None and statistics.has_min_max:
+                dates += [statistics.min, statistics.max]
+            else:
+                flight_dates = parquet_file.read_row_group(i, columns = ['FL_DATE']).column('FL_DATE').to_pandas().dropna().astype(str)
+                dates += [flight_dates.min(), flight_dates.max()] if len(flight_dates) else []
+
+    return min(dates)[:7], max(dates)[:7]
+
+
+def concat_flights(frames: list) -> pd.DataFrame:
+    """
+    Concatenate typed flights frames. Categories of categorical columns are united and sorted
+    (like in `read_flights_store`), so that the columns stay categorical.
+    """
+    categorical_cols = frames[0].select_dtypes(include = ['category']).columns
+    categories = {col: sorted(set().union(*(frame[col].cat.categories for frame in frames))) for col in categorical_cols}
+
+    frames = [frame.assign(**{col: frame[col].cat.set_categories(categories[col]) for col in categorical_cols}) for frame in frames]
+
+    return pd.concat(frames, ignore_index = True)
+
+
+def append_flights_store(csv_path: str, store_path: str, chunksize: int = CSV_CHUNKSIZE) -> list:
+    """
+    Append flights of CSV (e.g. a newly published month) to Parquet store as new files and return them
+    (paths relative to `store_path`). Files already in the store are not rewritten.
+
+    Flights are converted into a staging directory first and moved into the store only when complete, so that readers
+    never see a partially written file. Dates of the CSV must not overlap dates of flights in the store -
+    these flights would be counted twice.
+    """
+    if not os.path.isdir(store_path):
+        raise FileNotFoundError(f'No flights store in {store_path}')
+
+    staging_path = store_path.rstrip('/') + '.staging'
+    shutil.rmtree(staging_path, ignore_errors = True)
+
+    try:
+        categorical_dtypes = {col: 'category' for col in CATEGORICAL_COLS}
+        chunks = pd.read_csv(csv_path, dtype = categorical_dtypes, on_bad_lines = 'skip', chunksize = chunksize)
+        write_flights_chunks(chunks, staging_path)
+
+        dates = flights_dataset(staging_path).to_table(columns = ['FL_DATE']).column('FL_DATE').to_pandas().astype(str)
+        first, last = dates.min(), dates.max()
+        if count_flights_store(store_path, [('FL_DATE', '>=', first), ('FL_DATE', '<=', last)]) > 0:
+            raise ValueError(f'Flights of {first} - {last} overlap flights already in store {store_path}')
+
+        files = store_files(staging_path)
+        for file in files:
+            os.replace(os.path.join(staging_path, file), os.path.join(store_path, file))
+    finally:
+        shutil.rmtree(staging_path, ignore_errors = True)
+
+    os.utime(store_path) # new version of the store (see `store_version`)
+
+    return files
@@ -0,0 +1,191 @@
+"""
+This file contains a generator of synthetic flights matching the schema of the dataset (see storage_utils.FLIGHTS_DTYPES).
+
+The real dataset is not shipped with the repository. Synthetic flights connect real U.S. airports of
+`dataset/airports_codes.csv` (so routes can be drawn on the map) with a skewed popularity of airports, like hubs
+and regional airports, and consistent times: distances follow coordinates and delays add up along the flight.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from storage_utils import CSV_CHUNKSIZE, FLIGHTS_DTYPES, write_flights_chunks, count_flights_store
+
+
+#################################################################################
+
+# Variables
+
+DIR_PATH = os.path.dirname(os.path.realpath(__file__))
+AIRPORTS_CODES = DIR_PATH + '/dataset/airports_codes.csv'
+
+SYNTHETIC_SIZES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000} # named sizes of benchmarks
+SYNTHETIC_AIRPORTS = 350 # U.S. airports flights are drawn between
+SYNTHETIC_SEED = 2024
+SYNTHETIC_DATES = ('2019-01-01', '2023-12-31')
+SYNTHETIC_BOUNDS = (24, 50, -125, -66) # latitudes and longitudes of contiguous U.S., keeps distances realistic
+
+# (AIRLINE, AIRLINE_CODE, DOT_CODE, relative number of flights)
+SYNTHETIC_AIRLINES = [
+    ('Southwest Airlines Co.', 'WN', 19393, 18),
+    ('Delta Air Lines Inc.', 'DL', 19790, 13),
+    ('American Airlines Inc.', 'AA', 19805, 12),
+    ('SkyWest Airlines Inc.', 'OO', 20304, 10),
+    ('United Air Lines Inc.', 'UA', 19977, 9),
+    ('Republic Airline', 'YX', 20452, 5),
+    ('Endeavor Air Inc.', '9E', 20363, 4),
+    ('Envoy Air', 'MQ', 20398, 4),
+    ('PSA Airlines Inc.', 'OH', 20397, 4),
+    ('JetBlue Airways', 'B6', 20409, 4),
+    ('Alaska Airlines Inc.', 'AS', 19930, 4),
+    ('Spirit Air Lines', 'NK', 20416, 3),
+    ('Mesa Airlines Inc.', 'YV', 20378, 2),
+    ('Frontier Airlines Inc.', 'F9', 20436, 2),
+    ('Allegiant Air', 'G4', 20368, 2),
+    ('Horizon Air', 'QX', 19687, 1),
+    ('Hawaiian Airlines Inc.', 'HA', 19690, 1),
+    ('ExpressJet Airlines LLC d/b/a aha!', 'EV', 20366, 1)
+]
+
+
+#################################################################################
+# Functions
+
+def synthetic_airports(codes_path: str = AIRPORTS_CODES, n_airports: int = SYNTHETIC_AIRPORTS) -> pd.DataFrame:
+    """
+    Airports flights are drawn between: code, city and coordinates of first `n_airports` airports of contiguous U.S.
+    """
+    lat_min, lat_max, lon_min, lon_max = SYNTHETIC_BOUNDS
+    codes = pd.read_csv(codes_path, sep = ';', on_bad_lines = 'skip')
+    airports = codes[(codes['Country Code'] == 'US') & codes['Latitude'].between(lat_min, lat_max) & codes['Longitude'].between(lon_min, lon_max)]
+    airports = airports.drop_duplicates('Airport Code').head(n_airports)
+
+    return pd.DataFrame({
+        'code': airports['Airport Code'].to_numpy(),
+        'city': (airports['City Name'] + ', US').to_numpy(),
+        'lat': airports['Latitude'].to_numpy(dtype = 'float64'),
+        'lon': airports['Longitude'].to_numpy(dtype = 'float64')
+    })
+
+
+def clock_time(minutes: np.ndarray) -> np.ndarray:
+    """
+    Minutes after midnight as hhmm clock time of the dataset.
+    """
+    minutes = np.mod(minutes, 24 * 60)
+    return minutes // 60 * 100 + minutes % 60
+
+
+def synthetic_flights(n: int, airports: pd.DataFrame, seed: int = SYNTHETIC_SEED) -> pd.DataFrame:
+    """
+    `n` synthetic flights between `airports` (see `synthetic_airports`) with columns and dtypes of FLIGHTS_DTYPES.
+    """
+    rng = np.random.default_rng(seed)
+
+    # popularity of airports falls with their rank, so a few hubs have most of the flights
+    weights = 1 / np.arange(1, len(airports) + 1) ** 0.9
+    weights = weights / weights.sum()
+    origins = rng.choice(len(airports), n, p = weights)
+    dests = rng.choice(len(airports), n, p = weights)
+    dests = np.where(dests == origins, (dests + 1 + rng.integers(0, 10, n)) % len(airports), dests)
+
+    shares = np.array([airline[3] for airline in SYNTHETIC_AIRLINES], dtype = 'float64')
+    carriers = rng.choice(len(SYNTHETIC_AIRLINES), n, p = shares / shares.sum())
+    names = np.array([airline[0] for airline in SYNTHETIC_AIRLINES], dtype = object)
+    codes = np.array([airline[1] for airline in SYNTHETIC_AIRLINES], dtype = object)
+    dot_codes = np.array([airline[2] for airline in SYNTHETIC_AIRLINES])
+
+    first_day, last_day = (pd.Timestamp(date) for date in SYNTHETIC_DATES)
+    days = pd.date_range(first_day, last_day).strftime('%Y-%m-%d').to_numpy()
+    dates = days[rng.integers(0, len(days), n)]
+
+    # great-circle distance of routes in miles
+    lat1, lon1 = np.radians(airports['lat'].to_numpy()[origins]), np.radians(airports['lon'].to_numpy()[origins])
+    lat2, lon2 = np.radians(airports['lat'].to_numpy()[dests]), np.radians(airports['lon'].to_numpy()[dests])
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    distance = np.maximum(np.round(2 * 3958.8 * np.arcsin(np.sqrt(a))), 30)
+
+    # scheduled times and delays in minutes, delays add up along the flight
+    crs_dep = rng.integers(5 * 60, 23 * 60, n)
+    crs_elapsed = np.round(distance / 8 + 30)
+    dep_delay = np.round(rng.gamma(0.6, 25, n) - 8)
+    taxi_out = np.round(rng.gamma(4, 4, n))
+    taxi_in = np.round(rng.gamma(2, 4, n))
+    air_time = np.round(distance / 8 + rng.normal(0, 5, n)).clip(10)
+    elapsed = taxi_out + air_time + taxi_in
+    arr_delay = dep_delay + elapsed - crs_elapsed
+
+    cancelled = rng.random(n) < 0.02
+    diverted = ~cancelled & (rng.random(n) < 0.003)
+    not_flown = cancelled | diverted
+
+    def flown(values):
+        return np.where(not_flown, np.nan, values)
+
+    dep_time = np.where(cancelled, np.nan, clock_time(crs_dep + dep_delay))
+    delays = rng.dirichlet(np.ones(5), n) * np.where(arr_delay >= 15, arr_delay, np.nan)[:, None]
+
+    flights = pd.DataFrame({
+        'FL_DATE': dates,
+        'AIRLINE': names[carriers],
+        'AIRLINE_DOT': names[carriers] + ': ' + codes[carriers],
+        'AIRLINE_CODE': codes[carriers],
+        'DOT_CODE': dot_codes[carriers],
+        'FL_NUMBER': rng.integers(1, 7000, n),
+        'ORIGIN': airports['code'].to_numpy()[origins],
+        'ORIGIN_CITY': airports['city'].to_numpy()[origins],
+        'DEST': airports['code'].to_numpy()[dests],
+        'DEST_CITY': airports['city'].to_numpy()[dests],
+        'CRS_DEP_TIME': clock_time(crs_dep),
+        'DEP_TIME': dep_time,
+        'DEP_DELAY': np.where(cancelled, np.nan, dep_delay),
+        'TAXI_OUT': np.where(cancelled, np.nan, taxi_out),
+        'WHEELS_OFF': np.where(cancelled, np.nan, clock_time(crs_dep + dep_delay + taxi_out)),
+        'WHEELS_ON': flown(clock_time(crs_dep + dep_delay + taxi_out + air_time)),
+        'TAXI_IN': flown(taxi_in),
+        'CRS_ARR_TIME': clock_time(crs_dep + crs_elapsed),
+        'ARR_TIME': flown(clock_time(crs_dep + dep_delay + elapsed)),
+        'ARR_DELAY': flown(arr_delay),
+        'CANCELLED': cancelled.astype('int8'),
+        'CANCELLATION_CODE': np.where(cancelled, np.array(list('ABCD'))[rng.integers(0, 4, n)], None),
+        'DIVERTED': diverted.astype('int8'),
+        'CRS_ELAPSED_TIME': crs_elapsed,
+        'ELAPSED_TIME': flown(elapsed),
+        'AIR_TIME': flown(air_time),
+        'DISTANCE': distance,
+        'DELAY_DUE_CARRIER': flown(np.round(delays[:, 0])),
+        'DELAY_DUE_WEATHER': flown(np.round(delays[:, 1])),
+        'DELAY_DUE_NAS': flown(np.round(delays[:, 2])),
+        'DELAY_DUE_SECURITY': flown(np.round(delays[:, 3])),
+        'DELAY_DUE_LATE_AIRCRAFT': flown(np.round(delays[:, 4]))
+    })
+
+    return flights.astype(FLIGHTS_DTYPES)
+
+
+def iter_synthetic_flights(n: int, chunksize: int = CSV_CHUNKSIZE, seed: int = SYNTHETIC_SEED, codes_path: str = AIRPORTS_CODES):
+    """
+    Yield `n` synthetic flights in chunks of at most `chunksize` rows, each drawn with its own seed.
+    """
+    airports = synthetic_airports(codes_path)
+    for i, start in enumerate(range(0, n, chunksize)):
+        yield synthetic_flights(min(chunksize, n - start), airports, seed = seed + i)
+
+
+def write_synthetic_store(n: int, store_path: str, seed: int = SYNTHETIC_SEED) -> None:
+    """
+    (Re)write Parquet store (see storage_utils) of `n` synthetic flights. Memory used does not depend on `n`.
+    """
+    shutil.rmtree(store_path, ignore_errors = True)
+    write_flights_chunks(iter_synthetic_flights(n, seed = seed), store_path)
+
+
+def ensure_synthetic_store(n: int, store_path: str, seed: int = SYNTHETIC_SEED) -> None:
+    """
+    Write store of `n` synthetic flights unless `store_path` already holds exactly `n` flights.
+    """
+    if not os.path.isdir(store_path) or count_flights_store(store_path) != n:
+        write_synthetic_store(n, store_path, seed)
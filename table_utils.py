@@ -0,0 +1,240 @@
+"""
+This file contains utilities for paging through filtered and sorted flights in Raw data table.
+
+Filters are lists of (column, operator, value) conditions joined with AND, e.g.
+[('ORIGIN', '==', 'ATL'), ('FL_DATE', '>=', '2022-01-01')] - the format of pyarrow.parquet filters,
+so they can be pushed down to Parquet store. Only the requested page of rows is ever materialized.
+"""
+
+import operator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from storage_utils import concat_flights
+
+
+#################################################################################
+
+# Variables
+
+PAGE_SIZE = 100 # rows of Raw data table sent to browser at once
+PAGE_KEYS_LIMIT = 100_000 # sort keys held at once while paging through Parquet dataset, whatever the page number
+PAGE_HISTOGRAM_BINS = 65536 # bins of sort keys counted in one pass when looking for the first row of a deep page
+
+FILTER_OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge
+}
+
+
+#################################################################################
+# Functions
+
+def filter_mask(frame: pd.DataFrame, filters: list) -> np.ndarray:
+    """
+    Boolean mask of rows of `frame` that satisfy all `filters`.
+
+    Conditions on categorical columns are evaluated once per category and matched by codes,
+    so that comparisons of strings (e.g. dates) do not run for every row.
+    """
+    mask = np.ones(len(frame), dtype = bool)
+
+    for col, op, value in filters:
+        values = frame[col]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            categories = values.cat.categories
+            matching = np.flatnonzero(FILTER_OPERATORS[op](categories, value))
+            mask &= np.isin(values.cat.codes.to_numpy(), matching)
+        else:
+            mask &= np.asarray(FILTER_OPERATORS[op](values, value), dtype = bool)
+
+    return mask
+
+
+def sort_keys(values: pd.Series, ascending: bool) -> np.ndarray:
+    """
+    Numeric keys ordering `values` (categoricals by their sorted categories), missing values last.
+    """
+    if values.dtype == object: # categoricals of separate chunks concatenated
+        values = values.astype('category')
+
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        values = values.cat.reorder_categories(sorted(values.cat.categories))
+        keys = values.cat.codes.to_numpy().astype('float64')
+        keys[keys < 0] = np.nan
+    else:
+        keys = values.to_numpy(dtype = 'float64', na_value = np.nan)
+
+    keys = keys if ascending else -keys
+    return np.where(np.isnan(keys), np.inf, keys)
+
+
+def top_positions(keys: np.ndarray, k: int) -> np.ndarray:
+    """
+    Positions of `k` smallest `keys` in sorted order (ties keep order of rows), without sorting all keys.
+    """
+    if k < len(keys):
+        # k-th smallest key splits the rows, ties at the split are taken in order of rows
+        threshold = np.partition(keys, k - 1)[k - 1]
+        smaller = np.flatnonzero(keys < threshold)
+        ties = np.flatnonzero(keys == threshold)[:k - len(smaller)]
+        candidates = np.sort(np.concatenate([smaller, ties]))
+    else:
+        candidates = np.arange(len(keys))
+
+    return candidates[np.argsort(keys[candidates], kind = 'stable')]
+
+
+def page_of_frame(frame: pd.DataFrame, filters: list, sort_by: str = None, ascending: bool = True,
+                  offset: int = 0, limit: int = PAGE_SIZE) -> tuple:
+    """
+    Page of rows of in-memory `frame` and number of all rows matching `filters`.
+    """
+    positions = np.flatnonzero(filter_mask(frame, filters)) if filters else np.arange(len(frame))
+    total = len(positions)
+
+    if sort_by is not None:
+        keys = sort_keys(frame[sort_by].iloc[positions], ascending)
+        positions = positions[top_positions(keys, offset + limit)]
+
+    return frame.iloc[positions[offset:offset + limit]], total
+
+
+def dataset_keys(fragments: list, sort_by: str, expression, ascending: bool, categories: pd.Index = None):
+    """
+    Yield sort keys (see `sort_keys`) of rows of every fragment of dataset matching `expression`, reading only `sort_by`
+    column. Categorical values are keyed by their position in sorted `categories` of all fragments,
+    so keys of separate fragments are comparable.
+    """
+    for fragment in fragments:
+        values = fragment.to_table(columns = [sort_by], filter = expression).column(0).to_pandas()
+        if categories is not None:
+            values = pd.Series(pd.Categorical(values.astype(object), categories = categories))
+        yield sort_keys(values, ascending)
+
+
+def key_of_rank(scan, rank: int, limit: int = PAGE_KEYS_LIMIT) -> tuple:
+    """
+    Key of the row of `rank` (from 0) in order of keys and number of rows with smaller keys.
+
+    `scan` is a function yielding keys of all rows in chunks, it is called once per pass. Keys of ranks are narrowed
+    down by histograms of keys within the range holding `rank`, until the range holds a single key or at most `limit`
+    keys, which are then sorted - memory does not depend on `rank`.
+    """
+    lo, hi, closed, below = -np.inf, np.inf, True, 0 # keys in [lo, hi) (or [lo, hi] if closed) hold the rank, `below` are smaller
+
+    def within(keys):
+        return keys[(keys >= lo) & ((keys <= hi) if closed else (keys < hi))]
+
+    while True:
+        count, kmin, kmax, finite_max = 0, np.inf, -np.inf, -np.inf
+        for keys in scan():
+            keys = within(keys)
+            if len(keys):
+                count, kmin, kmax = count + len(keys), min(kmin, keys.min()), max(kmax, keys.max())
+                finite_max = max(finite_max, keys[np.isfinite(keys)].max(initial = -np.inf))
+
+        if kmin == kmax:
+            return kmin, below
+        if count <= limit:
+            keys = np.sort(np.concatenate([within(keys) for keys in scan()]))
+            key = keys[rank - below]
+            return key, below + int(np.searchsorted(keys, key, side = 'left'))
+
+        # missing values (inf keys, last in order) are left out of bins over finite keys
+        counts = np.zeros(PAGE_HISTOGRAM_BINS, dtype = 'int64')
+        for keys in scan():
+            keys = within(keys)
+            counts += np.histogram(keys[np.isfinite(keys)], bins = PAGE_HISTOGRAM_BINS, range = (kmin, finite_max))[0]
+
+        cumulative = np.cumsum(counts)
+        if rank - below >= cumulative[-1]:
+            return np.inf, below + int(cumulative[-1])
+
+        edges = np.histogram_bin_edges([], bins = PAGE_HISTOGRAM_BINS, range = (kmin, finite_max))
+        b = int(np.searchsorted(cumulative, rank - below, side = 'right'))
+        below += int(cumulative[b - 1]) if b > 0 else 0
+        lo, hi, closed = edges[b], edges[b + 1], b == PAGE_HISTOGRAM_BINS - 1
+
+
+def best_positions(scan, k: int, key: float = -np.inf, skip: int = 0) -> tuple:
+    """
+    Positions (in order of rows of all chunks of `scan`) of `k` rows with the smallest keys in sorted order, starting at
+    rows with `key` after the first `skip` of them, and numbers of rows of chunks. Only keys and positions of `k` best
+    rows are kept between chunks.
+    """
+    best_keys, best = np.array([]), np.array([], dtype = 'int64')
+    counts, ties = [], 0
+
+    for keys in scan():
+        equal = keys == key
+        tie_ranks = ties + np.cumsum(equal) - 1
+        ties += int(equal.sum())
+        selected = np.flatnonzero((keys > key) | (equal & (tie_ranks >= skip)))
+
+        candidates = np.concatenate([best_keys, keys[selected]])
+        positions = np.concatenate([best, sum(counts) + selected])
+        top = top_positions(candidates, min(k, len(candidates)))
+        best_keys, best = candidates[top], positions[top]
+        counts.append(len(keys))
+
+    return best, np.array(counts, dtype = 'int64')
+
+
+def page_of_dataset(dataset, columns: list, filters: list, sort_by: str = None, ascending: bool = True,
+                    offset: int = 0, limit: int = PAGE_SIZE) -> tuple:
+    """
+    Page of rows of Parquet `dataset` (pyarrow) matching `filters` and number of all matching rows, with memory and
+    work per request that do not grow with the page number.
+
+    Fragments (files) are scanned one by one for positions of rows of the page: without sorting from counts of their
+    matching rows, with sorting from keys of `sort_by` column only - by a single pass keeping `offset` + `limit` best keys
+    for pages near the top, or by finding the key of the first row of the page (see `key_of_rank`) and then the
+    `limit` best keys from it. Only rows of the page are then read from their fragments.
+    """
+    expression = pq.filters_to_expression(filters) if filters else None
+    fragments = list(dataset.get_fragments(filter = expression))
+
+    if sort_by is None:
+        counts = np.array([fragment.count_rows(filter = expression) for fragment in fragments], dtype = 'int64')
+        total = int(counts.sum())
+        positions = np.arange(offset, min(offset + limit, total))
+    else:
+        categories = None
+        if isinstance(dataset.schema.field(sort_by).type, pa.DictionaryType):
+            values = set()
+            for fragment in fragments:
+                values.update(fragment.to_table(columns = [sort_by], filter = expression).column(0).to_pandas().cat.categories)
+            categories = pd.Index(sorted(values))
+
+        scan = lambda: dataset_keys(fragments, sort_by, expression, ascending, categories)
+        top = offset + limit <= PAGE_KEYS_LIMIT
+        positions, counts = best_positions(scan, offset + limit if top else limit)
+        total = int(counts.sum())
+
+        if top:
+            positions = positions[offset:]
+        elif offset >= total:
+            positions = np.array([], dtype = 'int64')
+        else:
+            key, below = key_of_rank(scan, offset)
+            positions, _ = best_positions(scan, limit, key, offset - below)
+
+    if not len(positions):
+        return pd.DataFrame(columns = columns), total
+
+    # rows of the page are taken from their fragments, then put back into order of the page
+    bases = np.cumsum(counts) - counts
+    owners = np.searchsorted(bases, positions, side = 'right') - 1
+    order = np.argsort(owners, kind = 'stable')
+    parts = [fragments[owner].take(positions[order][owners[order] == owner] - bases[owner], columns = columns, filter = expression).to_pandas()
+             for owner in np.unique(owners)]
+
+    return concat_flights(parts).iloc[np.argsort(order)].reset_index(drop = True), total
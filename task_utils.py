@@ -0,0 +1,48 @@
+"""
+This file contains the worker pool running heavy computations of the application off the Shiny event loop.
+
+All sessions of a worker process share its event loop, so a slow summary computed in a reactive calc stalls every
+session. Extended tasks of the app await `run_in_pool` instead - the computation runs in a thread of TASK_POOL
+while the event loop keeps serving other sessions. Threads (not processes) share loaded data and RESULT_CACHE,
+and numpy, pandas and query engines release the GIL in their heavy loops.
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics_utils import profiled_task
+
+
+#################################################################################
+
+# Variables
+
+TASK_WORKERS = int(os.environ.get('FLIGHTS_TASK_WORKERS', min(4, os.cpu_count() or 1))) # threads of TASK_POOL
+
+TASK_POOL = ThreadPoolExecutor(max_workers = TASK_WORKERS, thread_name_prefix = 'flights-task') # shared by all sessions
+
+
+#################################################################################
+# Functions
+
+async def run_in_pool(function, *args, **kwargs):
+    """
+    Await `function(*args, **kwargs)` computed in TASK_POOL.
+
+    Cancelling the awaiting task drops a call still waiting in the pool. A computation that already started
+    cannot be interrupted - it runs to the end and its result only fills RESULT_CACHE. Calls are added to profile
+    capture of Diagnostics panel while it runs (see `metrics_utils.profiled_task`).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(TASK_POOL, profiled_task(functools.partial(function, *args, **kwargs)))
+
+
+def restart_task(task, *args) -> None:
+    """
+    Invoke extended `task` (shiny.reactive.ExtendedTask) with `args`, cancelling its invocations in progress
+    or queued - they are superseded by this one.
+    """
+    task.cancel()
+    task.invoke(*args)
@@ -1,7 +1,29 @@
+import numpy as np
 import pandas as pd
-import plotly.express as px
-from pandas.api.types import is_numeric_dtype
+from pandas.api.types import is_integer_dtype, is_numeric_dtype
+import logging
 import os
+import sys
+import threading
+import time
+
+from storage_utils import FLIGHTS_DTYPES, ensure_flights_store, read_flights_store, iter_flights_store, count_flights_store, store_files, store_version, store_months
+from aggregate_utils import MEAN_COLS, SAMPLE_SIZE, routes_from_origin, aggregate_flights_chunks, merge_flights_aggregates
+from engine_utils import create_engine
+from geo_utils import build_coords_index, AirportGrid
+from stats_utils import GRID_BINS, histogram_edges, count_values, grid_counts
+from table_utils import PAGE_SIZE
+from cube_utils import CUBE_COLUMNS, aggregate_cube_chunks, merge_cube_aggregates, roll_up_routes
+from network_utils import RouteGraph, route_index_edges, cube_edges
+from sketch_utils import SKETCH_COLUMNS, SKETCH_FLIGHTS_COLUMNS, aggregate_sketch_chunks, merge_sketch_aggregates, sketch_quantiles, sketch_histogram
+from shared_utils import shared_lock
+from cache_utils import RESULT_CACHE, cached
+from context_utils import LazyContext
+from metrics_utils import instrument_module, instrument_altair, start_metrics_log
+
+
+logger = logging.getLogger(__name__)
+
 #################################################################################
 
 # Variables and data
@@ -10,12 +32,116 @@ DIR_PATH = os.path.dirname(os.path.realpath(__file__)) # path of directory to th
 DATASET_SOURCE = 'https://www.kaggle.com/datasets/patrickzel/flight-delay-and-cancellation-dataset-2019-2023'
 
 
-FLIGHTS = pd.read_csv(DIR_PATH + '/dataset/flights_tiny.csv', on_bad_lines='skip')
-CODES = pd.read_csv(DIR_PATH + '/dataset/airports_codes.csv', sep = ';', on_bad_lines='skip')
-
-FLIGHTS = FLIGHTS.iloc[:, 1:]
-FLIGHTS_SAMPLE = FLIGHTS.sample(n = 1000, random_state=2024)
-NUMERIC_COLS = list(FLIGHTS.select_dtypes(include=['number']).drop(['CANCELLED', 'DIVERTED', 'DOT_CODE', 'FL_NUMBER'], axis  = 1).columns)
+FLIGHTS_CSV = os.environ.get('FLIGHTS_CSV', DIR_PATH + '/dataset/flights_tiny.csv')
+FLIGHTS_STORE = os.environ.get('FLIGHTS_STORE', DIR_PATH + '/dataset/flights_store') # typed Parquet copy of FLIGHTS_CSV, built on first run
+
+# 'pandas', 'polars' or 'duckdb' - engine computing aggregates of flights (see engine_utils)
+FLIGHTS_ENGINE = os.environ.get('FLIGHTS_ENGINE', 'pandas')
+
+# Only for 'pandas' engine:
+# 'memory' - whole FLIGHTS frame is held in memory,
+# 'shared' - FLIGHTS is mapped from Arrow files in FLIGHTS_SHARED, one copy shared by all worker processes,
+# 'streaming' - flights are read in chunks and only their aggregates are kept (for the full dataset)
+FLIGHTS_LOADING = os.environ.get('FLIGHTS_LOADING', 'memory')
+FLIGHTS_SHARED = os.environ.get('FLIGHTS_SHARED', DIR_PATH + '/dataset/flights_shared')
+
+# Flights appended to FLIGHTS_STORE (see ingest.py) are merged into loaded data without restart
+FLIGHTS_WATCH = float(os.environ.get('FLIGHTS_WATCH', '30')) # seconds between checks of FLIGHTS_STORE, 0 - off
+DATA_POLL_INTERVAL = 2 # seconds between checks of sessions for newly published data
+
+NON_ANALYZED_COLS = ['CANCELLED', 'DIVERTED', 'DOT_CODE', 'FL_NUMBER'] # numeric codes and flags left out of Data tab
+# Known from schema, without loading flights
+FLIGHTS_COLUMNS = list(FLIGHTS_DTYPES)
+FLIGHTS_NUMERIC_COLS = [col for col, dtype in FLIGHTS_DTYPES.items() if dtype != 'category']
+NUMERIC_COLS = [col for col in FLIGHTS_NUMERIC_COLS if col not in NON_ANALYZED_COLS]
+
+NEARBY_AIRPORTS_MILES = 50 # radius of nearby airports listed in popups of the map
+
+NETWORK_MAX_STOPS = 2 # connections with more stops are not listed
+CONNECTIONS_LIMIT = 100 # shortest connections listed
+
+XY_POINTS_THRESHOLD = 5000 # above this number of points Interactions tab shows density grid instead of scatter
+ZOOM_STEPS = 32 # zoomed ranges of density grid are snapped to steps of at least 1/ZOOM_STEPS of their width (see `snap_range`)
+ZOOM_DEBOUNCE = 0.3 # seconds without zoom or pan of density grid before the zoomed grid is computed
+
+# Modules needed only by charts, imported during warm-up instead of at startup
+WARM_UP_IMPORTS = ['altair', 'anywidget', 'jsonschema', 'toolz']
+
+
+def load_store() -> str:
+    """
+    Convert FLIGHTS_CSV into FLIGHTS_STORE if it is missing or stale and return path of the store.
+
+    The engine and values read from the store without it (e.g. MONTHS) load the store first, so it is converted once
+    per process - and under the lock of FLIGHTS_SHARED, like by the engine, when workers share flights.
+    """
+    if FLIGHTS_ENGINE == 'pandas' and FLIGHTS_LOADING == 'shared':
+        with shared_lock(FLIGHTS_SHARED):
+            ensure_flights_store(FLIGHTS_CSV, FLIGHTS_STORE)
+    else:
+        ensure_flights_store(FLIGHTS_CSV, FLIGHTS_STORE)
+
+    return FLIGHTS_STORE
+
+
+def load_engine():
+    DATA.STORE # converted before the engine reads it
+    engine = create_engine(FLIGHTS_ENGINE, FLIGHTS_CSV, FLIGHTS_STORE, loading = FLIGHTS_LOADING, sample_size = SAMPLE_SIZE, shared_path = FLIGHTS_SHARED)
+    RESULT_CACHE.set_version(engine.version) # results of other dataset versions are dropped
+    return engine
+
+
+def load_description_html():
+    with open(DIR_PATH + '/dataset/dictionary_nicer.html', 'r') as f:
+        return f.read()
+
+
+# Data of the application, loaded on first access or by warm-up after startup.
+# Values are also available as attributes of this module (e.g. utils.ROUTES), which loads them.
+DATA = LazyContext()
+DATA.register('STORE', load_store)
+DATA.register('ORIGIN_AIRPORTS', lambda: load_origin_airports()) # only two columns of the store - stays on critical path
+DATA.register('MONTHS', lambda: store_months(DATA.STORE)) # first and last month of flights, from Parquet metadata - stays on critical path
+DATA.register('DESCRIPTION_HTML', load_description_html)
+DATA.register('CODES', lambda: pd.read_csv(DIR_PATH + '/dataset/airports_codes.csv', sep = ';', on_bad_lines='skip'))
+DATA.register('AIRPORT_COORDS', lambda: build_coords_index(DATA.CODES)) # coordinates keyed by Airport Code
+DATA.register('AIRPORT_GRID', lambda: AirportGrid(DATA.AIRPORT_COORDS)) # spatial index behind nearby airports and map bounds queries
+DATA.register('ENGINE', load_engine)
+DATA.register('DATASET_VERSION', lambda: DATA.ENGINE.version)
+DATA.register('FLIGHTS', lambda: DATA.ENGINE.flights) # None unless held in memory by pandas engine
+DATA.register('FLIGHTS_SAMPLE', lambda: DATA.ENGINE.sample(SAMPLE_SIZE))
+DATA.register('ROUTES', lambda: DATA.ENGINE.route_index()) # (ORIGIN, DEST) aggregates behind summaries of Flights tab
+DATA.register('STATISTICS', lambda: DATA.ENGINE.column_statistics(FLIGHTS_NUMERIC_COLS)) # co-moments, min, max and value counts behind Data tab statistics and chart ranges
+DATA.register('CUBE', lambda: aggregate_cube_chunks(DATA.ENGINE.iter_chunks(CUBE_COLUMNS))) # (ORIGIN, DEST, AIRLINE, MONTH) cells behind filters of Flights tab
+DATA.register('SKETCHES', lambda: aggregate_sketch_chunks(DATA.ENGINE.iter_chunks(SKETCH_FLIGHTS_COLUMNS))) # quantile sketches of delays and durations per route and airline
+
+# Values merged with aggregates of appended flights (see `ingest_appended_flights`): {value: aggregate}
+APPENDED_AGGREGATES = {'ROUTES': 'routes', 'STATISTICS': 'statistics', 'FLIGHTS_SAMPLE': 'sample'}
+INGEST_LOCK = threading.Lock() # one ingestion at a time
+
+
+def __getattr__(name: str):
+    if name in DATA:
+        return getattr(DATA, name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+# Panels of route statistics in Flights tab: {panel: {column: route index aggregate}}
+SUMMARY_PANELS = {
+    'airports': {
+        'AIRLINE': 'AIRLINE_unique',
+        'AIRLINE_DOT': 'AIRLINE_DOT_unique',
+        'AIRLINE_CODE': 'AIRLINE_CODE_unique',
+        'DOT_CODE': 'DOT_CODE_first',
+        'ORIGIN_CITY': 'ORIGIN_CITY_first',
+        'DEST_CITY': 'DEST_CITY_first'
+    },
+    'times': {col: f'{col}_mean' for col in ['CRS_DEP_TIME', 'DEP_TIME', 'DEP_DELAY', 'CRS_ARR_TIME', 'ARR_TIME', 'ARR_DELAY']},
+    'in_flight_times': {col: f'{col}_mean' for col in ['TAXI_OUT', 'WHEELS_OFF', 'WHEELS_ON', 'TAXI_IN', 'AIR_TIME']},
+    'duration_distance': {col: f'{col}_mean' for col in ['CRS_ELAPSED_TIME', 'ELAPSED_TIME', 'DISTANCE']},
+    'flight_status': {col: f'{col}_sum' for col in ['CANCELLED', 'DIVERTED']}
+}
+SUMMARY_FLOAT_COLS = ['CANCELLED', 'DIVERTED'] # 0.0/1.0 in CSV, so their sums are floats
 
 
 # Color map of Airlines in dataset
@@ -41,131 +167,430 @@ AIRLINE_COLORS = {
 }
 
 
-with open(DIR_PATH + '/dataset/dictionary_nicer.html', 'r') as f:
-    DESCRIPTION_HTML = f.read()
-
-
 #################################################################################
 # Functions
 
-def summarize_routes_from_origin(flights:pd.DataFrame, origin: str) -> pd.DataFrame:
-    filtered_flights = flights[flights['ORIGIN'] == origin]
-
-    # dest = row['DEST']
-    # origin_city = row['ORIGIN_CITY']
-    # airline = row['AIRLINE']
-    # dest_city = row['DEST_CITY']
-    # distance = row['mean_distance']
-
-    summary = filtered_flights.groupby('DEST').agg(
-                                        ORIGIN = ('ORIGIN', 'first'),
-                                        ORIGIN_CITY=('ORIGIN_CITY', 'first'),
-                                        DEST_CITY=('DEST_CITY', 'first'),
-                                        AIRLINE = ('AIRLINE', 'first'),
-                                        mean_crs_dep_time=('CRS_DEP_TIME', 'mean'),
-                                        mean_dep_time=('DEP_TIME', 'mean'),
-                                        mean_dep_delay=('DEP_DELAY', 'mean'),
-                                        mean_taxi_out=('TAXI_OUT', 'mean'),
-                                        mean_wheels_off=('WHEELS_OFF', 'mean'),
-                                        mean_wheels_on=('WHEELS_ON', 'mean'),
-                                        mean_taxi_in=('TAXI_IN', 'mean'),
-                                        mean_crs_arr_time=('CRS_ARR_TIME', 'mean'),
-                                        mean_arr_time=('ARR_TIME', 'mean'),
-                                        mean_arr_delay=('ARR_DELAY', 'mean'),
-                                        mean_cancelled=('CANCELLED', 'mean'),
-                                        mean_diverted=('DIVERTED', 'mean'),
-                                        mean_crs_elapsed_time=('CRS_ELAPSED_TIME', 'mean'),
-                                        mean_elapsed_time=('ELAPSED_TIME', 'mean'),
-                                        mean_air_time=('AIR_TIME', 'mean'),
-                                        mean_distance=('DISTANCE', 'mean'),
-                                        ).reset_index()
-    
+@cached(RESULT_CACHE)
+def filter_routes(origin: str, months: tuple = None, airlines: tuple = ()) -> pd.DataFrame:
+    """
+    Route aggregates of flights from `origin` within `months` ('YYYY-MM' first and last) by `airlines` (all if empty),
+    rolled up from cube (see `cube_utils.roll_up_routes`). Without filters this is the route index of all flights.
+    """
+    if covers_all_flights(months, airlines):
+        return DATA.ROUTES
+
+    return roll_up_routes(DATA.CUBE, DATA.ROUTES, origin, months, airlines)
+
+
+def covers_all_flights(months: tuple = None, airlines: tuple = ()) -> bool:
+    """
+    True if filters of Flights tab select all flights, which are summarized by route index.
+    """
+    first, last = DATA.MONTHS
+    return not airlines and (months is None or (months[0] <= first and months[1] >= last))
+
+
+@cached(RESULT_CACHE)
+def summarize_routes_from_origin(routes: pd.DataFrame, origin: str) -> pd.DataFrame:
+    """
+    Summary of every route from `origin`, served from route index (see `build_route_index`).
+    """
+    filtered_routes = routes_from_origin(routes, origin)
+
+    summary = filtered_routes.index.to_frame(index = False)[['DEST', 'ORIGIN']]
+    summary['ORIGIN_CITY'] = filtered_routes['ORIGIN_CITY_first'].values
+    summary['DEST_CITY'] = filtered_routes['DEST_CITY_first'].values
+    summary['AIRLINE'] = filtered_routes['AIRLINE_first'].values
+
+    for col in MEAN_COLS: # every mean of route index is drawn on the map
+        summary[f'mean_{col.lower()}'] = filtered_routes[f'{col}_mean'].values
+
+    return summary_dtypes(summary)
+
+
+@cached(RESULT_CACHE)
+def summarize_from_origin(routes: pd.DataFrame, origin: str):
+    """
+    Statistics of every route from `origin` split into panels of Flights tab, served from route index.
+    """
+    filtered_routes = routes_from_origin(routes, origin)
+    keys = filtered_routes.index.to_frame() # ORIGIN and DEST lead every panel
+
+    summary = {}
+    for panel, columns in SUMMARY_PANELS.items():
+        panel_summary = keys.assign(**{col: filtered_routes[aggregate] for col, aggregate in columns.items()})
+        summary[panel] = summary_dtypes(panel_summary.set_axis(filtered_routes.index.get_level_values('DEST').astype(object)))
 
     return summary
 
 
-def summarize_from_origin(flights: pd.DataFrame, origin: str):
-    filtered_flights = flights[flights['ORIGIN'] == origin]
-    
-    flights_groups = filtered_flights.groupby('DEST')
-
-    # Group: Airline and Airport Information
-    summary_airports = flights_groups.agg(
-        ORIGIN=('ORIGIN', 'first'),
-        DEST=('DEST', 'first'),
-        AIRLINE=('AIRLINE', lambda x: ', '.join(x.unique())),
-        AIRLINE_DOT=('AIRLINE_DOT', lambda x: ', '.join(x.unique())),
-        AIRLINE_CODE=('AIRLINE_CODE', lambda x: ', '.join(x.unique())),
-        DOT_CODE=('DOT_CODE', 'first'),
-        ORIGIN_CITY=('ORIGIN_CITY', 'first'),
-        DEST_CITY=('DEST_CITY', 'first')
-    )
-
-    # Group: Departure and Arrival Times
-    summary_times = flights_groups.agg({
-        'ORIGIN': 'first',
-        'DEST': 'first',
-        'CRS_DEP_TIME': 'mean',
-        'DEP_TIME': 'mean',
-        'DEP_DELAY': 'mean',
-        'CRS_ARR_TIME': 'mean',
-        'ARR_TIME': 'mean',
-        'ARR_DELAY': 'mean'
-    })
+def summary_dtypes(summary: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cast columns of `summary` to dtypes of summaries of flights read from CSV: strings are objects and numbers are 64-bit.
+    """
+    dtypes = {}
+    for col, dtype in summary.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            dtypes[col] = object
+        elif col in SUMMARY_FLOAT_COLS:
+            dtypes[col] = 'float64'
+        elif is_numeric_dtype(dtype):
+            dtypes[col] = 'int64' if is_integer_dtype(dtype) else 'float64'
 
-    # Group: In-Flight Times
-    summary_in_flight_times = flights_groups.agg({
-        'ORIGIN': 'first',
-        'DEST': 'first',
-        'TAXI_OUT': 'mean',
-        'WHEELS_OFF': 'mean',
-        'WHEELS_ON': 'mean',
-        'TAXI_IN': 'mean',
-        'AIR_TIME': 'mean'
-    })
+    return summary.astype(dtypes)
 
-    # Group: Flight Duration and Distance
-    summary_duration_distance = flights_groups.agg({
-        'ORIGIN': 'first',
-        'DEST': 'first',
-        'CRS_ELAPSED_TIME': 'mean',
-        'ELAPSED_TIME': 'mean',
-        'DISTANCE': 'mean'
-    })
 
-    # Group: Flight Status
-    summary_flight_status = flights_groups.agg({
-        'ORIGIN': 'first',
-        'DEST': 'first',
-        'CANCELLED': 'sum',
-        'DIVERTED': 'sum'
+def percentiles_frame(sketches: pd.DataFrame) -> pd.DataFrame:
+    """
+    Percentiles ('<COLUMN>_p50', ...) of SKETCH_COLUMNS from every sketch of `sketches` (see `sketch_utils`).
+    """
+    percentiles = pd.concat({col: sketch_quantiles(sketches, col) for col in SKETCH_COLUMNS}, axis = 1)
+    percentiles.columns = [f'{col}_{name}' for col, name in percentiles.columns]
+
+    return percentiles
+
+
+@cached(RESULT_CACHE)
+def route_percentiles(origin: str) -> pd.DataFrame:
+    """
+    Percentiles of delays and durations of every route from `origin` over all flights, indexed by DEST.
+    """
+    return percentiles_frame(routes_from_origin(DATA.SKETCHES['routes'], origin).droplevel('ORIGIN'))
+
+
+@cached(RESULT_CACHE)
+def airline_percentiles() -> pd.DataFrame:
+    """
+    Percentiles of delays and durations of every airline over all flights, indexed by AIRLINE.
+    """
+    return percentiles_frame(DATA.SKETCHES['airlines'])
+
+
+@cached(RESULT_CACHE)
+def origin_distribution(origin: str, column: str) -> tuple:
+    """
+    Distribution of `column` of all flights from `origin` up to its p99 (see `sketch_utils.sketch_histogram`)
+    and its percentiles, from sketches of its routes merged into one.
+    """
+    sketch = routes_from_origin(DATA.SKETCHES['routes'], origin)[column].groupby(level = 'BUCKET').sum()
+    percentiles = sketch_quantiles(sketch.to_frame(), column).iloc[0]
+
+    return sketch_histogram(sketch, upper = percentiles['p99']), percentiles
+
+
+@cached(RESULT_CACHE)
+def route_graph(months: tuple = None, airlines: tuple = ()) -> RouteGraph:
+    """
+    Graph of routes of flights within `months` by `airlines` (see `network_utils.RouteGraph`), built from route index
+    or, with filters, from cube.
+    """
+    if covers_all_flights(months, airlines):
+        return RouteGraph(route_index_edges(DATA.ROUTES))
+
+    return RouteGraph(cube_edges(DATA.CUBE['cube'], months, airlines))
+
+
+@cached(RESULT_CACHE)
+def find_connections(origin: str, dest: str, months: tuple = None, airlines: tuple = ()) -> pd.DataFrame:
+    """
+    Shortest connections from `origin` to `dest` with up to NETWORK_MAX_STOPS stops.
+    """
+    return route_graph(months, airlines).connections(origin, dest, NETWORK_MAX_STOPS, CONNECTIONS_LIMIT)
+
+
+@cached(RESULT_CACHE)
+def find_path(origin: str, dest: str, weight: str = 'distance', months: tuple = None, airlines: tuple = ()) -> pd.DataFrame:
+    """
+    Legs of the path from `origin` to `dest` with the least total `weight` ('distance' or 'delay').
+    """
+    return route_graph(months, airlines).shortest_path(origin, dest, weight)
+
+
+@cached(RESULT_CACHE)
+def hub_centrality(months: tuple = None, airlines: tuple = ()) -> pd.DataFrame:
+    """
+    Hub statistics of airports, most central first (see `network_utils.RouteGraph.centrality`).
+    """
+    return route_graph(months, airlines).centrality()
+
+
+def network_summary(origin: str, network: tuple, months: tuple = None, airlines: tuple = ()) -> pd.DataFrame:
+    """
+    Table of network mode of the map: connections from `origin` for ('connections', dest, weight) with the best path
+    computed alongside, hub statistics for ('hubs',).
+    """
+    if network[0] == 'connections':
+        _, dest, weight = network
+        find_path(origin, dest, weight, months, airlines)
+        return find_connections(origin, dest, months, airlines)
+
+    return hub_centrality(months, airlines)
+
+
+@cached(RESULT_CACHE)
+def describe_columns(columns: tuple) -> pd.DataFrame:
+    """
+    Descriptive statistics of numeric `columns` over all flights for Data tab (quartiles are exact for whole numbers).
+    """
+    return DATA.STATISTICS.select(list(columns)).describe()
+
+
+@cached(RESULT_CACHE)
+def correlate_columns(columns: tuple) -> pd.DataFrame:
+    """
+    Correlation matrix of numeric `columns` over all flights for Data tab.
+    """
+    return DATA.STATISTICS.select(list(columns)).correlation()
+
+
+@cached(RESULT_CACHE)
+def distribution_counts(var: str, color: str = None) -> pd.DataFrame:
+    """
+    Counts behind Distributions tab chart of `var` over all flights, per value of `color` (unless None or `var`).
+
+    Numeric `var` is binned (columns `var` and '<var>_end' are edges of bins), other variables are counted
+    by value. Only counts are sent to the chart, so its size does not grow with number of flights.
+    """
+    color = None if color == var else color
+    edges = None
+    if FLIGHTS_DTYPES[var] != 'category':
+        edges = histogram_edges(*DATA.STATISTICS.bounds(var))
+
+    chunks = DATA.ENGINE.iter_chunks([var] if color is None else [var, color])
+    counts = count_values(chunks, var, color, edges).rename('count').reset_index()
+
+    if edges is not None:
+        counts[f'{var}_end'] = counts[var] + (edges[1] - edges[0])
+
+    return counts
+
+
+def xy_point_count(var1: str, var2: str) -> int:
+    """
+    Number of flights where both `var1` and `var2` are present (points of their scatter plot).
+    """
+    return int(DATA.STATISTICS.select([var1, var2]).n[0, 1])
+
+
+@cached(RESULT_CACHE)
+def xy_points(var1: str, var2: str) -> pd.DataFrame:
+    """
+    All flights with `var1` and `var2`, for scatter plot of a small dataset.
+    """
+    return pd.concat(DATA.ENGINE.iter_chunks(list(dict.fromkeys([var1, var2])))).dropna()
+
+
+def density_grid(var1: str, var2: str, x_range: tuple = None, y_range: tuple = None, bins: int = GRID_BINS) -> pd.DataFrame:
+    """
+    Number of flights in cells of `bins` x `bins` grid of `var1` and `var2` within `x_range` and `y_range`
+    (whole range of data by default). Columns 'x', 'x_end' (`var1`) and 'y', 'y_end' (`var2`) are edges of cells.
+    Empty cells are left out.
+    """
+    x_range = x_range or DATA.STATISTICS.bounds(var1)
+    y_range = y_range or DATA.STATISTICS.bounds(var2)
+    x_edges = np.linspace(x_range[0], x_range[1] if x_range[1] > x_range[0] else x_range[0] + 1, bins + 1)
+    y_edges = np.linspace(y_range[0], y_range[1] if y_range[1] > y_range[0] else y_range[0] + 1, bins + 1)
+
+    counts = grid_counts(DATA.ENGINE.iter_chunks(list(dict.fromkeys([var1, var2]))), var1, var2, x_edges, y_edges)
+    x_cells, y_cells = np.nonzero(counts)
+
+    return pd.DataFrame({
+        'x': x_edges[x_cells], 'x_end': x_edges[x_cells + 1],
+        'y': y_edges[y_cells], 'y_end': y_edges[y_cells + 1],
+        'count': counts[x_cells, y_cells]
     })
 
-    # Combine all summaries into a single dictionary
-    summary = {
-        'airports': summary_airports,
-        'times': summary_times,
-        'in_flight_times': summary_in_flight_times,
-        'duration_distance': summary_duration_distance,
-        'flight_status': summary_flight_status
-    }
 
-    return summary
+@cached(RESULT_CACHE)
+def xy_density(var1: str, var2: str) -> pd.DataFrame:
+    """
+    Density grid of `var1` and `var2` over whole range of data (see `density_grid`), shared by all sessions.
+    """
+    return density_grid(var1, var2)
 
 
-def get_origins(flights):
-    originandcity = flights['ORIGIN'] + ', ' + flights['ORIGIN_CITY']
-    return originandcity.unique().tolist()
+def snap_range(value_range: tuple, data_range: tuple) -> tuple:
+    """
+    `value_range` widened to multiples of a step from start of `data_range`. The step is width of `data_range` divided
+    by a power of two, between 1/ZOOM_STEPS and 2/ZOOM_STEPS of width of `value_range` - close zooms and pans
+    get the same range.
+    """
+    start, end = value_range
+    data_width = data_range[1] - data_range[0]
+    if not end > start or not data_width > 0:
+        return tuple(value_range)
 
-def get_dests(flights):
-    return flights['DEST'].unique().tolist()
+    step = data_width / 2.0 ** max(0, np.floor(np.log2(data_width * ZOOM_STEPS / (end - start))))
+    return (float(data_range[0] + np.floor((start - data_range[0]) / step) * step),
+            float(data_range[0] + np.ceil((end - data_range[0]) / step) * step))
 
 
-def get_coords(codes, airport):
-    coords = codes.loc[codes['Airport Code'] == airport][['Latitude', 'Longitude']].iloc[0].to_dict()
+@cached(RESULT_CACHE)
+def snapped_density(var1: str, var2: str, x_range: tuple, y_range: tuple) -> pd.DataFrame:
+    """
+    Density grid of snapped ranges (see `zoomed_density`), shared by all sessions.
+    """
+    return density_grid(var1, var2, x_range, y_range)
 
-    return coords
 
+def zoomed_density(var1: str, var2: str, x_range: tuple, y_range: tuple) -> pd.DataFrame:
+    """
+    Density grid of `var1` and `var2` covering `x_range` and `y_range` of a zoomed chart. Ranges are snapped
+    (see `snap_range`), so grids of close zooms are shared in RESULT_CACHE.
+    """
+    x_range = snap_range(x_range, DATA.STATISTICS.bounds(var1))
+    y_range = snap_range(y_range, DATA.STATISTICS.bounds(var2))
+
+    return snapped_density(var1, var2, x_range, y_range)
+
+
+@cached(RESULT_CACHE)
+def flights_page(filters: tuple, sort_by: str = None, ascending: bool = True, page: int = 1) -> tuple:
+    """
+    Page (numbered from 1) of flights matching `filters` for Raw data table, sorted by `sort_by` (order of dataset
+    if None), and number of all matching flights. `filters` are (column, operator, value) conditions (see `table_utils`).
+    """
+    return DATA.ENGINE.page(list(filters), sort_by, ascending, offset = (page - 1) * PAGE_SIZE, limit = PAGE_SIZE)
+
+
+def months_dates(months: tuple) -> tuple:
+    """
+    First day of the first month and last day of the last month of `months` ('YYYY-MM' first and last).
+    """
+    return f'{months[0]}-01', pd.Period(months[1]).end_time.strftime('%Y-%m-%d')
+
+
+def get_origins(flights: pd.DataFrame) -> list:
+    """
+    Origins ('<ORIGIN>, <ORIGIN_CITY>') of `flights` in order of first appearance.
+    """
+    # deduplicate before concatenating - ORIGIN and ORIGIN_CITY are categoricals
+    origins = flights[['ORIGIN', 'ORIGIN_CITY']].drop_duplicates()
+    return (origins['ORIGIN'].astype(str) + ', ' + origins['ORIGIN_CITY'].astype(str)).tolist()
+
+
+def load_origin_airports() -> list:
+    """
+    Origins of all flights of the store in order of first appearance, out of its ORIGIN and ORIGIN_CITY columns
+    read in chunks - without waiting for the engine.
+    """
+    origins = {}
+    for chunk in iter_flights_store(DATA.STORE, ['ORIGIN', 'ORIGIN_CITY']):
+        origins.update(dict.fromkeys(get_origins(chunk))) # known origins keep their position
+
+    return list(origins)
+
+def get_dests(flights):
+    return flights['DEST'].unique().tolist()
 
 
-ORIGIN_AIRPORTS = get_origins(FLIGHTS)
\ No newline at end of file
+def get_coords(coords: pd.DataFrame, airport: str) -> dict:
+    """
+    Coordinates of `airport` from keyed coordinates index (see `build_coords_index`).
+    Raises KeyError if there are no coordinates for airport.
+    """
+    try:
+        return coords.loc[airport].to_dict()
+    except KeyError:
+        raise KeyError(f'No coordinates for airport {airport}') from None
+
+
+def nearby_airports(airport: str, miles: float = NEARBY_AIRPORTS_MILES) -> pd.Series:
+    """
+    Distances (miles) of other airports within `miles` of `airport`, nearest first (see `geo_utils.AirportGrid`).
+    Raises KeyError if there are no coordinates for airport.
+    """
+    coords = get_coords(DATA.AIRPORT_COORDS, airport)
+    nearby = DATA.AIRPORT_GRID.within(coords['Latitude'], coords['Longitude'], miles)
+
+    return nearby[nearby.index != airport]
+
+
+def ingest_appended_flights() -> bool:
+    """
+    Merge flights appended to FLIGHTS_STORE since they were loaded (see `storage_utils.append_flights_store`)
+    into data of the application and publish them as a new dataset version, without restart.
+
+    Only appended files are read. Their partial aggregates (sums and counts of routes, distinct airlines,
+    co-moments and value counts of columns, cube cells, quantile sketches, sample) are merged into loaded values, new origins are added
+    to ORIGIN_AIRPORTS. Values not loaded yet are computed by their loaders over the whole store.
+    Returns False if nothing was appended.
+    """
+    with INGEST_LOCK:
+        engine = DATA.ENGINE
+        version = store_version(FLIGHTS_STORE)
+        files = store_files(FLIGHTS_STORE)
+        if not set(engine.files) <= set(files):
+            logger.warning('Flights store %s was rewritten, restart the application to load it', FLIGHTS_STORE)
+            return False
+
+        files = [file for file in files if file not in set(engine.files)]
+        if not files:
+            return False
+
+        start = time.perf_counter()
+        flights = read_flights_store(FLIGHTS_STORE, files = files)
+        aggregates = aggregate_flights_chunks([flights], sample_size = SAMPLE_SIZE)
+        rows = count_flights_store(FLIGHTS_STORE, files = engine.files)
+        engine.append(flights, aggregates, files, version)
+
+        current = {aggregate: getattr(DATA, name) for name, aggregate in APPENDED_AGGREGATES.items() if DATA.is_loaded(name)}
+        appended = {**aggregates, 'statistics': aggregates['statistics'].select(FLIGHTS_NUMERIC_COLS)}
+        merged = merge_flights_aggregates([{**current, 'rows': rows}, appended])
+        values = {name: merged[aggregate] for name, aggregate in APPENDED_AGGREGATES.items() if aggregate in current}
+
+        if DATA.is_loaded('CUBE'):
+            values['CUBE'] = merge_cube_aggregates([DATA.CUBE, aggregate_cube_chunks([flights[CUBE_COLUMNS]], start_row = rows)])
+        if DATA.is_loaded('SKETCHES'):
+            values['SKETCHES'] = merge_sketch_aggregates([DATA.SKETCHES, aggregate_sketch_chunks([flights[SKETCH_FLIGHTS_COLUMNS]])])
+        if DATA.is_loaded('ORIGIN_AIRPORTS'):
+            known = set(DATA.ORIGIN_AIRPORTS)
+            values['ORIGIN_AIRPORTS'] = DATA.ORIGIN_AIRPORTS + [origin for origin in get_origins(flights) if origin not in known]
+        if DATA.is_loaded('MONTHS'):
+            values['MONTHS'] = store_months(FLIGHTS_STORE)
+
+        values['FLIGHTS'] = engine.flights
+        values['DATASET_VERSION'] = engine.version
+
+        DATA.publish(values)
+        RESULT_CACHE.set_version(engine.version) # results of previous version are dropped
+        logger.info('Ingested %d flights of %d appended files in %.2f s', len(flights), len(files), time.perf_counter() - start)
+
+        return True
+
+
+def watch_flights_store(interval: float = FLIGHTS_WATCH, after: threading.Thread = None) -> threading.Thread:
+    """
+    Ingest flights appended to FLIGHTS_STORE (see `ingest_appended_flights`) in a daemon thread, which checks version
+    of the store every `interval` seconds (nothing if `interval` is 0). Checks start after thread `after` (warm-up)
+    ends, so that no value is being loaded while appended flights are merged.
+    """
+    if interval <= 0:
+        return None
+
+    def run():
+        if after is not None:
+            after.join()
+        checked = DATA.DATASET_VERSION
+        while True:
+            time.sleep(interval)
+            try:
+                version = store_version(FLIGHTS_STORE)
+                if version != checked:
+                    checked = version
+                    ingest_appended_flights()
+            except Exception:
+                logger.exception('Ingestion of flights appended to %s failed', FLIGHTS_STORE)
+
+    thread = threading.Thread(target = run, name = 'store-watch', daemon = True)
+    thread.start()
+
+    return thread
+
+
+
+instrument_module(sys.modules[__name__]) # latencies of functions above (see metrics_utils)
+start_metrics_log()
+
+WARM_UP = DATA.warm_up(imports = WARM_UP_IMPORTS, hooks = [instrument_altair]) # starts loading as soon as the server imports the app
+watch_flights_store(after = WARM_UP)